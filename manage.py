@@ -14,10 +14,43 @@ def create_db():
     db.create_all()
 
 
+@manager.command
+def repack_lists():
+    """Rewrite the id list columns of existing games from json to packed arrays."""
+    from plyus import db, mutable
+    from plyus.misc import BuildingDeck
+    from plyus.player import Player
+    from plyus.round import Round
+
+    for model in [BuildingDeck, Player, Round]:
+        mutable.repack(db.session, model)
+        db.session.commit()
+
+
 @manager.command
 def run():
     plyus.app.run(debug=True)
 
+@manager.command
+def simulate(games=100, first_seed=0, players='2,3,4,5,6', ai='simple', processes=0, quiet=False):
+    """Play self-play games across a pool of processes and print stats.
+    Seeds are first_seed .. first_seed + games - 1, for each player count."""
+    from plyus import simulate as sim
+
+    seeds = range(int(first_seed), int(first_seed) + int(games))
+    player_counts = [int(n) for n in players.split(',')]
+    jobs = sim.make_jobs(seeds, player_counts, ai)
+
+    results = []
+    for r in sim.run_tournament(jobs, processes=int(processes) or None):
+        results.append(r)
+        if not quiet:
+            print("seed=%(seed)s players=%(num_players)s finished=%(finished)s rounds=%(rounds)s "
+                  "winner_seat=%(winner_seat)s points=%(points)s" % r)
+
+    print(sim.format_summary(sim.summarize(results)))
+
+
 @manager.command
 def diagram():
     from sqlalchemy_schemadisplay import create_schema_graph
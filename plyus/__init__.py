@@ -1,17 +1,19 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager
-from flask_openid import OpenID
-
 db = None
 app = None
 lm = None
 oid = None
 
 
+# flask and friends are only imported here, so the game engine (plyus.engine,
+# plyus.referee) can be used without them
 def create_flask_app(my_config):
     global app, db, lm, oid
 
+    from flask import Flask
+    from flask_sqlalchemy import SQLAlchemy
+    from flask_login import LoginManager
+    from flask_openid import OpenID
+
     app = Flask(__name__)
     app.config.update(my_config)
 
@@ -23,5 +25,5 @@ def create_flask_app(my_config):
 
     oid = OpenID(app, app.config['TEMP_DIR'])
 
-    from plyus import misc, gamestate, round, player, user, proto
-    from plyus import webapp
\ No newline at end of file
+    from plyus import misc, moverecord, checkpoint, gamestate, gamerecord, round, player, user, proto
+    from plyus import webapp
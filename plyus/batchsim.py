@@ -0,0 +1,471 @@
+"""Lockstep simulation of many games at once, for balance studies.
+
+BatchSimulator plays N independent games between SimpleAI style players,
+with the state of every game held in numpy arrays (struct of arrays) rather
+than in GameState objects.  On each tick, every unfinished game makes one
+move.  Games are grouped by their current step, and each group's move is
+applied with a handful of vectorized operations.
+
+The rules are the Referee's rules, and the decisions are the ones
+plyus/simpleai.py makes.  Given the same shuffles, a batch game is the
+same game, move for move, as the engine plays one game at a time, which
+tests/test_batchsim.py checks by playing both side by side.  The shuffles
+are made in _shuffled_decks() and _shuffled_role_piles(), from a numpy
+RandomState seeded once per batch, so a batch is reproducible from its
+seed, but individual games are not the engine's games with the same seed.
+
+Card ids index straight into the CardCatalog arrays.  A hand is stored as
+the order each card arrived in (-1 when the card isn't in the hand), so the
+"first card in hand" SimpleAI likes to use is an argmin.  The deck is a
+circular buffer, drawn from the front and returned to the back."""
+
+import numpy as np
+
+from plyus import bits
+from plyus.catalog import catalog_for, color_code
+from plyus.engine import RoundBase
+from plyus.referee import Referee
+
+# stages, as codes
+PLAYING = 0
+END_GAME = 1
+GAME_OVER = 2
+ABORTED = 3  # SimpleAI drew from a deck with fewer than two cards, which the Referee rejects
+
+# steps, as codes.  The phase is implied by the step.
+PICK_ROLE = 0
+HIDE_ROLE = 1
+COINS_OR_BUILDING = 2
+KEEP_CARD = 3
+BUILD_BUILDING = 4
+FINISH = 5
+
+_NOT_HELD = -1
+_NEVER = np.iinfo(np.int32).max
+
+
+class BatchSimulator(object):
+    def __init__(self, num_games, num_players, seed, deck_template='decks/deck_test_60.csv'):
+        self.num_games = N = num_games
+        self.num_players = P = num_players
+        self.catalog = catalog = catalog_for(deck_template)
+        self.random = np.random.RandomState(seed)
+        self.face_up_num, self.face_down_num = RoundBase.role_setup_for_n_players(P)
+        self.roles_per_player = 2 if P <= 3 else 1
+
+        card_ids = np.array(sorted(catalog.card_map.keys()), dtype=np.int32)
+        self.num_cards = len(card_ids)
+        D = len(catalog.cost)  # card ids index these arrays directly
+
+        self.cost = catalog.cost.astype(np.int32)
+        self.points = catalog.points.astype(np.int32)
+        self.role_color = np.full(9, -2, dtype=np.int32)
+        for role, color in Referee.bonus_colors.items():
+            self.role_color[role] = color_code(color)
+        self.role_bits = np.array([0] + [bits.role_bit(r) for r in range(1, 9)], dtype=np.uint8)
+
+        self.games = np.arange(N)
+        self.stage = np.full(N, PLAYING, dtype=np.int8)
+        self.step_code = np.full(N, PICK_ROLE, dtype=np.int8)
+        self.round_num = np.full(N, -1, dtype=np.int32)
+        self.moves = np.zeros(N, dtype=np.int32)
+        self.cur_player = np.zeros(N, dtype=np.int32)
+        self.crown = np.zeros(N, dtype=np.int32)
+
+        self.gold = np.full((N, P), 2, dtype=np.int32)
+        self.hand = np.full((N, P, D), _NOT_HELD, dtype=np.int32)
+        self.hand_count = np.zeros((N, P), dtype=np.int32)
+        self.table = np.full((N, P, D), _NOT_HELD, dtype=np.int32)
+        self.table_count = np.zeros((N, P), dtype=np.int32)
+        self.clock = np.zeros(N, dtype=np.int32)  # orders arrivals in hands and on tables
+        self.first_to_eight = np.zeros((N, P), dtype=bool)
+        self.points_scored = np.zeros((N, P), dtype=np.int32)
+        self.winner = np.full(N, -1, dtype=np.int32)
+
+        # the deck is a circular buffer of card ids, drawn from deck_head
+        self.deck = np.zeros((N, self.num_cards), dtype=np.int32)
+        self.deck_head = np.zeros(N, dtype=np.int32)
+        self.deck_size = np.full(N, self.num_cards, dtype=np.int32)
+        self.buffer = np.zeros((N, 2), dtype=np.int32)
+
+        # per round state
+        self.role_pile = np.zeros((N, 8), dtype=np.int32)
+        self.role_pile_len = np.zeros(N, dtype=np.int32)
+        self.role_owner = np.full((N, 9), -1, dtype=np.int32)
+        self.num_roles_picked = np.zeros(N, dtype=np.int32)
+        self.cur_role = np.zeros(N, dtype=np.int32)
+        self.revealed = np.zeros((N, P), dtype=np.uint8)  # role sets, see plyus.bits
+        self.used_power = np.zeros((N, P), dtype=bool)
+        self.taken_bonus = np.zeros((N, P), dtype=bool)
+        self.seven_builds_left = np.zeros(N, dtype=np.int32)
+        self.dead_role = np.zeros(N, dtype=np.int32)
+        self.mugged_role = np.zeros(N, dtype=np.int32)
+
+        # SimpleAI remembers the role after the one it picked as its likely victim
+        self.likely_victim = np.zeros((N, P), dtype=np.int32)
+
+        self._start_games()
+
+    # ---- setup
+
+    def _start_games(self):
+        N, P = self.num_games, self.num_players
+        self.deck[:] = self._shuffled_decks()
+
+        for p in range(P):
+            cards = self._draw(self.games, 4)
+            for j in range(4):
+                self._add_to_hand(self.games, np.full(N, p, dtype=np.int32), cards[:, j])
+
+        self._start_new_round(self.games)
+
+    # the only random choices in a game.  Each returns one row per game, in
+    # the order the engine's list would be in after shuffling.
+    def _shuffled_decks(self):
+        card_ids = np.array(sorted(self.catalog.card_map.keys()), dtype=np.int32)
+        return card_ids[self.random.rand(self.num_games, self.num_cards).argsort(axis=1)]
+
+    def _shuffled_role_piles(self, g):
+        return self.random.rand(len(g), 8).argsort(axis=1) + 1
+
+    def _start_new_round(self, g):
+        piles = self._shuffled_role_piles(g)
+        skip = self.face_up_num + self.face_down_num
+        self.role_pile[g] = 0
+        self.role_pile[g, :8 - skip] = piles[:, skip:]
+        self.role_pile_len[g] = 8 - skip
+
+        self.role_owner[g] = -1
+        self.num_roles_picked[g] = 0
+        self.cur_role[g] = 0
+        self.revealed[g] = 0
+        self.used_power[g] = False
+        self.taken_bonus[g] = False
+        self.seven_builds_left[g] = 3
+        self.dead_role[g] = 0
+        self.mugged_role[g] = 0
+
+        self.cur_player[g] = self.crown[g]
+        self.step_code[g] = PICK_ROLE
+        self.round_num[g] += 1
+
+    # ---- card movement
+
+    def _draw(self, g, k):
+        """ takes k cards off the top of each game's deck.  Games without enough cards are aborted
+            and get zeros, which are never card ids. """
+        short = self.deck_size[g] < k
+        if short.any():
+            self.stage[g[short]] = ABORTED
+        cols = (self.deck_head[g][:, None] + np.arange(k)) % self.num_cards
+        cards = self.deck[g[:, None], cols]
+        cards[short] = 0
+        ok = ~short
+        self.deck_head[g[ok]] = (self.deck_head[g[ok]] + k) % self.num_cards
+        self.deck_size[g[ok]] -= k
+        return cards
+
+    def _draw_up_to(self, g, k):
+        """ takes up to k cards off the top of each game's deck, as many as it has.
+            The missing ones are zeros. """
+        n = np.minimum(self.deck_size[g], k)
+        cols = (self.deck_head[g][:, None] + np.arange(k)) % self.num_cards
+        cards = self.deck[g[:, None], cols]
+        cards[np.arange(k)[None, :] >= n[:, None]] = 0
+        self.deck_head[g] = (self.deck_head[g] + n) % self.num_cards
+        self.deck_size[g] -= n
+        return cards
+
+    def _return_to_deck(self, g, cards):
+        col = (self.deck_head[g] + self.deck_size[g]) % self.num_cards
+        self.deck[g, col] = cards
+        self.deck_size[g] += 1
+
+    def _add_to_hand(self, g, p, cards):
+        real = cards > 0
+        g, p, cards = g[real], p[real], cards[real]
+        self.hand[g, p, cards] = self.clock[g]
+        self.hand_count[g, p] += 1
+        self.clock[g] += 1
+
+    def _first_in_hand(self, g, p):
+        """ the card that has been in each hand longest, and whether there was one """
+        arrived = self.hand[g, p]
+        c = np.where(arrived >= 0, arrived, _NEVER).argmin(axis=1)
+        return c, self.hand_count[g, p] > 0
+
+    # ---- the moves
+
+    def step(self):
+        """ every unfinished game makes one move """
+        live = self.stage <= END_GAME
+        groups = [(code, np.flatnonzero(live & (self.step_code == code)))
+                  for code in (PICK_ROLE, HIDE_ROLE, COINS_OR_BUILDING, KEEP_CARD, BUILD_BUILDING, FINISH)]
+        self.moves[live] += 1
+
+        handlers = {PICK_ROLE: self._pick_role, HIDE_ROLE: self._hide_role,
+                    COINS_OR_BUILDING: self._coins_or_building, KEEP_CARD: self._keep_card,
+                    BUILD_BUILDING: self._build_building, FINISH: self._finish}
+        for code, g in groups:
+            if len(g):
+                handlers[code](g)
+        return int(live.sum())
+
+    def run(self, max_moves_per_player=100):
+        """ plays every game to the end, or until it has taken max_moves_per_player moves per
+            player, the same limit the unit tests use.  Returns self.results(). """
+        for i in range(max_moves_per_player * self.num_players):
+            if self.step() == 0:
+                break
+        return self.results()
+
+    def results(self):
+        return {'finished': self.stage == GAME_OVER,
+                'aborted': self.stage == ABORTED,
+                'rounds': self.round_num.copy(),
+                'winner': self.winner.copy(),
+                'points': self.points_scored.copy(),
+                'moves': self.moves.copy()}
+
+    def _take_from_pile(self, g):
+        role = self.role_pile[g, 0]
+        self.role_pile[g, :-1] = self.role_pile[g, 1:]
+        self.role_pile[g, -1] = 0
+        self.role_pile_len[g] -= 1
+        return role
+
+    def _pick_role(self, g):
+        p = self.cur_player[g]
+        # SimpleAI picks the first role it sees, and expects the next one to be its victim
+        self.likely_victim[g, p] = self.role_pile[g, 1]
+        role = self._take_from_pile(g)
+        self.role_owner[g, role] = p
+        self.num_roles_picked[g] += 1
+
+        # 2 player games hide a role after the middle picks
+        hide = np.zeros(len(g), dtype=bool)
+        if self.num_players == 2:
+            hide = (self.num_roles_picked[g] == 2) | (self.num_roles_picked[g] == 3)
+        self.step_code[g[hide]] = HIDE_ROLE
+
+        done = ~hide & (self.num_roles_picked[g] >= self.num_players * self.roles_per_player)
+        self._start_turn(g[done], np.zeros(done.sum(), dtype=np.int32))
+
+        rest = ~hide & ~done
+        self.cur_player[g[rest]] = (p[rest] + 1) % self.num_players
+
+    def _hide_role(self, g):
+        self._take_from_pile(g)
+        self.cur_player[g] = (self.cur_player[g] + 1) % self.num_players
+        self.step_code[g] = PICK_ROLE
+
+    def _start_turn(self, g, after_role):
+        """ hands the turn to the lowest role in play above after_role, skipping the murdered one.
+            returns a mask of the games where everyone has already played """
+        roles = np.arange(9)
+        waiting = ((self.role_owner[g] >= 0) & (roles > after_role[:, None]) &
+                   (roles != self.dead_role[g][:, None]))
+        has_next = waiting.any(axis=1)
+        nxt = g[has_next]
+        role = waiting[has_next].argmax(axis=1)
+        player = self.role_owner[nxt, role]
+        self.cur_role[nxt] = role
+        self.cur_player[nxt] = player
+        self.step_code[nxt] = COINS_OR_BUILDING
+        return ~has_next
+
+    def _coins_or_building(self, g):
+        p = self.cur_player[g]
+        role = self.cur_role[g]
+        bonus = ~self.taken_bonus[g, p] & (self.role_color[role] >= 0)
+        self._take_bonus(g[bonus])
+
+        rest = ~bonus
+        g, p = g[rest], p[rest]
+        gold = self.hand_count[g, p] > 0
+        self._take_gold(g[gold])
+        self._draw_cards(g[~gold])
+
+    def _take_bonus(self, g):
+        p = self.cur_player[g]
+        color = self.role_color[self.cur_role[g]]
+        on_table = self.table[g, p] >= 0
+        self.gold[g, p] += (on_table & (self.catalog.color_codes[None, :] == color[:, None])).sum(axis=1)
+        self.taken_bonus[g, p] = True
+
+    def _pre_action_effects(self, g):
+        p = self.cur_player[g]
+        role = self.cur_role[g]
+        self.revealed[g, p] |= self.role_bits[role]
+
+        mugged = role == self.mugged_role[g]
+        gm, pm = g[mugged], p[mugged]
+        stolen = self.gold[gm, pm]
+        self.gold[gm, pm] = 0
+        self.gold[gm, self.role_owner[gm, 2]] += stolen
+
+    def _post_action_effects(self, g):
+        p = self.cur_player[g]
+        role = self.cur_role[g]
+        self.gold[g[role == 6], p[role == 6]] += 1
+
+        seven = role == 7
+        gs, ps = g[seven], p[seven]
+        cards = self._draw_up_to(gs, 2)
+        self._add_to_hand(gs, ps, cards[:, 0])
+        self._add_to_hand(gs, ps, cards[:, 1])
+
+    def _take_gold(self, g):
+        self._pre_action_effects(g)
+        self.gold[g, self.cur_player[g]] += 2
+        self._post_action_effects(g)
+        self.step_code[g] = BUILD_BUILDING
+
+    def _draw_cards(self, g):
+        self._pre_action_effects(g)
+        self.buffer[g] = self._draw(g, 2)
+        self.step_code[g] = KEEP_CARD
+
+    def _keep_card(self, g):
+        # SimpleAI always keeps the first card
+        self._add_to_hand(g, self.cur_player[g], self.buffer[g, 0])
+        self._return_to_deck(g, self.buffer[g, 1])
+        self._post_action_effects(g)
+        self.step_code[g] = BUILD_BUILDING
+
+    def _build_building(self, g):
+        # SimpleAI builds the first card in its hand, if it can afford it
+        p = self.cur_player[g]
+        card, has_card = self._first_in_hand(g, p)
+        build = has_card & (self.gold[g, p] >= self.cost[card])
+
+        gb, pb, cb = g[build], p[build], card[build]
+        self.hand[gb, pb, cb] = _NOT_HELD
+        self.hand_count[gb, pb] -= 1
+        self.table[gb, pb, cb] = self.clock[gb]
+        self.clock[gb] += 1
+        self.table_count[gb, pb] += 1
+        self.gold[gb, pb] -= self.cost[cb]
+
+        self.seven_builds_left[g] -= 1
+        again = (self.cur_role[g] == 7) & (self.seven_builds_left[g] > 0)
+        self.step_code[g] = np.where(again, BUILD_BUILDING, FINISH)
+
+        # building an 8th building triggers the end of the game
+        eight = (self.table_count[gb, pb] >= 8) & (self.stage[gb] == PLAYING)
+        self.first_to_eight[gb[eight], pb[eight]] = True
+        self.stage[gb[eight]] = END_GAME
+
+    def _finish(self, g):
+        p = self.cur_player[g]
+        role = self.cur_role[g]
+        can_use = ~self.used_power[g, p]
+
+        targeting = can_use & ((role == 1) | (role == 2))
+        self._target_role(g[targeting])
+
+        thief = can_use & (role == 3)
+        self._exchange_cards(g[thief])
+
+        razing = can_use & (role == 8)
+        raze_done = self._raze(g[razing])
+
+        finished = np.ones(len(g), dtype=bool)
+        finished[targeting | thief] = False
+        finished[np.flatnonzero(razing)[raze_done]] = False
+        self._end_turn(g[finished])
+
+    def _target_role(self, g):
+        p = self.cur_player[g]
+        victim = self.likely_victim[g, p]
+        victim[victim == 1] = 7
+        self.likely_victim[g, p] = victim
+
+        murderer = self.cur_role[g] == 1
+        self.dead_role[g[murderer]] = victim[murderer]
+        self.mugged_role[g[~murderer]] = victim[~murderer]
+        self.used_power[g, p] = True
+
+    def _exchange_cards(self, g):
+        p = self.cur_player[g]
+        card, has_card = self._first_in_hand(g, p)
+
+        # with cards in hand, swap the oldest one for one from the deck
+        gd, pd, cd = g[has_card], p[has_card], card[has_card]
+        self.hand[gd, pd, cd] = _NOT_HELD
+        self.hand_count[gd, pd] -= 1
+        self._return_to_deck(gd, cd)
+        self._add_to_hand(gd, pd, self._draw(gd, 1)[:, 0])
+
+        # with an empty hand, swap hands with the next player
+        gs, ps = g[~has_card], p[~has_card]
+        qs = (ps + 1) % self.num_players
+        mine = self.hand[gs, ps].copy()
+        self.hand[gs, ps] = self.hand[gs, qs]
+        self.hand[gs, qs] = mine
+        mine_count = self.hand_count[gs, ps].copy()
+        self.hand_count[gs, ps] = self.hand_count[gs, qs]
+        self.hand_count[gs, qs] = mine_count
+
+        self.used_power[g, p] = True
+
+    def _raze(self, g):
+        """ SimpleAI razes the next player's cheapest building when it can.
+            returns a mask of the games where it did """
+        p = self.cur_player[g]
+        q = (p + 1) % self.num_players
+        placed = self.table[g, q]
+        count = self.table_count[g, q]
+
+        # cheapest first, oldest first among equal costs
+        key = np.where(placed >= 0, self.cost[None, :] * 65536 + placed, _NEVER)
+        card = key.argmin(axis=1)
+        # SimpleAI leaves alone anyone who has revealed role 5.  The Referee only
+        # refuses when the target's cur_role is 5, and a target whose cur_role
+        # is 5 has played it this round, and so revealed it.  The AI's check
+        # covers the Referee's.  Likewise the AI wants the whole cost in gold
+        # where the Referee only needs cost - 1.
+        protected = (self.revealed[g, q] & self.role_bits[5]) != 0
+        raze = ((count > 0) & (count < 8) & (self.cost[card] <= self.gold[g, p]) & ~protected)
+
+        gr, pr, qr, cr = g[raze], p[raze], q[raze], card[raze]
+        self.gold[gr, pr] -= self.cost[cr] - 1
+        self.table[gr, qr, cr] = _NOT_HELD
+        self.table_count[gr, qr] -= 1
+        self.used_power[gr, pr] = True
+        return raze
+
+    def _end_turn(self, g):
+        everyone_played = self._start_turn(g, self.cur_role[g])
+        self._finish_round(g[everyone_played])
+
+    def _finish_round(self, g):
+        over = self.stage[g] == END_GAME
+        self._score(g[over])
+        self.stage[g[over]] = GAME_OVER
+
+        king = self.role_owner[g, 4]
+        crowned = king >= 0
+        self.crown[g[crowned]] = king[crowned]
+
+        # the Referee starts a new round even once the game is over, so do the
+        # same to keep round_num comparable
+        self._start_new_round(g)
+
+    def _score(self, g):
+        on_table = self.table[g] >= 0
+        basic = (on_table * self.points[None, None, :]).sum(axis=2)
+
+        colors = np.zeros(on_table.shape[:2], dtype=np.int32)
+        codes = self.catalog.color_codes
+        for code in range(codes.max() + 1):
+            colors += (on_table & (codes == code)[None, None, :]).any(axis=2)
+
+        bonus = (np.where(colors == 5, 3, 0) + np.where(self.table_count[g] >= 8, 2, 0) +
+                 np.where(self.first_to_eight[g], 2, 0))
+        self.points_scored[g] = basic + bonus
+
+        # ranked by points, then gold, then basic points.  Ties go to the lower seat
+        ranking = (self.points_scored[g].astype(np.int64) * 1000000000 +
+                   self.gold[g].astype(np.int64) * 10000 + basic)
+        self.winner[g] = ranking.argmax(axis=1)
@@ -0,0 +1,29 @@
+"""Helpers for packing per-seat flags into plain ints.
+
+Seat flags are an int with bit n set when the flag is on for the player in
+position n.  role_bit gives the matching bit for a role, 1-8, for code that
+keeps sets of roles in an int."""
+
+
+def role_bit(role):
+    return 1 << (role - 1)
+
+
+def seat_is_set(bits, seat):
+    return bits & (1 << seat) != 0
+
+
+def set_seat(bits, seat):
+    return bits | (1 << seat)
+
+
+def flags_to_bits(flags):
+    bits = 0
+    for seat, flag in enumerate(flags):
+        if flag:
+            bits |= 1 << seat
+    return bits
+
+
+def bits_to_flags(bits, num_seats):
+    return [bits & (1 << seat) != 0 for seat in range(num_seats)]
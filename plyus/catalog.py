@@ -0,0 +1,136 @@
+"""Read only card data for a deck template, as numpy arrays indexed by card id.
+
+There is one CardCatalog per template, shared by every deck and game built
+from it, so batch questions like "how many points are these buildings
+worth" are a single vectorized call instead of a loop over card_for_id.
+
+Clients fetch a catalog once, as json, from /catalog/<name>/<digest>.  The
+digest changes whenever the cards do, so the response can be cached forever,
+and game states can then send bare card ids (see the compact state mode)."""
+
+import csv
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from plyus.errors import FatalPlyusError
+from plyus import util
+
+# every building is one of these colors.  color_codes holds the index into this tuple
+COLORS = ('yellow', 'blue', 'green', 'red', 'purple')
+NO_COLOR = -1
+
+# deck templates live here, as <name>.csv
+DECKS_DIR = 'decks'
+
+
+class Building(object):
+    def __init__(self, id, color, points, name, cost=None):
+        self.id = id
+        self.color = color
+        self.points = points
+        self.name = name
+        self.cost = cost
+        if cost is None:
+            self.cost = points
+
+    def __repr__(self):
+        return "Building(id=%s, %s, %s, %s, %s)" % (self.id, self.name, self.color, self.points, self.cost)
+
+    def __eq__(self, other):
+        if isinstance(other, type(self)):
+            return self.id == other.id
+
+
+util.register_type('B', Building, ('id', 'color', 'points', 'name', 'cost'))
+
+
+class CardCatalog(object):
+    def __init__(self, template, full_cards):
+        self.template = template
+        self.full_cards = full_cards
+        self.card_map = dict([(c.id, c) for c in full_cards])
+
+        size = max(self.card_map.keys()) + 1
+        self.cost = np.zeros(size, dtype=np.int16)
+        self.points = np.zeros(size, dtype=np.int16)
+        self.color_codes = np.full(size, NO_COLOR, dtype=np.int8)
+        for c in full_cards:
+            if c.color not in COLORS:
+                raise FatalPlyusError("card %s in %s has unknown color %s" % (c.id, template, c.color))
+            self.cost[c.id] = c.cost
+            self.points[c.id] = c.points
+            self.color_codes[c.id] = color_code(c.color)
+
+        for a in (self.cost, self.points, self.color_codes):
+            a.flags.writeable = False
+
+        # what clients download, built once since the catalog never changes
+        self.name = os.path.splitext(os.path.basename(template))[0]
+        cards = [{'id': c.id, 'color': c.color, 'points': c.points, 'name': c.name, 'cost': c.cost}
+                 for c in full_cards]
+        cards_json = json.dumps(cards, sort_keys=True)
+        self.digest = hashlib.sha1(cards_json.encode('utf-8')).hexdigest()[:16]
+        self.json = json.dumps({'name': self.name, 'digest': self.digest, 'cards': cards}, sort_keys=True)
+
+    def ref(self):
+        """ what a game state tells the client about its catalog """
+        return {'name': self.name, 'digest': self.digest}
+
+    def total_points(self, ids):
+        return int(self.points[np.asarray(ids, dtype=np.intp)].sum())
+
+    def total_cost(self, ids):
+        return int(self.cost[np.asarray(ids, dtype=np.intp)].sum())
+
+    def count_color(self, ids, color):
+        codes = self.color_codes[np.asarray(ids, dtype=np.intp)]
+        return int(np.count_nonzero(codes == color_code(color)))
+
+    def num_colors(self, ids):
+        """ how many different colors there are among these buildings """
+        codes = self.color_codes[np.asarray(ids, dtype=np.intp)]
+        return int(np.count_nonzero(np.bincount(codes, minlength=len(COLORS))))
+
+    def color_counts(self, ids):
+        """ an array with the number of buildings of each color, in COLORS order """
+        codes = self.color_codes[np.asarray(ids, dtype=np.intp)]
+        return np.bincount(codes, minlength=len(COLORS))
+
+
+def color_code(color):
+    if color not in COLORS:
+        return NO_COLOR
+    return COLORS.index(color)
+
+
+def template_for_deck(name):
+    """ the template file for a deck name, as used in catalog urls, or None if there isn't one """
+    if not re.match(r'^\w+$', name):
+        return None
+    template = '%s/%s.csv' % (DECKS_DIR, name)
+    if not os.path.isfile(template):
+        return None
+    return template
+
+
+# catalogs are read only, so every deck built from the same template shares one
+_catalogs = {}
+
+
+def catalog_for(template):
+    """ returns the CardCatalog for a deck template, reading the csv file only once """
+    if template not in _catalogs:
+
+        def card_from_line(line):
+            return Building(int(line[0]), line[1], int(line[2]), line[3])
+
+        with open(template, 'r') as myfile:
+            lines = csv.reader(myfile)
+            full_cards = [card_from_line(line) for line in lines]
+
+        _catalogs[template] = CardCatalog(template, full_cards)
+    return _catalogs[template]
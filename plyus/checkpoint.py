@@ -0,0 +1,17 @@
+from plyus.mutable import JSONEncoded
+from plyus import db
+
+
+class Checkpoint(db.Model):
+    """ the whole state of a game just after journal entry seq, see GameStateBase.checkpoint """
+    __tablename__ = 'checkpoints'
+    __table_args__ = (db.UniqueConstraint('game_state_id', 'seq'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    game_state_id = db.Column(db.Integer, db.ForeignKey('gamestates.id'), nullable=False, index=True)
+    seq = db.Column(db.Integer, nullable=False)
+    state = db.Column(JSONEncoded)
+
+    def __init__(self, seq, state):
+        self.seq = seq
+        self.state = state
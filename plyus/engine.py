@@ -0,0 +1,837 @@
+"""The game engine core.
+
+Nothing in this module knows about flask or sqlalchemy.  The rules for the
+game state objects live in the *Base classes below, and are shared by the
+persistent models (GameState, Round, Player, BuildingDeck) and by the plain
+in-memory Sim* classes used for simulation and self-play.  The Referee works
+with either kind of object."""
+
+import logging
+import operator
+
+from . import util
+from . import bits
+from . import rng
+from . import events
+from plyus.catalog import Building, catalog_for
+from plyus.errors import FatalPlyusError
+
+
+#Each game consists of several stages, progressing forward relentlessly
+# (no backsies or looping)
+class Stage:
+    PRE_GAME = 'PRE_GAME'  #still waiting for players to join
+    PLAYING = 'PLAYING' # game has started
+    END_GAME = 'END_GAME' #a player built 8 buidings, so this is the last round
+    GAME_OVER = 'GAME_OVER' #last round finished, winners/scores recorded
+
+#Each Round consists of two phases
+class Phase:
+    PICK_ROLES = 'PICK_ROLES'
+    PLAY_TURNS = 'PLAY_TURNS'
+
+#The Play turn phase consists of several steps
+class Step:
+    NO_STEP = 'NO_STEP'
+    COINS_OR_BUILDING = 'COINS_OR_BUILDING'
+    KEEP_CARD = 'KEEP_CARD'
+    MURDER = 'MURDER'
+    STEAL = 'STEAL'
+    RAZE = 'RAZE'
+    BUILD_BUILDING = 'BUILD_BUILDING'
+    PICK_ROLE = 'PICK_ROLE'
+    HIDE_ROLE = 'HIDE_ROLE'
+    FINISH = 'FINISH'
+
+
+class BuildingDeckBase(object):
+    __slots__ = ()
+
+    def __init__(self, template):
+        """ template is a file name for now.  Might be a database id later """
+        self.template = template
+        self._construct_card_map()
+        self.cards = list(self.card_map.keys())
+
+    def _construct_card_map(self):
+        self.catalog = catalog_for(self.template)
+        self.full_cards = self.catalog.full_cards
+        self.card_map = self.catalog.card_map
+
+    def card_for_id(self, card_id):
+        if self.card_map is None:
+            self._construct_card_map()
+        return self.card_map[card_id]
+
+    def get_catalog(self):
+        if self.catalog is None:
+            self._construct_card_map()
+        return self.catalog
+
+
+#TODO:  make sure we can't have 2 players with the same name.  or else
+# make sure we handle that case properly
+class PlayerBase(object):
+    __slots__ = ()
+
+    # the state that changes during a game, split into plain values and lists
+    scalar_fields = ('name', 'position', 'gold', 'cur_role', 'rainbow_bonus',
+                     'first_to_eight_buildings', 'points')
+    list_fields = ('buildings_on_table', 'buildings_in_hand', 'buildings_buffer', 'roles',
+                   'revealed_roles')
+
+    def __init__(self, n):
+        self.name = n
+        self.position = None
+        self.gold = 2
+        self.buildings_on_table = []
+        self.buildings_in_hand = []
+        self.buildings_buffer = []
+        self.cur_role = None
+        self.roles = []
+        self.revealed_roles = []
+        self.rainbow_bonus = False
+        self.first_to_eight_buildings = False
+        self.points = None
+
+    #current player chooses to get gold
+    def take_gold(self):
+        self.gold += 2
+
+    #when current player chooses to draw cards
+    def take_cards(self, cards):
+        if len(cards) < 2:
+            #TODO: figure out and implement rule on reshuffling building cards
+            raise FatalPlyusError("Building deck is out of cards.")
+        self.buildings_buffer = util.draw_n(cards, 2)
+
+    def set_position(self, i):
+        self.position = i
+
+    def __repr__(self):
+        return "Player(name=%s, pos=%s, cur_role= %s, roles=%s, gold=%s, hand=%r, dists=%s)" % (self.name,
+                                                                                                self.position,
+                                                                                                self.cur_role,
+                                                                                                self.roles, self.gold,
+                                                                                                self.buildings_in_hand,
+                                                                                                self.buildings_on_table)
+
+    # with compact set, buildings are sent as bare card ids, for clients that
+    # have the deck's catalog (see plyus.catalog)
+    def to_dict_for_public(self, deck, compact=False):
+        d = {}
+        fields_to_copy = ['name', 'position', 'gold', 'points']
+
+        for k in fields_to_copy:
+            d[k] = getattr(self, k)
+
+        # lists are copied, so the dict doesn't change along with the game
+        d['revealed_roles'] = list(self.revealed_roles)
+
+        d['buildings_on_table'] = _cards(deck, self.buildings_on_table, compact)
+        d['num_cards_in_hand'] = len(self.buildings_in_hand)
+
+        return d
+
+    def to_dict_for_private(self, deck, compact=False):
+        d = self.to_dict_for_public(deck, compact)
+
+        d['cur_role'] = self.cur_role
+        d['roles'] = list(self.roles)
+
+        d['buildings_in_hand'] = _cards(deck, self.buildings_in_hand, compact)
+        d['buildings_buffer'] = _cards(deck, self.buildings_buffer, compact)
+        return d
+
+
+def _cards(deck, ids, compact):
+    if compact:
+        return list(ids)
+    return [deck.card_for_id(i) for i in ids]
+
+
+class RoundBase(object):
+    __slots__ = ()
+
+    scalar_fields = ('used_power_bits', 'taken_bonus_bits', 'num_seven_builds_left', 'dead_role',
+                     'mugged_role', 'num_roles_picked', 'turn_cursor')
+    list_fields = ('role_owners', 'turn_order', 'role_draw_pile', 'face_up_roles', 'face_down_roles')
+
+    def __init__(self, game_state):
+        self.game_state = game_state
+
+        # one bit per seat, see plyus.bits
+        self.used_power_bits = 0
+        self.taken_bonus_bits = 0
+        self.num_seven_builds_left = 3
+        self.dead_role = None
+        self.mugged_role = None
+        # role_owners[role] is the position of the player who picked that role,
+        # or None.  Kept up to date by mark_role_picked so lookups are cheap.
+        self.role_owners = [None] * 9
+        self.num_roles_picked = 0
+        # once picking is done, turn_order holds [role, player] for every role
+        # in play, in the order they take their turns. turn_cursor is the current turn.
+        self.turn_order = []
+        self.turn_cursor = 0
+
+        players = game_state.players
+
+        for p in players:
+            p.roles = []
+            p.cur_role = None
+
+        face_up_num, face_down_num = self.role_setup_for_n_players(len(players))
+        self.role_draw_pile = [1, 2, 3, 4, 5, 6, 7, 8]
+        game_state.get_random_gen().shuffle(self.role_draw_pile)
+        self.face_up_roles = util.draw_n(self.role_draw_pile, face_up_num)
+        self.face_down_roles = util.draw_n(self.role_draw_pile, face_down_num)
+
+    def has_used_power_for(self, position):
+        return bits.seat_is_set(self.used_power_bits, position)
+
+    def mark_used_power(self, position):
+        self.used_power_bits = bits.set_seat(self.used_power_bits, position)
+
+    def has_taken_bonus_for(self, position):
+        return bits.seat_is_set(self.taken_bonus_bits, position)
+
+    def mark_taken_bonus(self, position):
+        self.taken_bonus_bits = bits.set_seat(self.taken_bonus_bits, position)
+
+    # list views of the seat flags, one bool per player, for clients and bots
+    @property
+    def has_used_power(self):
+        return bits.bits_to_flags(self.used_power_bits, self.game_state.num_players)
+
+    @property
+    def has_taken_bonus(self):
+        return bits.bits_to_flags(self.taken_bonus_bits, self.game_state.num_players)
+
+    def player_for_role(self, role):
+        return self.role_owners[role]
+
+    def roles_in_play(self):
+        """ the picked roles, lowest first """
+        return [r for r in range(1, 9) if self.role_owners[r] is not None]
+
+    def gen_plyr_to_role_map(self):
+        m = {}
+        for p in range(self.game_state.num_players):
+            m[p] = []
+        for r in self.roles_in_play():
+            m[self.role_owners[r]].append(r)
+        return m
+
+    def gen_role_to_plyr_map(self):
+        return dict((r, self.role_owners[r]) for r in self.roles_in_play())
+
+    def mark_role_picked(self, role, player_id):
+        if player_id not in range(0, self.game_state.num_players):
+            raise FatalPlyusError("bad player-id")
+
+        logging.info("marking %s as picked by %s", role, player_id)
+        self.role_draw_pile.remove(role)
+        self.role_owners[role] = player_id
+        self.num_roles_picked += 1
+
+    def schedule_turns(self):
+        """ works out the turn order for the play turns phase.  Call once picking is done. """
+        self.turn_order = [[r, self.role_owners[r]] for r in self.roles_in_play()]
+        self.turn_cursor = 0
+
+    def cur_turn(self):
+        """ returns [role, player] for the current turn """
+        return self.turn_order[self.turn_cursor]
+
+    def advance_turn(self):
+        """ moves on to the next role's turn, skipping the murdered role.
+            returns [role, player] for the new turn, or None if everyone has played """
+        self.turn_cursor += 1
+        if (self.turn_cursor < len(self.turn_order) and
+                self.turn_order[self.turn_cursor][0] == self.dead_role):
+            self.turn_cursor += 1
+
+        if self.turn_cursor >= len(self.turn_order):
+            return None
+        return self.turn_order[self.turn_cursor]
+
+    @staticmethod
+    def role_setup_for_n_players(n):
+        # return (num_face_up, num_face_down)
+        if n == 2: return (0, 1)
+        if n == 3: return (0, 1)
+        if n == 4: return (2, 1)
+        if n == 5: return (1, 1)
+        if n == 6: return (0, 1)
+        raise FatalPlyusError("Wrong number of players: %s" % n)
+
+    def done_picking(self):
+        #if no player still needs to choose, we're done picking
+        # easy case - if everyone has picked one role we're done
+
+        num_roles_picked = self.num_roles_picked
+        num_players = self.game_state.num_players
+
+        num_roles_per_player = 1
+
+        if num_players <= 3:
+            num_roles_per_player = 2
+
+        return num_roles_picked >= num_players * num_roles_per_player
+
+    def __repr__(self):
+        return "Round(draw:%s, up:%s, down:%s\n    role_owners:%s" % (self.role_draw_pile,
+                                                                     self.face_up_roles,
+                                                                     self.face_down_roles,
+                                                                     self.role_owners)
+
+    def to_dict_for_public(self):
+        d = {}
+        fields_to_copy = ['has_used_power', 'has_taken_bonus', 'num_seven_builds_left']
+
+        for k in fields_to_copy:
+            d[k] = getattr(self, k)
+        d['face_up_roles'] = list(self.face_up_roles)
+
+        # only the turns that have started are public, the rest would give away who has which
+        # role.  The murdered role's turn is skipped, so who had it stays hidden too.
+        d['turn_order'] = [t for t in self.turn_order[:self.turn_cursor + 1] if t[0] != self.dead_role]
+
+        return d
+
+
+#TODO: refactor so referee is the only one who knows about random_gen
+#      make all gamestate methods more testable by injecting the randomly chosen
+#      items rather than doing the random choosing internally
+class GameStateBase(object):
+    """ Subclasses provide the state attributes, plus new_deck() and new_round()
+        to build the matching deck and round objects, and journal_move(),
+        get_journal(), save_checkpoint() and nearest_checkpoint() to keep the
+        game's move journal and checkpoints. """
+    __slots__ = ()
+
+    # a checkpoint is saved every this many moves, and at the start of every round
+    checkpoint_interval = 50
+
+    scalar_fields = ('stage', 'step', 'phase', 'base_seed', 'rng_counter', 'num_players', 'round_num',
+                     'cur_player_index', 'player_with_crown_token', 'winner', 'num_moves')
+
+    def __init__(self, base_seed, created_by, num_players, deck_template=None):
+        self.stage = Stage.PRE_GAME
+        self.step = Step.NO_STEP
+        self.base_seed = base_seed
+        if deck_template is None:
+            deck_template = 'decks/deck_test_60.csv'
+        self.building_card_deck = self.new_deck(deck_template)
+        self.round_num = -1
+        self.rng_counter = 0
+        self.num_moves = 0
+
+        self.num_players = num_players
+
+        self.players = [created_by]
+        self.winner = None
+        self.cur_player_index = 0
+
+    def add_player(self, player):
+        if self.stage != Stage.PRE_GAME:
+            raise FatalPlyusError("Can't add players except in stage PRE_GAME")
+        if len(self.players) >= self.num_players:
+            raise FatalPlyusError("Game already has %s players." % self.num_players)
+
+        self.players.append(player)
+
+    def start_game(self):
+
+        if len(self.players) < self.num_players:
+            logging.error("trying to start game %s with only %s players, but expecting %s players",
+                          self.id, len(self.players), self.num_players)
+            raise FatalPlyusError("Not all players have joined yet")
+        if self.stage != Stage.PRE_GAME:
+            raise FatalPlyusError("Can't start game except from stage PRE_GAME  (in stage %s now)" % (self.stage,))
+
+        # the journal starts with the players in the order they joined, which
+        # together with base_seed is everything needed to deal the game again
+        join_order = [p.name for p in self.players]
+
+        rand_gen = self.get_random_gen()
+        rand_gen.shuffle(self.players)
+        rand_gen.shuffle(self.building_card_deck.cards)
+
+        for i, p in enumerate(self.players):
+            p.set_position(i)
+            #TODO:  replace magic number with actual number of cards in starting hand.
+            p.buildings_in_hand.extend(util.draw_n(self.building_card_deck.cards, 4))
+
+        self.round = self.new_round()
+        self.player_with_crown_token = 0 #this player gets to go first when picking a role
+        self.stage = Stage.PLAYING
+        self.start_new_round()
+        self.record_move({'player': None, 'action': {'name': 'start_game', 'players': join_order}})
+
+    def wants_checkpoint(self, seq, new_round):
+        return new_round or seq % self.checkpoint_interval == 0
+
+    def record_move(self, move, new_round=False, checkpoint=None):
+        """ appends an accepted move to the journal.  The entry for start_game
+            is seq 0, and each move after that gets the next seq.  checkpoint is
+            for moves journaled after the fact: the state to save for this move,
+            taken just after it was made. """
+        seq = self.num_moves
+        self.journal_move(seq, move)
+        self.num_moves += 1
+        if checkpoint is None and self.wants_checkpoint(seq, new_round):
+            checkpoint = self.checkpoint()
+        if checkpoint is not None:
+            self.save_checkpoint(seq, checkpoint)
+
+    def to_dict_for_public(self, compact=False):
+        d = {}
+        fields_to_copy = ['round_num', 'player_with_crown_token', 'stage',
+                          'phase', 'step', 'cur_player_index', 'num_players',
+                          'winner']
+        for k in fields_to_copy:
+            d[k] = getattr(self, k)
+
+        if self.id:
+            d['id'] = self.id
+
+        d['players'] = [p.to_dict_for_public(self.building_card_deck, compact) for p in self.players]
+        d['building_card_deck_len'] = len(self.building_card_deck.cards)
+
+        r = {}
+        if self.round:
+            r = self.round.to_dict_for_public()
+        d['round'] = r
+
+        return d
+
+    def to_dict_for_player(self, player, compact=False):
+        d = self.to_dict_for_public(compact)
+
+        r = d['round']
+        logging.debug("in todictforplayer %s", player)
+        if player.position == self.cur_player_index and self.phase == Phase.PICK_ROLES:
+            logging.debug("assigning role_draw_pile now")
+            r['role_draw_pile'] = list(self.round.role_draw_pile)
+        else:
+            logging.debug(" %s not equal %s", player.position, self.cur_player_index)
+            logging.debug("or  %s not equal %s", self.phase, Phase.PICK_ROLES)
+        return d
+
+    def advance_cur_player_index(self):
+        self.cur_player_index = (self.cur_player_index + 1) % self.num_players
+
+    def __repr__(self):
+        return ("phase=%s, step=%s, cur_player_index: %s, round=%s" %
+                (self.phase, self.step, self.cur_player_index, self.round))
+
+    def finish_round(self):
+        logging.debug("made it to finish_round with stage as %s", self.stage)
+        #TODO: announce dead player if any
+
+        # if we are in the end_game (someone built 8 things)
+        # and we are done with the round, game is over
+        if self.stage == Stage.END_GAME:
+            self.do_game_over_calculations()
+            self.stage = Stage.GAME_OVER
+            if events.active:
+                events.emit(events.GameFinished(self.id, self.round_num, self.winner))
+        logging.info("after end game check, stage is %s", self.stage)
+        #if the konig was around, give that player the crown
+        king = self.round.player_for_role(4)
+        if king is not None:
+            self.player_with_crown_token = king
+        if events.active:
+            events.emit(events.RoundFinished(self.id, self.round_num, self.player_with_crown_token))
+
+    def start_new_round(self):
+        logging.info("starting new round")
+        # each round draws from a fresh stream
+        self.round_num += 1
+        self.rng_counter = 0
+        self.round = self.new_round()
+        self.cur_player_index = self.player_with_crown_token
+        self.phase = Phase.PICK_ROLES
+        self.step = Step.PICK_ROLE
+
+        for p in self.players:
+            p.revealed_roles = []
+
+    def get_cur_plyr(self):
+        return self.players[self.cur_player_index]
+
+    # this should only be called at the end of a round, after
+    # all players have taken their turn and we are in the
+    # END_GAME stage
+    def do_game_over_calculations(self):
+
+        catalog = self.building_card_deck.get_catalog()
+        for p in self.players:
+
+            basic_points = catalog.total_points(p.buildings_on_table)
+            bonus_points = 0
+
+            if catalog.num_colors(p.buildings_on_table) == 5:
+                p.rainbow_bonus = True
+                bonus_points += 3
+
+            if len(p.buildings_on_table) >= 8:
+                bonus_points += 2
+
+            if p.first_to_eight_buildings:
+                bonus_points += 2
+
+            p.points = basic_points + bonus_points
+            p.ranking = (p.points, p.gold, basic_points)
+            #TODO:  implement official tiebreaker
+        ranked_players = sorted(self.players, key=lambda p: p.ranking, reverse=True)
+        self.winner = ranked_players[0].name
+
+    def encode_observation(self, player_index, out=None):
+        """ what player_index can see of the game, as a fixed size float32 vector.
+            Pass out to reuse a vector.  See plyus.observation for the layout. """
+        from plyus import observation
+        return observation.encode(self, player_index, out)
+
+    def get_random_gen(self):
+        """ a generator for this game's stream of random numbers.  Each round has
+            its own stream, keyed by base_seed and round_num, and rng_counter
+            records how far into it the game has drawn, so replays draw the same numbers """
+        return rng.GameRandom(self)
+
+    def snapshot(self):
+        """ captures everything a move can change, so restore() can put it back later.
+            Only ints, strings and short lists of ids are copied, the card catalog is shared. """
+        players = list(self.players)
+        player_states = [(_scalars(p, p.scalar_fields), _lists(p, p.list_fields)) for p in players]
+        rnd = self.round
+        round_state = None
+        if rnd is not None:
+            round_state = (_scalars(rnd, rnd.scalar_fields), _lists(rnd, rnd.list_fields))
+        return (_scalars(self, self.scalar_fields), players, player_states, rnd, round_state,
+                list(self.building_card_deck.cards))
+
+    def checkpoint(self):
+        """ the whole state of the game as plain dicts and lists, which can be stored
+            as json and turned back into a game with SimGameState.from_checkpoint() """
+        rnd = self.round
+        round_state = None
+        if rnd is not None:
+            round_state = _fields_dict(rnd, rnd.scalar_fields, rnd.list_fields)
+        return {'template': self.building_card_deck.template,
+                'game': _fields_dict(self, self.scalar_fields, ()),
+                'players': [_fields_dict(p, p.scalar_fields, p.list_fields) for p in self.players],
+                'round': round_state,
+                'cards': list(self.building_card_deck.cards)}
+
+    def to_bytes(self):
+        """ the whole game in a compact versioned binary form, see plyus.packing """
+        from plyus import packing
+        return packing.pack(self)
+
+    def restore(self, snap):
+        """ puts this game back the way it was when snapshot() was called.
+            A snapshot can be restored any number of times. """
+        game_values, players, player_states, rnd, round_state, cards = snap
+        _set_scalars(self, self.scalar_fields, game_values)
+        self.players = list(players)
+        for p, (scalars, lists) in zip(players, player_states):
+            _set_scalars(p, p.scalar_fields, scalars)
+            _set_lists(p, p.list_fields, lists)
+        self.round = rnd
+        if rnd is not None:
+            _set_scalars(rnd, rnd.scalar_fields, round_state[0])
+            _set_lists(rnd, rnd.list_fields, round_state[1])
+        self.building_card_deck.cards = list(cards)
+
+
+_getters = {}
+
+
+def _scalars(obj, fields):
+    getter = _getters.get(fields)
+    if getter is None:
+        getter = _getters[fields] = operator.attrgetter(*fields)
+    return getter(obj)
+
+
+def _lists(obj, fields):
+    return tuple([list(v) for v in _scalars(obj, fields)])
+
+
+def _fields_dict(obj, scalar_fields, list_fields):
+    d = dict(zip(scalar_fields, _scalars(obj, scalar_fields)))
+    if list_fields:
+        d.update(zip(list_fields, _lists(obj, list_fields)))
+    return d
+
+
+def _set_fields(obj, scalar_fields, list_fields, d):
+    for k in scalar_fields:
+        setattr(obj, k, d.get(k))
+    for k in list_fields:
+        setattr(obj, k, list(d.get(k, ())))
+
+
+def _set_scalars(obj, fields, values):
+    for k, v in zip(fields, values):
+        setattr(obj, k, v)
+
+
+def _set_lists(obj, fields, values):
+    for k, v in zip(fields, values):
+        setattr(obj, k, list(v))
+
+
+# The in-memory engine.  These are plain objects with __slots__, so attribute
+# access is as cheap as python allows.  Use them for self-play and simulation,
+# and copy to and from the persistent models with from_model() and copy_to_model()
+
+class SimBuildingDeck(BuildingDeckBase):
+    __slots__ = ('template', 'cards', 'catalog', 'full_cards', 'card_map')
+
+
+class SimPlayer(PlayerBase):
+    __slots__ = ('id', 'name', 'position', 'gold', 'buildings_on_table', 'buildings_in_hand',
+                 'buildings_buffer', 'cur_role', 'roles', 'revealed_roles', 'rainbow_bonus',
+                 'first_to_eight_buildings', 'points', 'ranking')
+
+    def __init__(self, n):
+        PlayerBase.__init__(self, n)
+        self.id = None
+
+    def clone(self):
+        p = SimPlayer.__new__(SimPlayer)
+        p.id = self.id
+        p.name = self.name
+        p.position = self.position
+        p.gold = self.gold
+        p.buildings_on_table = self.buildings_on_table[:]
+        p.buildings_in_hand = self.buildings_in_hand[:]
+        p.buildings_buffer = self.buildings_buffer[:]
+        p.cur_role = self.cur_role
+        p.roles = self.roles[:]
+        p.revealed_roles = self.revealed_roles[:]
+        p.rainbow_bonus = self.rainbow_bonus
+        p.first_to_eight_buildings = self.first_to_eight_buildings
+        p.points = self.points
+        return p
+
+
+class SimRound(RoundBase):
+    __slots__ = ('game_state', 'used_power_bits', 'taken_bonus_bits', 'num_seven_builds_left',
+                 'dead_role', 'mugged_role', 'role_owners', 'num_roles_picked', 'turn_order',
+                 'turn_cursor', 'role_draw_pile', 'face_up_roles', 'face_down_roles')
+
+    def clone(self, game_state):
+        r = SimRound.__new__(SimRound)
+        r.game_state = game_state
+        r.used_power_bits = self.used_power_bits
+        r.taken_bonus_bits = self.taken_bonus_bits
+        r.num_seven_builds_left = self.num_seven_builds_left
+        r.dead_role = self.dead_role
+        r.mugged_role = self.mugged_role
+        r.role_owners = self.role_owners[:]
+        r.num_roles_picked = self.num_roles_picked
+        # the [role, player] pairs are never changed once scheduled, so they can be shared
+        r.turn_order = self.turn_order[:]
+        r.turn_cursor = self.turn_cursor
+        r.role_draw_pile = self.role_draw_pile[:]
+        r.face_up_roles = self.face_up_roles[:]
+        r.face_down_roles = self.face_down_roles[:]
+        return r
+
+
+class SimGameState(GameStateBase):
+    __slots__ = ('id', 'stage', 'step', 'phase', 'players', 'base_seed', 'rng_counter', 'building_card_deck',
+                 'num_players', 'round_num', 'cur_player_index', 'player_with_crown_token',
+                 'winner', 'round', 'num_moves', 'journal', 'checkpoints', 'history_shared')
+
+    def __init__(self, base_seed, created_by, num_players, deck_template=None):
+        self.id = None
+        self.phase = None
+        self.round = None
+        self.player_with_crown_token = None
+        self.journal = []
+        # (seq, state) pairs, oldest first
+        self.checkpoints = []
+        # set when journal and checkpoints are shared with a clone, see clone()
+        self.history_shared = False
+        GameStateBase.__init__(self, base_seed, created_by, num_players, deck_template)
+
+    def new_deck(self, template):
+        return SimBuildingDeck(template)
+
+    def new_round(self):
+        return SimRound(self)
+
+    def journal_move(self, seq, move):
+        self._own_history()
+        self.journal.append(move)
+
+    def get_journal(self, end=None, start=0):
+        """ the journal entries from seq start up to before seq end, or all of them """
+        return self.journal[start:end]
+
+    def save_checkpoint(self, seq, state):
+        self._own_history()
+        self.checkpoints.append((seq, state))
+
+    def _own_history(self):
+        # copies the journal and checkpoints before adding to them, if a clone shares them
+        if self.history_shared:
+            self.journal = self.journal[:]
+            self.checkpoints = self.checkpoints[:]
+            self.history_shared = False
+
+    def nearest_checkpoint(self, seq):
+        """ (seq, state) for the last checkpoint at or before seq, or None """
+        for checkpoint in reversed(self.checkpoints):
+            if checkpoint[0] <= seq:
+                return checkpoint
+        return None
+
+    def clone(self):
+        """ an independent copy of this game, for trying out moves.  The card catalog is shared,
+            and so are the journal and checkpoints until either game adds to them, so a
+            clone costs the same however long the game has gone on. """
+        g = SimGameState.__new__(SimGameState)
+        g.id = self.id
+        g.stage = self.stage
+        g.step = self.step
+        g.phase = self.phase
+        g.base_seed = self.base_seed
+        g.rng_counter = self.rng_counter
+        g.num_players = self.num_players
+        g.round_num = self.round_num
+        g.cur_player_index = self.cur_player_index
+        g.player_with_crown_token = self.player_with_crown_token
+        g.winner = self.winner
+        g.num_moves = self.num_moves
+        g.journal = self.journal
+        g.checkpoints = self.checkpoints
+        g.history_shared = self.history_shared = True
+
+        deck = self.building_card_deck
+        g.building_card_deck = new_deck = SimBuildingDeck.__new__(SimBuildingDeck)
+        new_deck.template = deck.template
+        new_deck.catalog = deck.catalog
+        new_deck.full_cards = deck.full_cards
+        new_deck.card_map = deck.card_map
+        new_deck.cards = deck.cards[:]
+
+        g.players = [p.clone() for p in self.players]
+        g.round = None
+        if self.round is not None:
+            g.round = self.round.clone(g)
+        return g
+
+    @classmethod
+    def from_model(cls, model):
+        """ builds an in-memory copy of a persistent GameState """
+        g = cls.__new__(cls)
+        g.id = model.id
+        _set_scalars(g, cls.scalar_fields, _scalars(model, cls.scalar_fields))
+        g.journal = model.get_journal()
+        # checkpoints stay in the database, they are only needed to go back in time
+        g.checkpoints = []
+        g.history_shared = False
+
+        model_deck = model.building_card_deck
+        g.building_card_deck = deck = SimBuildingDeck.__new__(SimBuildingDeck)
+        deck.template = model_deck.template
+        deck.cards = list(model_deck.cards)
+        deck._construct_card_map()
+
+        g.players = []
+        for mp in model.players:
+            p = SimPlayer.__new__(SimPlayer)
+            p.id = mp.id
+            _set_scalars(p, p.scalar_fields, _scalars(mp, p.scalar_fields))
+            _set_lists(p, p.list_fields, _lists(mp, p.list_fields))
+            g.players.append(p)
+
+        g.round = None
+        if model.round is not None:
+            g.round = r = SimRound.__new__(SimRound)
+            r.game_state = g
+            _set_scalars(r, r.scalar_fields, _scalars(model.round, r.scalar_fields))
+            _set_lists(r, r.list_fields, _lists(model.round, r.list_fields))
+        return g
+
+    @classmethod
+    def from_checkpoint(cls, state, journal=()):
+        """ builds a game from GameStateBase.checkpoint().  journal is the game's
+            journal up to the checkpoint, if the copy should carry it. """
+        g = cls.__new__(cls)
+        g.id = None
+        _set_fields(g, cls.scalar_fields, (), state['game'])
+        g.journal = list(journal)
+        g.checkpoints = []
+        g.history_shared = False
+
+        g.building_card_deck = deck = SimBuildingDeck.__new__(SimBuildingDeck)
+        deck.template = state['template']
+        deck.cards = list(state['cards'])
+        deck._construct_card_map()
+
+        g.players = []
+        for ps in state['players']:
+            p = SimPlayer.__new__(SimPlayer)
+            p.id = None
+            _set_fields(p, p.scalar_fields, p.list_fields, ps)
+            g.players.append(p)
+
+        g.round = None
+        if state['round'] is not None:
+            g.round = r = SimRound.__new__(SimRound)
+            r.game_state = g
+            _set_fields(r, r.scalar_fields, r.list_fields, state['round'])
+        return g
+
+    @classmethod
+    def from_bytes(cls, data, journal=()):
+        """ builds a game from GameStateBase.to_bytes() """
+        from plyus import packing
+        return cls.from_checkpoint(packing.unpack(data), journal)
+
+    def copy_to_model(self, model):
+        """ writes this game's state back onto a persistent GameState and its
+            players, round and deck.  Players are matched up by id, or by name
+            for players that haven't been saved, since seats are only dealt at
+            the start of the game (names are unique in a game, the journal needs that). """
+        # a new round shuffles with the model's random stream and clears the
+        # players' roles, so it is made first and everything is copied over it
+        if self.round is not None and model.round is None:
+            model.round = model.new_round()
+
+        # only the journal entries and checkpoints the model doesn't have yet are written
+        model_moves = model.num_moves or 0
+        for seq in range(model_moves, self.num_moves):
+            model.journal_move(seq, self.journal[seq])
+        for seq, state in self.checkpoints:
+            if seq >= model_moves:
+                model.save_checkpoint(seq, state)
+        _set_scalars(model, self.scalar_fields, _scalars(self, self.scalar_fields))
+
+        model.building_card_deck.cards = list(self.building_card_deck.cards)
+
+        if self.round is not None:
+            r = self.round
+            _set_scalars(model.round, r.scalar_fields, _scalars(r, r.scalar_fields))
+            _set_lists(model.round, r.list_fields, _lists(r, r.list_fields))
+
+        by_id = dict((mp.id, mp) for mp in model.players if mp.id is not None)
+        by_name = dict((mp.name, mp) for mp in model.players)
+        model_players = []
+        for p in self.players:
+            mp = by_id.get(p.id) if p.id is not None else by_name.get(p.name)
+            if mp is None:
+                raise FatalPlyusError("No player %s in game %s to copy onto" % (p.name, model.id))
+            _set_scalars(mp, p.scalar_fields, _scalars(p, p.scalar_fields))
+            _set_lists(mp, p.list_fields, _lists(p, p.list_fields))
+            model_players.append(mp)
+        # keep the model's players in seat order, like the game's
+        model.players[:] = model_players
@@ -0,0 +1,76 @@
+"""Structured events from the game engine.
+
+The referee and game state announce what happens in a game (roles picked,
+gold stolen, buildings razed, rounds finished...) as small namedtuples.
+Anything interested subscribes a callable.  Call sites check the module
+level `active` flag before building an event, so when nothing is
+subscribed an event costs one attribute lookup:
+
+    if events.active:
+        events.emit(events.GoldStolen(...))
+"""
+
+import logging
+from collections import namedtuple
+
+RolePicked = namedtuple('RolePicked', 'game_id round_num player role')
+RoleHidden = namedtuple('RoleHidden', 'game_id round_num player role')
+RoleMurdered = namedtuple('RoleMurdered', 'game_id round_num player role')
+RoleMugged = namedtuple('RoleMugged', 'game_id round_num player role')
+GoldStolen = namedtuple('GoldStolen', 'game_id round_num thief victim gold')
+BonusGold = namedtuple('BonusGold', 'game_id round_num player gold')
+BonusCards = namedtuple('BonusCards', 'game_id round_num player num_cards')
+BuildingBuilt = namedtuple('BuildingBuilt', 'game_id round_num player card cost')
+BuildingRazed = namedtuple('BuildingRazed', 'game_id round_num raider victim card cost')
+RoundFinished = namedtuple('RoundFinished', 'game_id round_num crown')
+GameFinished = namedtuple('GameFinished', 'game_id round_num winner')
+
+active = False
+_subscribers = []
+
+
+def subscribe(fn):
+    global active
+    _subscribers.append(fn)
+    active = True
+
+
+def unsubscribe(fn):
+    global active
+    _subscribers.remove(fn)
+    active = bool(_subscribers)
+
+
+def emit(event):
+    for fn in _subscribers:
+        fn(event)
+
+
+def log_event(event):
+    """ a subscriber that sends events to the log """
+    logging.info("event: %s", event)
+
+
+class Recorder(object):
+    """ collects events while in a with block:
+
+            with events.Recorder() as rec:
+                referee.handle_move(move)
+            rec.events
+    """
+
+    def __init__(self, *types):
+        self.types = types
+        self.events = []
+
+    def __call__(self, event):
+        if not self.types or isinstance(event, self.types):
+            self.events.append(event)
+
+    def __enter__(self):
+        subscribe(self)
+        return self
+
+    def __exit__(self, *exc):
+        unsubscribe(self)
+        return False
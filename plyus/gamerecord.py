@@ -0,0 +1,150 @@
+from plyus.engine import SimGameState
+from plyus.referee import Referee
+from plyus.mutable import JSONEncoded
+from plyus import journal
+from plyus import db
+
+
+class GameRecordMove(db.Model):
+    """ one entry in a GameRecord's journal.  The key is known up front, so a
+        batch of moves goes in as a single insert """
+    __tablename__ = 'gamerecordmoves'
+
+    game_record_id = db.Column(db.Integer, db.ForeignKey('gamerecords.id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    player = db.Column(db.Integer)
+    action = db.Column(JSONEncoded)
+
+    def __init__(self, seq, player, action):
+        self.seq = seq
+        self.player = player
+        self.action = action
+
+    def to_move(self):
+        return {'player': self.player, 'action': self.action}
+
+
+class GameRecordCheckpoint(db.Model):
+    """ the whole state of a GameRecord's game just after journal entry seq, see
+        GameStateBase.checkpoint """
+    __tablename__ = 'gamerecordcheckpoints'
+
+    game_record_id = db.Column(db.Integer, db.ForeignKey('gamerecords.id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    state = db.Column(JSONEncoded)
+
+    def __init__(self, seq, state):
+        self.seq = seq
+        self.state = state
+
+
+class GameRecord(db.Model):
+    """A whole game kept in one row, as an alternative to GameState and its
+    players, round and deck rows.  The game is stored packed (see
+    plyus.packing), with a few header columns for listing games without
+    unpacking them, and played as an in-memory SimGameState, so its players
+    and round only exist while it is loaded.  Playing a move is one select
+    and one update, plus one insert for the journal and another for a
+    checkpoint, when the move gets one (see plyus.journal).
+
+    version is bumped on every save and checked by the update, so when two
+    requests play the same game at once the second one to commit fails with
+    StaleDataError instead of overwriting the first."""
+    __tablename__ = 'gamerecords'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    stage = db.Column(db.String)
+    num_players = db.Column(db.Integer)
+    cur_player_index = db.Column(db.Integer)
+    num_moves = db.Column(db.Integer)
+    winner = db.Column(db.String)
+    template = db.Column(db.String)
+    state = db.Column(db.LargeBinary)
+    # the id of the user playing each seat, by position
+    user_ids = db.Column(JSONEncoded)
+    # append only, so they are never loaded just to add a move
+    journal_records = db.relationship(GameRecordMove, lazy='dynamic', order_by=GameRecordMove.seq)
+    checkpoint_records = db.relationship(GameRecordCheckpoint, lazy='dynamic',
+                                         order_by=GameRecordCheckpoint.seq)
+
+    __mapper_args__ = {'version_id_col': version}
+
+    def __init__(self, game, user_ids=None):
+        self.user_ids = user_ids
+        self.save(game)
+
+    def seat_for_user(self, user_id):
+        """ the position of the seat user_id plays, or None """
+        if self.user_ids is None or user_id not in self.user_ids:
+            return None
+        return self.user_ids.index(user_id)
+
+    def load(self):
+        """ the game, as a SimGameState.  Its journal only holds the moves played
+            after it was loaded, use get_journal() for the rest. """
+        g = SimGameState.from_bytes(self.state)
+        g.id = self.id
+        return g
+
+    def save(self, game):
+        """ stores game, which was loaded from this record or is being put in it """
+        old_moves = self.num_moves or 0
+        new_moves = game.num_moves - old_moves
+        if new_moves:
+            moves = game.get_journal()
+            for seq, move in enumerate(moves[len(moves) - new_moves:], old_moves):
+                self.journal_records.append(GameRecordMove(seq, move['player'], move['action']))
+            for seq, state in game.checkpoints:
+                if seq >= old_moves:
+                    self.checkpoint_records.append(GameRecordCheckpoint(seq, state))
+
+        self.stage = game.stage
+        self.num_players = game.num_players
+        self.cur_player_index = game.cur_player_index
+        self.num_moves = game.num_moves
+        self.winner = game.winner
+        self.template = game.building_card_deck.template
+        self.state = game.to_bytes()
+
+    def get_journal(self, end=None, start=0):
+        """ the journal entries from seq start up to before seq end, or all of them """
+        records = self.journal_records
+        if start:
+            records = records.filter(GameRecordMove.seq >= start)
+        if end is not None:
+            records = records.filter(GameRecordMove.seq < end)
+        return [r.to_move() for r in records]
+
+    def nearest_checkpoint(self, seq):
+        """ (seq, state) for the last checkpoint at or before seq, or None """
+        c = (self.checkpoint_records.filter(GameRecordCheckpoint.seq <= seq)
+             .order_by(None).order_by(GameRecordCheckpoint.seq.desc()).first())
+        if c is None:
+            return None
+        return c.seq, c.state
+
+    def game_at(self, seq):
+        """ an in-memory copy of the game as it was just after journal entry seq,
+            restored from the nearest checkpoint with only the moves since replayed """
+        game = self
+        if self.nearest_checkpoint(seq) is None:
+            # the game was put in the record without its checkpoints, so it is
+            # played again from the start, which needs the whole journal
+            game = self.load()
+            game.journal = self.get_journal()
+        g = journal.game_at(game, seq)
+        g.id = self.id
+        return g
+
+    def perform_moves(self, moves, since_version=None, compact=False, commit=None, player_index=None):
+        """ Referee.perform_moves on the stored game, saving it if they all go
+            through, then calling commit if it is given """
+        game = self.load()
+
+        def save():
+            self.save(game)
+            if commit is not None:
+                commit()
+
+        return Referee.for_game(game).perform_moves(moves, since_version, compact, save, player_index)
@@ -0,0 +1,66 @@
+"""Replaying games from their move journal.
+
+Every move accepted by Referee.perform_move is appended to the game's
+journal (GameStateBase.record_move), after an entry for start_game that
+lists the players in the order they joined.  Since all the randomness in a
+game comes from base_seed, the seed and the journal are enough to play the
+whole game again.
+
+Checkpoints (GameStateBase.checkpoint) are saved every checkpoint_interval
+moves and at the start of each round, so going back to any point in a game
+only replays the moves since the nearest one."""
+
+from plyus.engine import SimGameState, SimPlayer
+from plyus.errors import FatalPlyusError
+from plyus.referee import Referee
+
+
+def rebuild(base_seed, num_players, deck_template, moves):
+    """ plays a game again, in memory, from its seed and journal """
+    if not moves or moves[0]['action']['name'] != 'start_game':
+        raise FatalPlyusError("journal doesn't start with start_game")
+
+    players = [SimPlayer(name) for name in moves[0]['action']['players']]
+    game = SimGameState(base_seed, players[0], num_players, deck_template)
+    for p in players[1:]:
+        game.add_player(p)
+    game.start_game()
+
+    replay(game, moves[1:])
+    return game
+
+
+def replay(game, moves):
+    """ plays journal entries onto a game, journaling them as it goes """
+    ref = Referee(game)
+    for move in moves:
+        round_num = game.round_num
+        ref.handle_move(move)
+        game.record_move(move, new_round=game.round_num != round_num)
+
+
+def rebuild_game(game):
+    """ an in-memory copy of a game, persistent or not, rebuilt from its journal """
+    g = rebuild(game.base_seed, game.num_players, game.building_card_deck.template, game.get_journal())
+    g.id = game.id
+    return g
+
+
+def game_at(game, seq):
+    """ an in-memory copy of a game as it was just after journal entry seq.  Only
+        the moves since the nearest checkpoint are read, and they are all the
+        copy's journal holds, as with GameRecord.load(). """
+    checkpoint = game.nearest_checkpoint(seq)
+    if checkpoint is None:
+        moves = game.get_journal(seq + 1)
+        if len(moves) <= seq:
+            raise FatalPlyusError("game %s has no journal entry %s" % (game.id, seq))
+        return rebuild(game.base_seed, game.num_players, game.building_card_deck.template, moves)
+
+    cp_seq, state = checkpoint
+    moves = game.get_journal(seq + 1, cp_seq + 1)
+    if len(moves) < seq - cp_seq:
+        raise FatalPlyusError("game %s has no journal entry %s" % (game.id, seq))
+    g = SimGameState.from_checkpoint(state)
+    replay(g, moves)
+    return g
@@ -0,0 +1,22 @@
+from plyus.mutable import JSONEncoded
+from plyus import db
+
+
+class MoveRecord(db.Model):
+    """ one accepted move in a game's journal, see GameStateBase.record_move """
+    __tablename__ = 'moverecords'
+    __table_args__ = (db.UniqueConstraint('game_state_id', 'seq'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    game_state_id = db.Column(db.Integer, db.ForeignKey('gamestates.id'), nullable=False, index=True)
+    seq = db.Column(db.Integer, nullable=False)
+    player = db.Column(db.Integer)
+    action = db.Column(JSONEncoded)
+
+    def __init__(self, seq, player, action):
+        self.seq = seq
+        self.player = player
+        self.action = action
+
+    def to_move(self):
+        return {'player': self.player, 'action': self.action}
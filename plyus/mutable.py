@@ -1,7 +1,11 @@
 import json
+import sys
+from array import array
 
+from sqlalchemy import inspect
 from sqlalchemy.ext.mutable import Mutable
-from sqlalchemy.types import TypeDecorator, VARCHAR
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.types import TypeDecorator, VARCHAR, LargeBinary
 
 from . import util
 
@@ -70,4 +74,50 @@ class JSONEncoded(TypeDecorator):
     def process_result_value(self, value, dialect):
         if value is not None:
             value = json.loads(value, object_hook=util.dict_to_object)
-        return value
\ No newline at end of file
+        return value
+
+
+class _RawBinary(LargeBinary):
+    # hands back whatever the driver gives, so IntArray can tell blobs from json text
+    def result_processor(self, dialect, coltype):
+        return None
+
+
+class IntArray(TypeDecorator):
+    """Represents a list of small unsigned ints as a packed little endian
+    array('H') blob.  Rows written by JSONEncoded are still read, and are
+    written back packed the next time they change, or by repack()."""
+
+    impl = _RawBinary
+
+    typecode = 'H'
+    _swap = sys.byteorder != 'little'
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            a = array(self.typecode, value)
+            if self._swap:
+                a.byteswap()
+            value = a.tobytes()
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return json.loads(value)
+        a = array(self.typecode)
+        a.frombytes(value)
+        if self._swap:
+            a.byteswap()
+        return a.tolist()
+
+
+def repack(session, model):
+    """ marks every IntArray column of every row of model as changed, so the
+        next commit writes any still stored as json back packed """
+    columns = [c.key for c in inspect(model).columns if isinstance(c.type, IntArray)]
+    for row in session.query(model):
+        for key in columns:
+            if getattr(row, key) is not None:
+                flag_modified(row, key)
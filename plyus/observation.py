@@ -0,0 +1,162 @@
+"""Fixed size numeric observations of a game, for bots and learning.
+
+encode(game, player_index, out) writes what that player can see of the
+game into a float32 vector of OBS_SIZE, without going through
+to_dict_for_player and json.  Only what the dicts would show that player
+is encoded: the role draw pile only while they are picking, and hands and
+roles only for themselves.
+
+Seats are relative to the observer: seat 0 is the observer, seat 1 the
+player after them, and so on, so the same vector position always means the
+same thing to a bot whatever seat it plays from.  SECTIONS gives the layout,
+and OFFSETS[name] is where each section starts."""
+
+import numpy as np
+
+from plyus.catalog import COLORS
+from plyus.engine import Stage, Phase, Step
+
+MAX_PLAYERS = 6
+NUM_ROLES = 8
+MAX_COST = 6  # costs above this are counted as MAX_COST
+
+STAGES = (Stage.PRE_GAME, Stage.PLAYING, Stage.END_GAME, Stage.GAME_OVER)
+PHASES = (Phase.PICK_ROLES, Phase.PLAY_TURNS)
+STEPS = (Step.NO_STEP, Step.PICK_ROLE, Step.HIDE_ROLE, Step.COINS_OR_BUILDING, Step.KEEP_CARD,
+         Step.BUILD_BUILDING, Step.FINISH)
+
+# per seat: in game, gold, cards in hand, buildings on table, table by color,
+# table points, revealed roles, final points
+SEAT_SIZE = 1 + 1 + 1 + 1 + len(COLORS) + 1 + NUM_ROLES + 1
+
+SECTIONS = (
+    ('stage', len(STAGES)),
+    ('phase', len(PHASES)),
+    ('step', len(STEPS)),
+    ('num_players', MAX_PLAYERS - 1),
+    ('round_num', 1),
+    ('deck_len', 1),
+    ('cur_seat', MAX_PLAYERS),
+    ('crown_seat', MAX_PLAYERS),
+    ('face_up_roles', NUM_ROLES),
+    ('role_draw_pile', NUM_ROLES),
+    ('used_power', MAX_PLAYERS),
+    ('taken_bonus', MAX_PLAYERS),
+    ('seven_builds_left', 1),
+    ('seats', MAX_PLAYERS * SEAT_SIZE),
+    ('hand_colors', len(COLORS)),
+    ('hand_costs', MAX_COST),
+    ('hand_affordable', 1),
+    ('buffer_colors', len(COLORS)),
+    ('buffer_costs', MAX_COST),
+    ('my_roles', NUM_ROLES),
+    ('my_cur_role', NUM_ROLES),
+)
+
+OFFSETS = {}
+OBS_SIZE = 0
+for _name, _size in SECTIONS:
+    OFFSETS[_name] = OBS_SIZE
+    OBS_SIZE += _size
+
+_stage_index = dict((s, i) for i, s in enumerate(STAGES))
+_phase_index = dict((s, i) for i, s in enumerate(PHASES))
+_step_index = dict((s, i) for i, s in enumerate(STEPS))
+
+_ids_dtype = np.intp
+
+
+def new_observation():
+    return np.zeros(OBS_SIZE, dtype=np.float32)
+
+
+def _one_hot(out, section, index):
+    if index is not None:
+        out[OFFSETS[section] + index] = 1
+
+
+def _roles(out, offset, roles):
+    for r in roles:
+        out[offset + r - 1] = 1
+
+
+def _costs(catalog, ids):
+    costs = np.minimum(catalog.cost[ids], MAX_COST)
+    return np.bincount(costs, minlength=MAX_COST + 1)[1:]
+
+
+def encode(game, player_index, out=None):
+    """ writes player_index's view of game into out (a float32 vector of
+        OBS_SIZE, made if not given) and returns it """
+    if out is None:
+        out = new_observation()
+    else:
+        out.fill(0)
+
+    n = game.num_players
+    catalog = game.building_card_deck.get_catalog()
+    rnd = game.round
+    me = game.players[player_index]
+
+    def seat(position):
+        return (position - player_index) % n
+
+    _one_hot(out, 'stage', _stage_index.get(game.stage))
+    _one_hot(out, 'phase', _phase_index.get(game.phase))
+    _one_hot(out, 'step', _step_index.get(game.step))
+    _one_hot(out, 'num_players', n - 2)
+    out[OFFSETS['round_num']] = game.round_num
+    out[OFFSETS['deck_len']] = len(game.building_card_deck.cards)
+    if game.stage != Stage.PRE_GAME:
+        _one_hot(out, 'cur_seat', seat(game.cur_player_index))
+        _one_hot(out, 'crown_seat', seat(game.player_with_crown_token))
+
+    if rnd is not None:
+        _roles(out, OFFSETS['face_up_roles'], rnd.face_up_roles)
+        if player_index == game.cur_player_index and game.phase == Phase.PICK_ROLES:
+            _roles(out, OFFSETS['role_draw_pile'], rnd.role_draw_pile)
+        for p in range(n):
+            if rnd.has_used_power_for(p):
+                _one_hot(out, 'used_power', seat(p))
+            if rnd.has_taken_bonus_for(p):
+                _one_hot(out, 'taken_bonus', seat(p))
+        out[OFFSETS['seven_builds_left']] = rnd.num_seven_builds_left
+
+    seats = out[OFFSETS['seats']:OFFSETS['seats'] + MAX_PLAYERS * SEAT_SIZE].reshape(MAX_PLAYERS, SEAT_SIZE)
+    owners = []
+    table_ids = []
+    for p in game.players:
+        s = seat(p.position)
+        row = seats[s]
+        row[0] = 1
+        row[1] = p.gold
+        row[2] = len(p.buildings_in_hand)
+        row[3] = len(p.buildings_on_table)
+        _roles(row, 5 + len(COLORS), p.revealed_roles)
+        row[SEAT_SIZE - 1] = p.points or 0
+        owners.extend([s] * len(p.buildings_on_table))
+        table_ids.extend(p.buildings_on_table)
+
+    # every table's colors and points in one go
+    owners = np.asarray(owners, dtype=_ids_dtype)
+    table_ids = np.asarray(table_ids, dtype=_ids_dtype)
+    by_color = np.bincount(owners * len(COLORS) + catalog.color_codes[table_ids],
+                           minlength=MAX_PLAYERS * len(COLORS))
+    seats[:, 4:4 + len(COLORS)] = by_color.reshape(MAX_PLAYERS, len(COLORS))
+    seats[:, 4 + len(COLORS)] = np.bincount(owners, weights=catalog.points[table_ids], minlength=MAX_PLAYERS)
+
+    hand = np.asarray(me.buildings_in_hand, dtype=_ids_dtype)
+    buffer = np.asarray(me.buildings_buffer, dtype=_ids_dtype)
+    o = OFFSETS['hand_colors']
+    out[o:o + len(COLORS)] = catalog.color_counts(hand)
+    o = OFFSETS['hand_costs']
+    out[o:o + MAX_COST] = _costs(catalog, hand)
+    out[OFFSETS['hand_affordable']] = np.count_nonzero(catalog.cost[hand] <= me.gold)
+    o = OFFSETS['buffer_colors']
+    out[o:o + len(COLORS)] = catalog.color_counts(buffer)
+    o = OFFSETS['buffer_costs']
+    out[o:o + MAX_COST] = _costs(catalog, buffer)
+    _roles(out, OFFSETS['my_roles'], me.roles)
+    if me.cur_role is not None:
+        _one_hot(out, 'my_cur_role', me.cur_role - 1)
+    return out
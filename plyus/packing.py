@@ -0,0 +1,336 @@
+"""A compact binary form of a whole game, for caching, snapshots, handing
+games to worker processes and archiving.
+
+pack(game) turns a game into bytes, and unpack(data) turns them into the
+same dict as GameStateBase.checkpoint(), for SimGameState.from_checkpoint().
+The layout of each version is frozen in FIELDS below, rather than taken
+from the engine, so a blob always reads back the way it was written.  When
+the engine's fields change, add a new version there and bump
+FORMAT_VERSION (tests/test_packing.py checks they match).  The game, each
+player and the round are one fixed size struct each, and every id list and string in the game
+goes into one array and one run of bytes in front of them, which are
+counted in the header.
+
+Every blob starts with MAGIC and FORMAT_VERSION.  A game that doesn't fit
+the format (a seed too big for 64 bits, say) is packed as json instead, and
+unpack() reads either, so callers never have to care which they got."""
+
+import json
+import operator
+import struct
+import sys
+from array import array
+
+from plyus import util
+from plyus.engine import Stage, Phase, Step
+from plyus.errors import FatalPlyusError
+
+MAGIC = b'PLYG'
+FORMAT_VERSION = 1
+
+# the order of these is part of the format, only ever add to the end
+STAGES = (Stage.PRE_GAME, Stage.PLAYING, Stage.END_GAME, Stage.GAME_OVER)
+PHASES = (Phase.PICK_ROLES, Phase.PLAY_TURNS)
+STEPS = (Step.NO_STEP, Step.COINS_OR_BUILDING, Step.KEEP_CARD, Step.MURDER, Step.STEAL, Step.RAZE,
+         Step.BUILD_BUILDING, Step.PICK_ROLE, Step.HIDE_ROLE, Step.FINISH)
+
+# magic, version, number of players, has round, number of ids, bytes of strings
+_header = struct.Struct('<4sBBBII')
+_swap = sys.byteorder != 'little'
+
+
+# A kind says how one field is stored.  fmt is its part of the record's
+# struct, put() gives the value for the struct, adding any ids or string
+# bytes to the game's, and get() turns it back, taking them from the reader.
+# None is stored as a sentinel, so every field may be None.
+
+class _Int(object):
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.none = -(1 << (struct.calcsize(fmt) * 8 - 1))
+
+    def put(self, v, ids, strs):
+        return self.none if v is None else v
+
+    def get(self, v, reader):
+        return None if v == self.none else v
+
+
+class _Bool(_Int):
+    def __init__(self):
+        _Int.__init__(self, 'b')
+
+    def get(self, v, reader):
+        return None if v == self.none else bool(v)
+
+
+class _Enum(object):
+    fmt = 'b'
+
+    def __init__(self, values):
+        self.values = values
+        self.index = dict((v, i) for i, v in enumerate(values))
+
+    def put(self, v, ids, strs):
+        return -1 if v is None else self.index[v]
+
+    def get(self, v, reader):
+        return None if v < 0 else self.values[v]
+
+
+class _Str(object):
+    fmt = 'i'  # length in bytes, -1 for None
+
+    def put(self, v, ids, strs):
+        if v is None:
+            return -1
+        b = v.encode('utf-8')
+        strs.append(b)
+        return len(b)
+
+    def get(self, n, reader):
+        if n < 0:
+            return None
+        start = reader.str_pos
+        reader.str_pos += n
+        return reader.strs[start:reader.str_pos].decode('utf-8')
+
+
+class _Ids(object):
+    fmt = 'i'  # number of ids, -1 for None
+
+    def put(self, v, ids, strs):
+        if v is None:
+            return -1
+        ids.extend(v)
+        return len(v)
+
+    def get(self, n, reader):
+        if n < 0:
+            return None
+        start = reader.id_pos
+        reader.id_pos += n
+        return reader.ids[start:reader.id_pos]
+
+
+class _OptionalIds(_Ids):
+    """ ids that may be None, stored as -1 """
+    def put(self, v, ids, strs):
+        if v is None:
+            return -1
+        return _Ids.put(self, [-1 if x is None else x for x in v], ids, strs)
+
+    def get(self, n, reader):
+        xs = _Ids.get(self, n, reader)
+        if xs is None:
+            return None
+        return [None if x == -1 else x for x in xs]
+
+
+class _Pairs(_Ids):
+    """ [a, b] pairs, flattened """
+    def put(self, v, ids, strs):
+        if v is None:
+            return -1
+        for pair in v:
+            ids.extend(pair)
+        return len(v)
+
+    def get(self, n, reader):
+        xs = _Ids.get(self, n * 2, reader)
+        if xs is None:
+            return None
+        return [xs[i:i + 2] for i in range(0, len(xs), 2)]
+
+
+class _Reader(object):
+    def __init__(self, ids, strs):
+        self.ids = ids
+        self.id_pos = 0
+        self.strs = strs
+        self.str_pos = 0
+
+
+INT = _Int('q')
+SMALL = _Int('h')
+BOOL = _Bool()
+STR = _Str()
+IDS = _Ids()
+OPTIONAL_IDS = _OptionalIds()
+PAIRS = _Pairs()
+ID_TYPECODE = 'h'
+
+KINDS = {
+    'stage': _Enum(STAGES),
+    'step': _Enum(STEPS),
+    'phase': _Enum(PHASES),
+    'base_seed': INT,
+    'rng_counter': INT,
+    'num_players': SMALL,
+    'round_num': SMALL,
+    'cur_player_index': SMALL,
+    'player_with_crown_token': SMALL,
+    'winner': STR,
+    'num_moves': INT,
+
+    'name': STR,
+    'position': SMALL,
+    'gold': SMALL,
+    'cur_role': SMALL,
+    'rainbow_bonus': BOOL,
+    'first_to_eight_buildings': BOOL,
+    'points': SMALL,
+    'buildings_on_table': IDS,
+    'buildings_in_hand': IDS,
+    'buildings_buffer': IDS,
+    'roles': IDS,
+    'revealed_roles': IDS,
+
+    'used_power_bits': INT,
+    'taken_bonus_bits': INT,
+    'num_seven_builds_left': SMALL,
+    'dead_role': SMALL,
+    'mugged_role': SMALL,
+    'num_roles_picked': SMALL,
+    'turn_cursor': SMALL,
+    'role_owners': OPTIONAL_IDS,
+    'turn_order': PAIRS,
+    'role_draw_pile': IDS,
+    'face_up_roles': IDS,
+    'face_down_roles': IDS,
+}
+
+
+class Schema(object):
+    """ packs the given fields of an object into one struct, and unpacks them as a dict """
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.kinds = tuple(KINDS[f] for f in self.fields)
+        self.getter = operator.attrgetter(*self.fields)
+        self.struct = struct.Struct('<' + ''.join(k.fmt for k in self.kinds))
+        # most fields are plain ints and id lists, which are done inline.  Their
+        # ids go in first, then those of the other fields, in field order.
+        self.ints = [(i, k.none) for i, k in enumerate(self.kinds) if type(k) is _Int]
+        self.ids = [i for i, k in enumerate(self.kinds) if type(k) is _Ids]
+        self.others = [(i, k) for i, k in enumerate(self.kinds) if type(k) not in (_Int, _Ids)]
+
+    def pack(self, obj, ids, strs):
+        values = list(self.getter(obj))
+        for i, none in self.ints:
+            if values[i] is None:
+                values[i] = none
+        for i in self.ids:
+            v = values[i]
+            if v is None:
+                values[i] = -1
+            else:
+                ids.extend(v)
+                values[i] = len(v)
+        for i, kind in self.others:
+            values[i] = kind.put(values[i], ids, strs)
+        return self.struct.pack(*values)
+
+    def unpack(self, data, offset, reader):
+        values = list(self.struct.unpack_from(data, offset))
+        for i, none in self.ints:
+            if values[i] == none:
+                values[i] = None
+        ids = reader.ids
+        pos = reader.id_pos
+        for i in self.ids:
+            n = values[i]
+            if n < 0:
+                values[i] = None
+            else:
+                values[i] = ids[pos:pos + n]
+                pos += n
+        reader.id_pos = pos
+        for i, kind in self.others:
+            values[i] = kind.get(values[i], reader)
+        return dict(zip(self.fields, values))
+
+
+# the fields of the game, player and round records, in order, for each format
+# version.  Never change a version once it is released, add a new one.
+FIELDS = {
+    1: {
+        'game': ('stage', 'step', 'phase', 'base_seed', 'rng_counter', 'num_players', 'round_num',
+                 'cur_player_index', 'player_with_crown_token', 'winner', 'num_moves'),
+        'player': ('name', 'position', 'gold', 'cur_role', 'rainbow_bonus', 'first_to_eight_buildings',
+                   'points', 'buildings_on_table', 'buildings_in_hand', 'buildings_buffer', 'roles',
+                   'revealed_roles'),
+        'round': ('used_power_bits', 'taken_bonus_bits', 'num_seven_builds_left', 'dead_role',
+                  'mugged_role', 'num_roles_picked', 'turn_cursor', 'role_owners', 'turn_order',
+                  'role_draw_pile', 'face_up_roles', 'face_down_roles'),
+    },
+}
+
+# version -> (game, player, round) schemas
+SCHEMAS = dict((version, (Schema(f['game']), Schema(f['player']), Schema(f['round'])))
+               for version, f in FIELDS.items())
+GAME, PLAYER, ROUND = SCHEMAS[FORMAT_VERSION]
+
+
+def pack(game):
+    """ bytes for the whole of game, json if it doesn't fit the format """
+    try:
+        return _pack(game)
+    except (struct.error, OverflowError, KeyError):
+        return util.to_json(game.checkpoint()).encode('utf-8')
+
+
+def _pack(game):
+    deck = game.building_card_deck
+    strs = []
+    ids = []
+    template_len = STR.put(deck.template, ids, strs)
+    cards_len = IDS.put(deck.cards, ids, strs)
+    records = [struct.pack('<ii', template_len, cards_len), GAME.pack(game, ids, strs)]
+    for p in game.players:
+        records.append(PLAYER.pack(p, ids, strs))
+    if game.round is not None:
+        records.append(ROUND.pack(game.round, ids, strs))
+
+    ids = array(ID_TYPECODE, ids)
+    if _swap:
+        ids.byteswap()
+    strs = b''.join(strs)
+    header = _header.pack(MAGIC, FORMAT_VERSION, len(game.players), game.round is not None, len(ids), len(strs))
+    return b''.join([header, ids.tobytes(), strs] + records)
+
+
+def unpack(data):
+    """ the checkpoint() dict for the game pack() was given """
+    if data[:len(MAGIC)] != MAGIC:
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+    magic, version, num_players, has_round, num_ids, num_str_bytes = _header.unpack_from(data, 0)
+    if version not in SCHEMAS:
+        raise FatalPlyusError("can't read packed game format version %s" % version)
+    game_schema, player_schema, round_schema = SCHEMAS[version]
+    offset = _header.size
+    ids = array(ID_TYPECODE)
+    end = offset + num_ids * ids.itemsize
+    ids.frombytes(data[offset:end])
+    if _swap:
+        ids.byteswap()
+    offset = end
+    end = offset + num_str_bytes
+    reader = _Reader(ids.tolist(), data[offset:end])
+    offset = end
+
+    template_len, cards_len = struct.unpack_from('<ii', data, offset)
+    offset += 8
+    state = {'template': STR.get(template_len, reader), 'cards': IDS.get(cards_len, reader)}
+    state['game'] = game_schema.unpack(data, offset, reader)
+    offset += game_schema.struct.size
+    state['players'] = []
+    for i in range(num_players):
+        state['players'].append(player_schema.unpack(data, offset, reader))
+        offset += player_schema.struct.size
+    state['round'] = None
+    if has_round:
+        state['round'] = round_schema.unpack(data, offset, reader)
+    return state
@@ -1,132 +1,425 @@
 import logging
+import operator
+import threading
+from collections import OrderedDict
 from . import util
-from .util import lowest_higher_than
-from plyus.misc import *
+from . import events
+from plyus.engine import Stage, Phase, Step
 from .errors import NotYourTurnError
 from .errors import IllegalActionError
 from .errors import NoSuchActionError
 
 
+# the phase, and the steps within it, in which each action can be taken
+action_rules = {
+    'pick_role': (Phase.PICK_ROLES, [Step.PICK_ROLE]),
+    'hide_role': (Phase.PICK_ROLES, [Step.HIDE_ROLE]),
+    'take_gold': (Phase.PLAY_TURNS, [Step.COINS_OR_BUILDING]),
+    'draw_cards': (Phase.PLAY_TURNS, [Step.COINS_OR_BUILDING]),
+    'keep_card': (Phase.PLAY_TURNS, [Step.KEEP_CARD]),
+    'build_building': (Phase.PLAY_TURNS, [Step.BUILD_BUILDING]),
+    'finish': (Phase.PLAY_TURNS, [Step.BUILD_BUILDING, Step.FINISH]),
+    'use_power': (Phase.PLAY_TURNS, [Step.COINS_OR_BUILDING, Step.BUILD_BUILDING, Step.FINISH]),
+    'take_bonus': (Phase.PLAY_TURNS, [Step.COINS_OR_BUILDING, Step.BUILD_BUILDING, Step.FINISH]),
+}
+
+
+def compile_action_table(rules):
+    """ turns {action: (phase, steps)} into {(phase, step): frozenset of actions} """
+    table = {}
+    for action_name, (phase, steps) in rules.items():
+        for step in steps:
+            table.setdefault((phase, step), set()).add(action_name)
+    return dict((k, frozenset(v)) for k, v in table.items())
+
+
+# attrgetters for Referee.save, by attribute names
+_getters = {}
+
+
+def _getter(attrs):
+    getter = _getters.get(attrs)
+    if getter is None:
+        getter = _getters[attrs] = operator.attrgetter(*attrs)
+    return getter
+
+
 class Referee:
+    # roles that collect bonus gold, and the color of building they collect for
+    bonus_colors = {4: "yellow", 5: "blue", 6: "green", 8: "red"}
+
+    # (phase, step) -> the actions allowed then
+    action_table = compile_action_table(action_rules)
+
+    # referees kept for recently used games, per thread, see for_game()
+    max_cached = 256
+    _cache = threading.local()
+
+    # a referee holds the game and the last state it sent each player, for
+    # working out deltas (see remember_sent).  The handler tables are shared by
+    # the class (see the bottom), and the random state lives in the game.
     def __init__(self, gs):
         self.game_state = gs
-        self.random_gen = gs.get_random_gen()
-        self.action_handlers = {
-            'pick_role': self.handle_pick_role
-            , 'hide_role': self.handle_hide_role
-            , 'take_gold': self.handle_take_gold
-            , 'build_building': self.handle_build_building
-            , 'draw_cards': self.handle_draw_cards
-            , 'keep_card': self.handle_keep_card
-            , 'finish': self.handle_finish
-            , 'use_power': self.handle_use_power
-            , 'take_bonus': self.handle_take_bonus
-        }
-        self.power_handlers = {
-            1: self.handle_power_1
-            , 2: self.handle_power_2
-            , 3: self.handle_power_3
-            , 8: self.handle_power_8
-        }
-
+        self.sent_states = {}
+        # while apply() runs, what the move changes, see save()
+        self.undo_log = None
+
+    # the referee for a game, reusing the one from last time while the game is
+    # in use.  Games are matched by id, so a game loaded again in a new session
+    # gets the same referee, rebound to the new object.  Each thread has its own
+    # referees, so a referee is never shared between requests running at once.
+    @classmethod
+    def for_game(cls, gs):
+        if gs.id is None:
+            return cls(gs)
+        referees = getattr(cls._cache, 'referees', None)
+        if referees is None:
+            referees = cls._cache.referees = OrderedDict()
+
+        ref = referees.pop(gs.id, None)
+        if ref is None:
+            ref = cls(gs)
+        ref.game_state = gs
+        referees[gs.id] = ref
+        if len(referees) > cls.max_cached:
+            referees.popitem(last=False)
+        return ref
 
     #TODO: validate that move is a valid move object.  possibly 
     # make an actual Move class that ensures validity
-    #TODO: validate that the player submitting this move
-    # matches the player in the move.  This might need to happen
-    # at a higher layer
-    def perform_move(self, move):
-        logging.info("-- in round %s, move is {%s}" % (self.game_state.round_num, move))
-
-        logging.debug('game_state is %s' % self.game_state)
-
+    # the reply is the state for the player whose turn it is next, and
+    # since_version is the version of the state that player already has.  If it
+    # is given, the reply is a delta from that state where possible, see
+    # get_state_update_as_json_for_player.  compact asks for card ids instead of
+    # whole buildings.
+    def perform_move(self, move, since_version=None, compact=False):
+        round_num = self.game_state.round_num
+        self.handle_move(move)
+        self.game_state.record_move(move, new_round=self.game_state.round_num != round_num)
+        return self.state_reply(since_version, compact)
+
+    # the reply for player_index, or the player whose turn it is.  commit, if
+    # given, is called before the state sent is remembered for deltas, so if it
+    # raises, the next delta isn't worked out from a state that was never saved.
+    def state_reply(self, since_version, compact, commit=None, player_index=None):
+        if player_index is None:
+            player_index = self.game_state.cur_player_index
+        reply, sent = self.state_update_for_player(player_index, since_version, compact)
+        if commit is not None:
+            commit()
+        self.remember_sent(player_index, sent)
+        return reply
+
+    # performs a list of moves, all or nothing.  If any move is illegal the game is
+    # put back as it was before the first one and the error is raised, so a
+    # client can send a whole turn and the caller commits once, by passing commit
+    # (see state_reply).  Events for the moves before the bad one will already
+    # have been sent.  The reply is the state for player_index, by default the
+    # player who made the moves, and since_version is the version that player has.
+    def perform_moves(self, moves, since_version=None, compact=False, commit=None, player_index=None):
+        gs = self.game_state
+        record = gs.snapshot()
+        accepted = []
+        try:
+            for move in moves:
+                round_num = gs.round_num
+                self.handle_move(move)
+                # the journal is only written once every move has gone through, so
+                # take any checkpoint now, while the game is just after this move
+                seq = gs.num_moves + len(accepted)
+                checkpoint = None
+                if gs.wants_checkpoint(seq, gs.round_num != round_num):
+                    checkpoint = gs.checkpoint()
+                    checkpoint['game']['num_moves'] = seq + 1
+                accepted.append((move, checkpoint))
+        except Exception:
+            gs.restore(record)
+            raise
+
+        for move, checkpoint in accepted:
+            gs.record_move(move, checkpoint=checkpoint)
+        if player_index is None and moves:
+            player_index = moves[0]['player']
+        return self.state_reply(since_version, compact, commit, player_index)
+
+    # reversible version of handle_move, for searching over moves without cloning.
+    # returns an undo record that can be passed to undo() to put the game back
+    # exactly as it was, including the deck order and any round change.  If the
+    # move is illegal the game is left untouched and the error is raised.
+    # The record only holds what the move changed: the game's and round's plain
+    # values, and whatever the handlers save().  Only a move that ends the round
+    # falls back to a whole snapshot.
+    def apply(self, move):
+        gs = self.game_state
+        # plain values are never lists, so they are kept as they are
+        getter = _getter(gs.scalar_fields)
+        log = self.undo_log = [(gs, gs.scalar_fields, getter, getter(gs))]
+        rnd = gs.round
+        if rnd is not None:
+            getter = _getter(rnd.scalar_fields)
+            log.append((rnd, rnd.scalar_fields, getter, getter(rnd)))
+        try:
+            self.handle_move(move)
+        except Exception:
+            self.undo(log)
+            raise
+        finally:
+            self.undo_log = None
+        return log
+
+    def undo(self, record):
+        for obj, attrs, getter, values in reversed(record):
+            if attrs is None:
+                obj.restore(values)
+                continue
+            # most saved values are left as they were, only put back the ones that changed
+            now = getter(obj)
+            if len(attrs) == 1:
+                now = (now,)
+            for attr, value, cur in zip(attrs, values, now):
+                if value is not cur:
+                    setattr(obj, attr, value)
+
+    # notes the current values of attrs of obj, before a handler changes them, so
+    # undo() can put them back.  Lists are copied.  Does nothing outside apply().
+    def save(self, obj, *attrs):
+        if self.undo_log is not None:
+            getter = _getter(attrs)
+            values = getter(obj)
+            if len(attrs) == 1:
+                values = (values,)
+            if list in map(type, values):
+                values = [v[:] if type(v) is list else v for v in values]
+            self.undo_log.append((obj, attrs, getter, values))
+
+    # does all the work of perform_move, without building the json response.
+    # self-play and simulation call this directly.
+    def handle_move(self, move):
+        gs = self.game_state
+
+        # verify that the game is being played, that this player is allowed to act
+        # right now, and that the action is legal, before any lookups or logging.
+        # END_GAME is still played, until its round is finished.
+        if gs.stage not in (Stage.PLAYING, Stage.END_GAME):
+            logging.debug("no moves are allowed in stage %s", gs.stage)
+            raise IllegalActionError("the game is not being played")
         player_index = move['player']
-        if player_index not in range(0, self.game_state.num_players):
-            raise IllegalActionError("Not a valid player")
+        if player_index != gs.cur_player_index:
+            if player_index not in range(0, gs.num_players):
+                raise IllegalActionError("Not a valid player")
+            logging.debug("not player %s's turn, it is %s's", player_index, gs.cur_player_index)
+            raise NotYourTurnError(player_index, gs.cur_player_index)
 
-        player = self.game_state.players[player_index]
         action = move['action']
-
-        logging.info('%s is attempting to take action: %s', player, action)
-        # verify that this player is allowed to act right now
-        if player.position != self.game_state.cur_player_index:
-            e = NotYourTurnError(player.position, self.game_state.cur_player_index)
-            logging.warn("about to raise not your turn: %r", e)
-            raise e
-
-        # verify that this action is legal
         action_name = action["name"]
         if action_name not in self.action_handlers:
+            logging.debug("no such action: %s", action_name)
             raise NoSuchActionError(action_name)
+        if action_name not in self.action_table.get((gs.phase, gs.step), ()):
+            logging.debug("%s not allowed in phase %s, step %s", action_name, gs.phase, gs.step)
+            raise IllegalActionError("%s not allowed now" % action_name)
+
+        logging.info("-- in round %s, player %s takes action: %s", gs.round_num, player_index, action)
 
         # perform the action
         cur_player = self.game_state.get_cur_plyr()
         handler = self.action_handlers[action_name]
-        handler(action, cur_player)
+        handler(self, action, cur_player)
 
         #building an 8th building triggers the end of the game
         if len(cur_player.buildings_on_table) >= 8:
             #if no one else has trigged the END_GAME yet, this player is first
             #to get 8 buildings, and gets a bonus
             if self.game_state.stage == Stage.PLAYING:
+                self.save(cur_player, 'first_to_eight_buildings')
                 cur_player.first_to_eight_buildings = True
                 self.game_state.stage = Stage.END_GAME
 
-        new_cur_player = self.game_state.cur_player_index
         logging.debug(" -- move handled.")
 
-        return self.get_current_state_as_json_for_player(new_cur_player)
-
-    def get_current_state_as_json_for_player(self, player_index):
-        # return the new state of the game
+    # the names of the actions the current player may try right now, according
+    # to the action table.  legal_moves() narrows this down to actual moves.
+    def allowed_actions(self):
+        gs = self.game_state
+        if gs.stage in (Stage.PRE_GAME, Stage.GAME_OVER):
+            return frozenset()
+        return self.action_table.get((gs.phase, gs.step), frozenset())
+
+    # returns every move the given player could legally make right now, in the
+    # same form perform_move takes.  This mirrors the checks done by the
+    # handlers, so anything returned here will be accepted by perform_move.
+    def legal_moves(self, player_index):
+        gs = self.game_state
+        if gs.stage in (Stage.PRE_GAME, Stage.GAME_OVER) or player_index != gs.cur_player_index:
+            return []
+
+        cur_player = gs.players[player_index]
+        step = gs.step
+        actions = []
+
+        if gs.phase == Phase.PICK_ROLES:
+            if step == Step.PICK_ROLE:
+                actions = [{'name': 'pick_role', 'target': r} for r in gs.round.role_draw_pile]
+            elif step == Step.HIDE_ROLE:
+                actions = [{'name': 'hide_role', 'target': r} for r in gs.round.role_draw_pile]
+
+        elif gs.phase == Phase.PLAY_TURNS:
+            if step == Step.COINS_OR_BUILDING:
+                # taking gold is always possible, drawing needs two cards in the deck
+                actions.append({'name': 'take_gold'})
+                if len(gs.building_card_deck.cards) >= 2:
+                    actions.append({'name': 'draw_cards'})
+            elif step == Step.KEEP_CARD:
+                actions = [{'name': 'keep_card', 'target': i} for i in range(len(cur_player.buildings_buffer))]
+            elif step == Step.BUILD_BUILDING:
+                actions = self.legal_build_actions(cur_player)
+
+            if step in (Step.BUILD_BUILDING, Step.FINISH):
+                actions.append({'name': 'finish'})
+
+            if step in (Step.COINS_OR_BUILDING, Step.BUILD_BUILDING, Step.FINISH):
+                actions.extend(self.legal_power_actions(cur_player))
+                if (cur_player.cur_role in self.bonus_colors and
+                        not gs.round.has_taken_bonus_for(cur_player.position)):
+                    actions.append({'name': 'take_bonus'})
+
+        return [{'player': player_index, 'action': a} for a in actions]
+
+    def legal_build_actions(self, cur_player):
+        deck = self.game_state.building_card_deck
+        actions = [{'name': 'build_building', 'target': 'skip'}]
+        for card_id in cur_player.buildings_in_hand:
+            if (card_id not in cur_player.buildings_on_table and
+                    deck.card_for_id(card_id).cost <= cur_player.gold):
+                actions.append({'name': 'build_building', 'target': card_id})
+        return actions
+
+    def legal_power_actions(self, cur_player):
+        gs = self.game_state
+        role = cur_player.cur_role
+        if gs.round.has_used_power_for(cur_player.position) or role not in self.power_handlers:
+            return []
+
+        if role == 1:
+            return [{'name': 'use_power', 'target': t} for t in range(2, 9)]
+
+        if role == 2:
+            return [{'name': 'use_power', 'target': t} for t in range(3, 9)]
+
+        if role == 3:
+            actions = [{'name': 'use_power', 'target': p.position}
+                       for p in gs.players if p.position != cur_player.position]
+            # any subset of the hand can be exchanged with the deck, but listing
+            # them all grows as 2**len(hand), so only offer exchanging none of it,
+            # each single card, and the whole hand.  handle_move takes any subset.
+            hand = cur_player.buildings_in_hand
+            actions.append({'name': 'use_power', 'target': 'deck', 'discards': []})
+            actions.extend({'name': 'use_power', 'target': 'deck', 'discards': [c]} for c in hand)
+            if len(hand) > 1:
+                actions.append({'name': 'use_power', 'target': 'deck', 'discards': list(hand)})
+            return actions
+
+        if role == 8:
+            if gs.step != Step.FINISH:
+                return []
+            deck = gs.building_card_deck
+            actions = []
+            for p in gs.players:
+                if len(p.buildings_on_table) >= 8 or p.cur_role == 5:
+                    continue
+                for card_id in p.buildings_on_table:
+                    if deck.card_for_id(card_id).cost - 1 <= cur_player.gold:
+                        actions.append({'name': 'use_power', 'target_player_id': p.position,
+                                        'target_card_id': card_id})
+            return actions
+
+        return []
+
+    def get_current_state_for_player(self, player_index, compact=False):
         for_player = self.game_state.players[player_index]
+        deck = self.game_state.building_card_deck
         d = {}
-        d['game'] = self.game_state.to_dict_for_player(for_player)
-        d['me'] = for_player.to_dict_for_private(self.game_state.building_card_deck)
-        j = util.to_json(d)
-        return j
+        # the state changes exactly when a move is journaled, so the move count is its version
+        d['version'] = self.game_state.num_moves
+        d['catalog'] = deck.get_catalog().ref()
+        d['game'] = self.game_state.to_dict_for_player(for_player, compact)
+        d['me'] = for_player.to_dict_for_private(deck, compact)
+        allowed = []
+        if player_index == self.game_state.cur_player_index:
+            allowed = sorted(self.allowed_actions())
+        d['allowed_actions'] = allowed
+        return d
+
+    def get_current_state_as_json_for_player(self, player_index, compact=False):
+        # return the new state of the game
+        reply, sent = self.state_update_for_player(player_index, None, compact)
+        self.remember_sent(player_index, sent)
+        return reply
+
+    # if this referee last sent the player the state at since_version, returns
+    # {'delta_since': since_version, 'changes': ...}, only the parts that changed
+    # (see util.dict_delta).  Otherwise the whole state, as from
+    # get_current_state_as_json_for_player, which the client should take as a resync.
+    def get_state_update_as_json_for_player(self, player_index, since_version, compact=False):
+        reply, sent = self.state_update_for_player(player_index, since_version, compact)
+        self.remember_sent(player_index, sent)
+        return reply
+
+    # the json for get_state_update_as_json_for_player, and the (version, compact,
+    # state) sent, which is left for the caller to pass to remember_sent.  The
+    # delta is only ever from a state this player was sent at since_version.
+    def state_update_for_player(self, player_index, since_version, compact):
+        d = self.get_current_state_for_player(player_index, compact)
+        base = None
+        if since_version is not None:
+            base = self.sent_states.get((player_index, since_version, compact))
+        if base is None:
+            reply = util.to_json(d)
+        else:
+            reply = util.to_json({'delta_since': since_version, 'changes': util.dict_delta(base, d)})
+        return reply, (d['version'], compact, d)
 
+    # sent_states is keyed by (player_index, version, compact), and only the
+    # latest version sent to each player is kept
+    def remember_sent(self, player_index, sent):
+        version, compact, d = sent
+        for key in [k for k in self.sent_states if k[0] == player_index and k[1] != version]:
+            del self.sent_states[key]
+        self.sent_states[(player_index, version, compact)] = d
 
-    def handle_use_power(self, action, cur_player):
-        self.validate_phase_and_step(Phase.PLAY_TURNS,
-                                     Step.BUILD_BUILDING,
-                                     Step.FINISH,
-                                     Step.COINS_OR_BUILDING)
 
+    def handle_use_power(self, action, cur_player):
         round = self.game_state.round
-        if round.has_used_power[cur_player.position]:
+        if round.has_used_power_for(cur_player.position):
             raise IllegalActionError("Already Used Power")
 
         handler = self.power_handlers[cur_player.cur_role]
-        handler(action, cur_player)
-        round.has_used_power[cur_player.position] = True
+        handler(self, action, cur_player)
+        round.mark_used_power(cur_player.position)
 
     def handle_finish(self, action, cur_player):
-        self.validate_phase_and_step(Phase.PLAY_TURNS, Step.BUILD_BUILDING, Step.FINISH)
-
         round = self.game_state.round
-        cur_role = cur_player.cur_role
-
-        role_to_plyr_map = round.gen_role_to_plyr_map()
 
-        logging.info("cur_player is %s, cur_role=%s" % (cur_player, cur_role))
-        next_role = lowest_higher_than(role_to_plyr_map.keys(), cur_role)
-        if next_role == round.dead_role:
-            next_role = lowest_higher_than(role_to_plyr_map.keys(), cur_role + 1)
+        logging.info("cur_player is %s, cur_role=%s", cur_player, cur_player.cur_role)
+        next_turn = round.advance_turn()
 
-        logging.info("next_role is %s  " % next_role)
+        logging.info("next turn is %s  ", next_turn)
         # if everyone has played, start a new round
-        if (next_role is None):
+        if (next_turn is None):
             #everyone_has_played: start next round
+            if self.undo_log is not None:
+                # a new round replaces the round and resets the players, so save it all
+                self.undo_log.append((self.game_state, None, None, self.game_state.snapshot()))
             self.game_state.finish_round()
             self.game_state.start_new_round()
 
         else:
-            #figure out who the next player is, based on the next cur_role to play.
+            #the next player is whoever has the next role to play.
             #reset the step for that player.
-            next_player = role_to_plyr_map[next_role]
+            next_role, next_player = next_turn
             self.game_state.cur_player_index = next_player
-            self.cur_player_index = role_to_plyr_map[next_role]
+            self.cur_player_index = next_player
+            self.save(self.game_state.players[next_player], 'cur_role')
             self.game_state.players[next_player].cur_role = next_role
             self.game_state.step = Step.COINS_OR_BUILDING
 
@@ -136,36 +429,46 @@ class Referee:
     def pre_action_effects(self, cur_player):
         rnd = self.game_state.round
 
+        self.save(cur_player, 'revealed_roles', 'gold')
         cur_player.revealed_roles.append(cur_player.cur_role)
         if cur_player.cur_role == rnd.mugged_role:
             stolen = cur_player.gold
             cur_player.gold = 0
-            mugger = rnd.gen_role_to_plyr_map()[2]
-            logging.info("Mugger[ %s ] has mugged [%s]" % (mugger, cur_player.name))
+            mugger = rnd.player_for_role(2)
+            self.save(self.game_state.players[mugger], 'gold')
+            logging.info("Mugger[ %s ] has mugged [%s]", mugger, cur_player.name)
             self.game_state.players[mugger].gold += stolen
-            #TODO: announce gold was stolen
+            if events.active:
+                gs = self.game_state
+                events.emit(events.GoldStolen(gs.id, gs.round_num, mugger, cur_player.position, stolen))
 
     #some things happen after a player "takes an action"
     # which means after they draw cards or take gold
     def post_action_effects(self, cur_player):
+        gs = self.game_state
         if cur_player.cur_role == 6:
+            self.save(cur_player, 'gold')
             cur_player.gold += 1
-            #TODO:  merchant getting a bonus gold needs to be an announced event
+            if events.active:
+                events.emit(events.BonusGold(gs.id, gs.round_num, cur_player.position, 1))
         if cur_player.cur_role == 7:
-            cards = util.draw_n(self.game_state.building_card_deck.cards, 2)
+            # the bonus is whatever is left, when the deck is nearly out
+            deck_cards = gs.building_card_deck.cards
+            self.save(gs.building_card_deck, 'cards')
+            self.save(cur_player, 'buildings_in_hand')
+            cards = util.draw_n(deck_cards, min(2, len(deck_cards)))
             cur_player.buildings_in_hand.extend(cards)
-            #TODO: announce player getting bonus cards
+            if events.active:
+                events.emit(events.BonusCards(gs.id, gs.round_num, cur_player.position, len(cards)))
 
     def handle_take_gold(self, action, cur_player):
-        self.validate_phase_and_step(Phase.PLAY_TURNS, Step.COINS_OR_BUILDING)
         self.pre_action_effects(cur_player)
+        self.save(cur_player, 'gold')
         cur_player.take_gold()
         self.post_action_effects(cur_player)
         self.game_state.step = Step.BUILD_BUILDING
 
     def handle_build_building(self, action, cur_player):
-        self.validate_phase_and_step(Phase.PLAY_TURNS, Step.BUILD_BUILDING)
-
         if 'target' not in action:
             logging.error("build action with no target")
             raise IllegalActionError()
@@ -189,9 +492,13 @@ class Referee:
                 logging.info("not enough gold!")
                 raise IllegalActionError()
 
+            self.save(cur_player, 'buildings_in_hand', 'buildings_on_table', 'gold')
             cur_player.buildings_in_hand.remove(target_id)
             cur_player.buildings_on_table.append(target_id)
             cur_player.gold = cur_player.gold - cost
+            if events.active:
+                gs = self.game_state
+                events.emit(events.BuildingBuilt(gs.id, gs.round_num, cur_player.position, target_id, cost))
 
         #unless current role is 7, we only get one build so next step is finish
         r = self.game_state.round
@@ -202,9 +509,11 @@ class Referee:
             self.game_state.step = Step.FINISH
 
     def handle_draw_cards(self, action, cur_player):
-        self.validate_phase_and_step(Phase.PLAY_TURNS, Step.COINS_OR_BUILDING)
-
+        if len(self.game_state.building_card_deck.cards) < 2:
+            raise IllegalActionError("Building deck is out of cards.")
         self.pre_action_effects(cur_player)
+        self.save(cur_player, 'buildings_buffer')
+        self.save(self.game_state.building_card_deck, 'cards')
         cur_player.take_cards(self.game_state.building_card_deck.cards)
         self.game_state.step = Step.KEEP_CARD
         logging.info("possible cards are %s", cur_player.buildings_buffer)
@@ -212,17 +521,18 @@ class Referee:
     #TODO: target should be an ID, not an index to keep consistent
     # with rest of actions
     def handle_keep_card(self, action, cur_player):
-        self.validate_phase_and_step(Phase.PLAY_TURNS, Step.KEEP_CARD)
         if 'target' not in action:
             logging.error("keep card action with no target")
             raise IllegalActionError()
 
         target_index = action['target']
-        if target_index < 0 or target_index > len(cur_player.buildings_buffer):
+        if target_index < 0 or target_index >= len(cur_player.buildings_buffer):
             logging.error("trying to keep card that wasn't drawn")
             raise IllegalActionError()
 
         target_id = cur_player.buildings_buffer[target_index]
+        self.save(cur_player, 'buildings_in_hand', 'buildings_buffer')
+        self.save(self.game_state.building_card_deck, 'cards')
         cur_player.buildings_in_hand.append(target_id)
         cur_player.buildings_buffer.remove(target_id)
         self.game_state.building_card_deck.cards.extend(cur_player.buildings_buffer)
@@ -231,8 +541,6 @@ class Referee:
 
 
     def handle_hide_role(self, action, cur_player):
-        self.validate_phase_and_step(Phase.PICK_ROLES, Step.HIDE_ROLE)
-
         if 'target' not in action:
             logging.error("hide role action with no target")
             raise IllegalActionError()
@@ -241,17 +549,20 @@ class Referee:
 
         if (target not in self.game_state.round.role_draw_pile):
             logging.error("hide role action with target not in draw pile")
+            raise IllegalActionError("role %s isn't in the draw pile" % target)
 
         round = self.game_state.round
+        self.save(round, 'role_draw_pile', 'face_down_roles')
         round.role_draw_pile.remove(target)
         round.face_down_roles.append(target)
+        if events.active:
+            gs = self.game_state
+            events.emit(events.RoleHidden(gs.id, gs.round_num, cur_player.position, target))
 
         self.game_state.advance_cur_player_index()
         self.game_state.step = Step.PICK_ROLE
 
     def handle_pick_role(self, action, cur_player):
-        self.validate_phase_and_step(Phase.PICK_ROLES, Step.PICK_ROLE)
-
         if 'target' not in action:
             logging.error("pick role action with no target")
             raise IllegalActionError()
@@ -260,17 +571,22 @@ class Referee:
 
         if (target not in self.game_state.round.role_draw_pile):
             logging.error("pick role action with target not in draw pile")
+            raise IllegalActionError("role %s isn't in the draw pile" % target)
 
         round = self.game_state.round
 
+        self.save(cur_player, 'roles')
+        self.save(round, 'role_draw_pile', 'role_owners', 'turn_order')
         cur_player.roles.append(target)
         round.mark_role_picked(target, cur_player.position)
-        role_to_plyr_map = round.gen_role_to_plyr_map()
+        if events.active:
+            gs = self.game_state
+            events.emit(events.RolePicked(gs.id, gs.round_num, cur_player.position, target))
 
         # handle 2 player special case
         # players must place a role card face down after their middle picks
         # to maintain uncertainty
-        num_roles_picked_so_far = len(role_to_plyr_map)
+        num_roles_picked_so_far = round.num_roles_picked
         if (self.game_state.num_players == 2 and num_roles_picked_so_far in [2, 3]):
             self.game_state.step = Step.HIDE_ROLE
             return
@@ -278,19 +594,18 @@ class Referee:
         #if all players have picked a role
         if (self.game_state.round.done_picking()):
             # it's time to play turns, in role number order.
-            # so figure out which role's turn it is, and set them
-            # to be current player.
-
-            roles_in_play = util.flatten(round.gen_plyr_to_role_map().values())
+            # so work out the turn order once, and make the player
+            # with the first role the current player.
 
-            current_role = lowest_higher_than(roles_in_play, 0)
-            cur_plyr_index = role_to_plyr_map[current_role]
+            round.schedule_turns()
+            current_role, cur_plyr_index = round.cur_turn()
             self.game_state.cur_player_index = cur_plyr_index
 
+            self.save(self.game_state.players[cur_plyr_index], 'cur_role')
             self.game_state.players[cur_plyr_index].cur_role = current_role
 
-            logging.info("Done Picking.  cur_role=%s, roles= %s, cur_plyr_pos=%s "
-                         % (current_role, cur_player.roles, self.game_state.cur_player_index))
+            logging.info("Done Picking.  cur_role=%s, roles= %s, cur_plyr_pos=%s ",
+                         current_role, cur_player.roles, self.game_state.cur_player_index)
             self.game_state.phase = Phase.PLAY_TURNS
             self.game_state.step = Step.COINS_OR_BUILDING
 
@@ -300,28 +615,25 @@ class Referee:
 
 
     def handle_take_bonus(self, action, cur_plyr):
-        self.validate_phase_and_step(Phase.PLAY_TURNS,
-                                     Step.BUILD_BUILDING,
-                                     Step.FINISH,
-                                     Step.COINS_OR_BUILDING)
-        color_map = {4: "yellow", 5: "blue", 6: "green", 8: "red"}
+        color_map = self.bonus_colors
 
         if cur_plyr.cur_role not in color_map:
             raise IllegalActionError("role %s doesn't get bonus gold" % cur_plyr.cur_role)
 
-        if self.game_state.round.has_taken_bonus[cur_plyr.position]:
+        if self.game_state.round.has_taken_bonus_for(cur_plyr.position):
             raise IllegalActionError("player has already taken bonus this round")
 
         color = color_map[cur_plyr.cur_role]
 
-        deck = self.game_state.building_card_deck
-
-        cards_on_table = map(deck.card_for_id, cur_plyr.buildings_on_table)
-
-        num_color = sum(1 for c in cards_on_table if c.color == color)
+        catalog = self.game_state.building_card_deck.get_catalog()
+        num_color = catalog.count_color(cur_plyr.buildings_on_table, color)
+        self.save(cur_plyr, 'gold')
         cur_plyr.gold += num_color
-        logging.info("Player %s gained %s bonus gold" % (cur_plyr.name, num_color))
-        self.game_state.round.has_taken_bonus[cur_plyr.position] = True
+        logging.info("Player %s gained %s bonus gold", cur_plyr.name, num_color)
+        self.game_state.round.mark_taken_bonus(cur_plyr.position)
+        if events.active:
+            gs = self.game_state
+            events.emit(events.BonusGold(gs.id, gs.round_num, cur_plyr.position, num_color))
 
     def handle_power_1(self, action, cur_plyr):
         #TODO:  make a decorator that validates a target is present
@@ -336,6 +648,9 @@ class Referee:
 
         #TODO: if player targets a face up role, announce this as a bold move
         self.game_state.round.dead_role = target
+        if events.active:
+            gs = self.game_state
+            events.emit(events.RoleMurdered(gs.id, gs.round_num, cur_plyr.position, target))
 
     def handle_power_2(self, action, cur_plyr):
         #TODO:  make a decorator that validates a target is present
@@ -354,6 +669,9 @@ class Referee:
 
         #TODO: if player targets a face up role, announce this as a bold move
         self.game_state.round.mugged_role = target
+        if events.active:
+            gs = self.game_state
+            events.emit(events.RoleMugged(gs.id, gs.round_num, cur_plyr.position, target))
 
     def handle_power_3(self, action, cur_plyr):
         if not 'target' in action:
@@ -367,6 +685,7 @@ class Referee:
             raise IllegalActionError("Invalid target: %s" % target)
 
         hand = cur_plyr.buildings_in_hand
+        self.save(cur_plyr, 'buildings_in_hand')
 
         if target == "deck":
 
@@ -377,6 +696,7 @@ class Referee:
                 raise IllegalActionError("No list of cards to discard.")
 
             discards = action['discards']
+            self.save(self.game_state.building_card_deck, 'cards')
 
             for d in discards:
                 if d not in hand:
@@ -392,6 +712,7 @@ class Referee:
             #lists in case sqlalchemy needs it this way.  might be overly paranoid .
             #blame my bad experience with JDO ages ago.
 
+            self.save(self.game_state.players[target], 'buildings_in_hand')
             other_hand = self.game_state.players[target].buildings_in_hand
             buff = hand[:]
             hand[:] = other_hand
@@ -421,7 +742,8 @@ class Referee:
         pass
 
     def handle_power_8(self, action, cur_plyr):
-        self.validate_phase_and_step(Phase.PLAY_TURNS, Step.FINISH)
+        # razing is only allowed once you're done building
+        self.validate_step(Step.FINISH)
         if not 'target_player_id' in action:
             raise IllegalActionError("No target player specified")
         target_player_pos = action['target_player_id']
@@ -441,8 +763,8 @@ class Referee:
         if target_plyr.cur_role == 5:
             raise IllegalActionError("Not allowed to target player with role #5")
 
-        logging.info("target_plyer is %s" % str(target_plyr))
-        logging.info("razing target is %s" % str(target_card_id))
+        logging.info("target_plyer is %s", target_plyr)
+        logging.info("razing target is %s", target_card_id)
         if target_card_id not in target_plyr.buildings_on_table:
             raise IllegalActionError("Target Player does not have target building")
 
@@ -452,24 +774,38 @@ class Referee:
         if cost_to_raze > cur_plyr.gold:
             raise IllegalActionError("Not enough gold to destroy target building")
 
+        self.save(cur_plyr, 'gold')
+        self.save(target_plyr, 'buildings_on_table')
         cur_plyr.gold -= cost_to_raze
         target_plyr.buildings_on_table.remove(target_card_id)
+        if events.active:
+            gs = self.game_state
+            events.emit(events.BuildingRazed(gs.id, gs.round_num, cur_plyr.position,
+                                             target_player_pos, target_card_id, cost_to_raze))
 
 
-    def validate_phase_and_step(self, phase, *steps):
-        if self.game_state.phase != phase:
-            logging.error("attempting action that requires phase %s, but current phase is %s" %
-                          (phase, self.game_state.phase))
-            raise IllegalActionError
-
-        if self.game_state.step not in steps:
-            logging.error("attempting action that requires step %s, but current step is %s" %
-                          (steps, self.game_state.step))
-            raise IllegalActionError
-
     def validate_step(self, *steps):
         if self.game_state.step not in steps:
-            logging.error("attempting action that requires step %s, but current step is %s" %
-                          (steps, self.game_state.step))
+            logging.debug("attempting action that requires step %s, but current step is %s",
+                          steps, self.game_state.step)
             raise IllegalActionError
 
+    # action name -> handler, and role -> power handler.  These are plain
+    # functions, called with the referee as the first argument.
+    action_handlers = {
+        'pick_role': handle_pick_role
+        , 'hide_role': handle_hide_role
+        , 'take_gold': handle_take_gold
+        , 'build_building': handle_build_building
+        , 'draw_cards': handle_draw_cards
+        , 'keep_card': handle_keep_card
+        , 'finish': handle_finish
+        , 'use_power': handle_use_power
+        , 'take_bonus': handle_take_bonus
+    }
+    power_handlers = {
+        1: handle_power_1
+        , 2: handle_power_2
+        , 3: handle_power_3
+        , 8: handle_power_8
+    }
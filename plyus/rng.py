@@ -0,0 +1,87 @@
+"""Counter based random numbers for games.
+
+A CounterRandom is a key plus a counter.  The n-th number of a stream is a
+hash (splitmix64) of the key and n, so making a generator costs nothing,
+its whole state is two ints that can be saved with a game, and any number
+of independent streams can be derived from one seed by hashing in more
+key parts.  shuffle() and friends are implemented here rather than taken
+from the random module, so a saved game replays the same way on any
+python version."""
+
+import hashlib
+
+_MASK = (1 << 64) - 1
+_GAMMA = 0x9e3779b97f4a7c15
+
+
+def _mix(z):
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & _MASK
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & _MASK
+    return z ^ (z >> 31)
+
+
+def stream_key(*parts):
+    """ combines ints and strings into a 64 bit stream key """
+    key = 0
+    for part in parts:
+        if isinstance(part, str):
+            part = int.from_bytes(hashlib.blake2b(part.encode('utf-8'), digest_size=8).digest(), 'little')
+        key = _mix((key * _GAMMA + (part & _MASK) + 1) & _MASK)
+    return key
+
+
+class CounterRandom(object):
+    __slots__ = ('key', 'counter')
+
+    def __init__(self, key, counter=0):
+        self.key = key
+        self.counter = counter
+
+    def next64(self):
+        self.counter += 1
+        return _mix((self.key + self.counter * _GAMMA) & _MASK)
+
+    def random(self):
+        """ a float in [0, 1) """
+        return (self.next64() >> 11) * (1.0 / (1 << 53))
+
+    def randbelow(self, n):
+        """ an int in [0, n), without modulo bias """
+        limit = _MASK - (_MASK + 1) % n
+        x = self.next64()
+        while x > limit:
+            x = self.next64()
+        return x % n
+
+    def randrange(self, n):
+        return self.randbelow(n)
+
+    def choice(self, seq):
+        return seq[self.randbelow(len(seq))]
+
+    def shuffle(self, x):
+        """ shuffles a list in place (fisher-yates) """
+        items = list(x)
+        for i in range(len(items) - 1, 0, -1):
+            j = self.randbelow(i + 1)
+            items[i], items[j] = items[j], items[i]
+        x[:] = items
+
+    def derive(self, *parts):
+        """ an independent stream, keyed by this stream's key and parts """
+        return CounterRandom(stream_key(self.key, *parts))
+
+
+class GameRandom(CounterRandom):
+    """ draws from a game's stream for its current round, and keeps the game's
+        rng_counter up to date, so the position in the stream is saved with the game """
+    __slots__ = ('game',)
+
+    def __init__(self, game):
+        CounterRandom.__init__(self, stream_key(game.base_seed, game.round_num), game.rng_counter)
+        self.game = game
+
+    def next64(self):
+        x = CounterRandom.next64(self)
+        self.game.rng_counter = self.counter
+        return x
@@ -1,14 +1,19 @@
 import logging
-from plyus.misc import *
+from plyus.engine import Step
 
 class Object(object):
     def __init__(self, d):
         self.__dict__ = d
 
 
+class RobotConfusedError(Exception):
+    pass
+
+
 class SimpleAIPlayer():
     def __init__(self, name):
         self.name = name
+        self.deck = None
 
         self.ponder_map = {
             Step.COINS_OR_BUILDING: self.ponder_coins_or_building
@@ -32,8 +37,15 @@ class SimpleAIPlayer():
     def ponder_keep_card(self, game, me):
         return {"name": "keep_card", "target": 0}
 
+    #in json mode buildings arrive as dicts, when playing natively they are just ids
+    def as_card(self, c):
+        if isinstance(c, int):
+            b = self.deck.card_for_id(c)
+            return {'id': b.id, 'cost': b.cost}
+        return c
+
     def ponder_build_building(self, game, me):
-        dists = me.buildings_in_hand
+        dists = [self.as_card(c) for c in me.buildings_in_hand]
         if len(dists) >= 1:
             cost = dists[0]['cost']
             if me.gold >= cost:
@@ -55,7 +67,7 @@ class SimpleAIPlayer():
         if me.cur_role == 3:
             discard = []
             if len(me.buildings_in_hand) >= 1:
-                discard.append(me.buildings_in_hand[0]['id'])
+                discard.append(self.as_card(me.buildings_in_hand[0])['id'])
                 return {"name": "use_power", "target": "deck", "discards": discard}
                 #if we have no cards, arbitrarily shaft the player after us.
             victim_pos = (me.position + 1) % game.num_players
@@ -63,10 +75,11 @@ class SimpleAIPlayer():
 
         if me.cur_role == 8:
             victim = game.players[(me.position + 1) % game.num_players]
-            logging.debug("razing victim is %s" % victim)
+            logging.debug("razing victim is %s", victim)
             potential_target = None
             if 0 < len(victim.buildings_on_table) < 8:
-                potential_target = sorted(victim.buildings_on_table, key=lambda d: d['cost'])[0]
+                on_table = [self.as_card(c) for c in victim.buildings_on_table]
+                potential_target = sorted(on_table, key=lambda d: d['cost'])[0]
             if (potential_target and
                         potential_target['cost'] <= me.gold and
                         5 not in victim.revealed_roles):
@@ -101,7 +114,7 @@ class SimpleAIPlayer():
         game.round = r
 
         for p in game.players:
-            logging.debug("p is ### %s ###" % p)
+            logging.debug("p is ### %s ###", p)
             game.players[p['position']] = Object(p)
 
         d = some_json['me']
@@ -109,6 +122,7 @@ class SimpleAIPlayer():
         return self.decide_what_to_do(game, me)
 
     def decide_what_to_do_native(self, game):
+        self.deck = game.building_card_deck
         me = game.players[game.cur_player_index]
         return self.decide_what_to_do(game, me)
 
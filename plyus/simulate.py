@@ -0,0 +1,130 @@
+"""Self-play tournaments, run across a pool of worker processes.
+
+Each job is (seed, num_players, ai_config).  Workers play the game with the
+in-memory engine and the Referee, no database involved, and send back a
+small result dict.  Results come back in job order as they finish, so a
+tournament is reproducible from its list of jobs."""
+
+import multiprocessing
+
+from plyus.engine import SimGameState, SimPlayer, Stage
+from plyus.referee import Referee
+from plyus.simpleai import SimpleAIPlayer
+
+# ai_config names one of these, and every seat is played by that kind of AI
+AIS = {'simple': SimpleAIPlayer}
+
+DEFAULT_DECK = 'decks/deck_test_60.csv'
+
+
+def play_game(seed, num_players, ai_config='simple', deck_template=DEFAULT_DECK, max_moves_per_player=100):
+    ai_class = AIS[ai_config]
+    ais = {}
+    players = []
+    for i in range(num_players):
+        name = 'AI%s' % i
+        ais[name] = ai_class(name)
+        players.append(SimPlayer(name))
+
+    game = SimGameState(seed, players[0], num_players, deck_template=deck_template)
+    for p in players[1:]:
+        game.add_player(p)
+    game.start_game()
+    ref = Referee(game)
+
+    num_moves = 0
+    while game.stage != Stage.GAME_OVER and num_moves < max_moves_per_player * num_players:
+        cur_ai = ais[game.get_cur_plyr().name]
+        ref.handle_move(cur_ai.decide_what_to_do_native(game))
+        num_moves += 1
+
+    result = {'seed': seed, 'num_players': num_players, 'ai': ai_config,
+              'finished': game.stage == Stage.GAME_OVER, 'rounds': game.round_num, 'moves': num_moves,
+              'winner_seat': None, 'points': [p.points for p in game.players]}
+    for p in game.players:
+        if p.name == game.winner:
+            result['winner_seat'] = p.position
+    return result
+
+
+def _play_job(job):
+    seed, num_players, ai_config = job
+    return play_game(seed, num_players, ai_config)
+
+
+def make_jobs(seeds, player_counts, ai_config='simple'):
+    return [(seed, n, ai_config) for n in player_counts for seed in seeds]
+
+
+def run_tournament(jobs, processes=None, chunksize=16):
+    """ plays every job, yielding each result as it is ready, in job order.
+        processes=None uses one worker per cpu, processes=1 plays in this process """
+    if processes == 1:
+        for job in jobs:
+            yield _play_job(job)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(_play_job, jobs, chunksize):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def summarize(results):
+    """ aggregate stats per player count: rounds to finish, winning seats and points """
+    by_num_players = {}
+    for r in results:
+        by_num_players.setdefault(r['num_players'], []).append(r)
+
+    summary = {}
+    for n, rs in sorted(by_num_players.items()):
+        finished = [r for r in rs if r['finished']]
+        rounds = [r['rounds'] for r in finished]
+        points = [pts for r in finished for pts in r['points']]
+        winning_points = [max(r['points']) for r in finished]
+        seats = [0] * n
+        for r in finished:
+            seats[r['winner_seat']] += 1
+
+        summary[n] = {'games': len(rs),
+                      'finished': len(finished),
+                      'total_rounds': sum(rounds),
+                      'mean_rounds': _mean(rounds),
+                      'min_rounds': min(rounds) if rounds else None,
+                      'max_rounds': max(rounds) if rounds else None,
+                      'winner_seats': seats,
+                      'mean_points': _mean(points),
+                      'mean_winning_points': _mean(winning_points),
+                      'points_histogram': _histogram(points)}
+    return summary
+
+
+def format_summary(summary):
+    lines = []
+    for n, s in sorted(summary.items()):
+        lines.append("%s players: %s games, %s finished" % (n, s['games'], s['finished']))
+        lines.append("  rounds: total %s, mean %.2f, min %s, max %s" % (
+            s['total_rounds'], s['mean_rounds'], s['min_rounds'], s['max_rounds']))
+        lines.append("  winner seats: %s" % s['winner_seats'])
+        lines.append("  points: mean %.2f, mean for winner %.2f" % (s['mean_points'], s['mean_winning_points']))
+        lines.append("  points histogram: %s" % ", ".join(
+            "%s-%s: %s" % (lo, hi, count) for lo, hi, count in s['points_histogram']))
+    return "\n".join(lines)
+
+
+def _mean(xs):
+    if not xs:
+        return 0.0
+    return float(sum(xs)) / len(xs)
+
+
+def _histogram(points, bucket_size=5):
+    """ [(low, high, count)] for each bucket of points that has any players in it """
+    counts = {}
+    for pts in points:
+        lo = (pts // bucket_size) * bucket_size
+        counts[lo] = counts.get(lo, 0) + 1
+    return [(lo, lo + bucket_size - 1, counts[lo]) for lo in sorted(counts)]
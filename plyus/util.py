@@ -1,6 +1,7 @@
 import logging
 import json
 import itertools
+import operator
 from . import errors
 
 
@@ -9,7 +10,7 @@ def draw_n(some_list, n):
         raise ValueError("trying to draw %s elements from a list of len %s" % (n, len(some_list)))
 
     r = some_list[0:n]
-    logging.debug("draw_n: items are %s " % r)
+    logging.debug("draw_n: items are %s ", r)
     del some_list[0:n]
     return r
 
@@ -42,31 +43,145 @@ def ids(xs):
     return [x.id for x in xs]
 
 
+# state deltas.  A delta holds the keys whose values changed; where the old and
+# new values are both dicts the delta for that key is itself a delta, and where
+# both are lists of the same length it is {LIST_ITEMS: {index: delta or value}}.
+# Keys that went away are listed under REMOVED.
+REMOVED = '_removed'
+LIST_ITEMS = '_items'
+
+
+def dict_delta(old, new):
+    """ the changes that turn dict old into dict new, see apply_delta """
+    delta = {}
+    for k, v in new.items():
+        if k not in old:
+            delta[k] = v
+            continue
+        change = _value_delta(old[k], v)
+        if change is not _unchanged:
+            delta[k] = change
+    removed = [k for k in old if k not in new]
+    if removed:
+        delta[REMOVED] = removed
+    return delta
+
+
+_unchanged = object()
+
+
+def _value_delta(old, new):
+    if old == new:
+        return _unchanged
+    if isinstance(old, dict) and isinstance(new, dict):
+        return dict_delta(old, new)
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        items = {}
+        for i, (o, n) in enumerate(zip(old, new)):
+            change = _value_delta(o, n)
+            if change is not _unchanged:
+                items[str(i)] = change
+        return {LIST_ITEMS: items}
+    return new
+
+
+def apply_delta(old, delta):
+    """ a new dict with delta (from dict_delta) applied to old.  old is not changed """
+    new = dict(old)
+    for k, change in delta.items():
+        if k == REMOVED:
+            for gone in change:
+                new.pop(gone, None)
+        elif k in old:
+            new[k] = _apply_value(old[k], change)
+        else:
+            new[k] = change
+    return new
+
+
+def _apply_value(old, change):
+    if isinstance(old, dict) and isinstance(change, dict):
+        return apply_delta(old, change)
+    if isinstance(old, list) and isinstance(change, dict) and LIST_ITEMS in change:
+        new = list(old)
+        for i, item_change in change[LIST_ITEMS].items():
+            i = int(i)
+            new[i] = _apply_value(old[i], item_change)
+        return new
+    return change
+
+
+# objects in json.  Classes are registered with a short tag and the fields
+# that make one up, and are encoded as {TYPE_TAG: tag, field: value, ...}.
+# Decoding calls the class with the fields as keyword arguments, so the
+# __init__ args must be named the same as the fields.  Only registered
+# classes are ever built from json.
+TYPE_TAG = '__t'
+
+
+class _Codec(object):
+    def __init__(self, tag, cls, fields):
+        self.tag = tag
+        self.cls = cls
+        self.fields = tuple(fields)
+        self.get_fields = operator.attrgetter(*self.fields)
+
+    def encode(self, obj):
+        values = self.get_fields(obj)
+        if len(self.fields) == 1:
+            values = (values,)
+        d = dict(zip(self.fields, values))
+        d[TYPE_TAG] = self.tag
+        return d
+
+    def decode(self, d):
+        return self.cls(**dict((f, d[f]) for f in self.fields if f in d))
+
+
+_codecs_by_tag = {}
+_codecs_by_class = {}
+_codecs_by_name = {}
+
+
+def register_type(tag, cls, fields):
+    if tag in _codecs_by_tag and _codecs_by_tag[tag].cls is not cls:
+        raise errors.FatalPlyusError("type tag %s is already used by %s" % (tag, _codecs_by_tag[tag].cls))
+    codec = _Codec(tag, cls, fields)
+    _codecs_by_tag[tag] = codec
+    _codecs_by_class[cls] = codec
+    _codecs_by_name[cls.__name__] = codec
+
+
 def convert_to_builtin_type(obj):
     # Convert objects to a dictionary of their representation
-    # based on code from http://pymotw.com
+    codec = _codecs_by_class.get(type(obj))
+    if codec is not None:
+        return codec.encode(obj)
+
+    # unregistered classes are written the old way, based on code from
+    # http://pymotw.com, but can't be read back as objects
     d = {'__class__': obj.__class__.__name__,
          '__module__': obj.__module__,
     }
     d.update(obj.__dict__)
     return d
 
-#this method has a major caveat - the __init__ method of the class being built
-# must have arguments named the same as the instance variables
+
 def dict_to_object(d):
-    if '__class__' in d:
-        class_name = d.pop('__class__')
-
-        module_name = d.pop('__module__')
-        logging.debug("class is %s and module is %s" % (class_name, module_name))
-        module = __import__(module_name)
-        logging.debug("module is %s" % module)
-        class_ = getattr(module, class_name)
-        args = dict((key.encode('ascii'), value) for key, value in d.items())
-        inst = class_(**args)
+    """ object_hook for json.loads that turns tagged dicts back into objects """
+    tag = d.get(TYPE_TAG)
+    if tag is not None:
+        codec = _codecs_by_tag.get(tag)
+    elif '__class__' in d:
+        # written before type tags, by class name and module
+        codec = _codecs_by_name.get(d['__class__'])
     else:
-        inst = d
-    return inst
+        return d
+
+    if codec is None:
+        logging.warning("not decoding unregistered type %s", tag or d['__class__'])
+        return d
+    return codec.decode(d)
 
 
 def to_json(x):
@@ -77,5 +192,5 @@ def to_json(x):
 
 def from_json(s):
     d = json.loads(s)
-    logging.debug("json loading type %s" % type(d))
+    logging.debug("json loading type %s", type(d))
     return d
@@ -1,10 +1,16 @@
-from flask import flash, render_template, redirect, url_for, g, session, request
+from flask import flash, render_template, redirect, url_for, g, session, request, jsonify, abort
 from flask_login import login_user, logout_user, current_user, login_required
+from sqlalchemy.orm.exc import StaleDataError
 
 from plyus import app
 from plyus import lm, oid
 from plyus.user import User
 from plyus.gamestate import GameState
+from plyus.gamerecord import GameRecord
+from plyus.player import Player
+from plyus.referee import Referee
+from plyus.errors import NotYourTurnError, NoSuchActionError, IllegalActionError, FatalPlyusError
+from plyus.catalog import catalog_for, template_for_deck
 from plyus.forms import LoginForm, NewGameForm
 from plyus.proto import *
 # Login related functions
@@ -105,13 +111,98 @@ def join_proto_game(gid):
     return redirect(url_for("show_proto_game", gid=gid))
 
 
+# games are kept as a GameState row with rows for its players, round and deck,
+# or with GAME_STORAGE = 'record' in the config, as a single GameRecord row
+def stores_game_records():
+    return app.config.get('GAME_STORAGE') == 'record'
+
+
 @app.route('/game/<int:gid>')
 @login_required
 def show_game(gid):
-    game = GameState.query.filter(GameState.id == gid).one()
+    if stores_game_records():
+        game = GameRecord.query.get_or_404(gid).load()
+    else:
+        game = GameState.query_for('play').filter(GameState.id == gid).one()
     return render_template("game.html", game=game.to_dict_for_public())
 
 
+# the position of the seat user plays in game gid, or None if they aren't in it
+def seat_for_user(gid, game, user):
+    if stores_game_records():
+        return game.seat_for_user(user.id)
+    return db.session.query(Player.position)\
+        .join(ProtoPlayer, ProtoPlayer.player_id == Player.id)\
+        .filter(Player.gamestate_id == gid, ProtoPlayer.user_id == user.id)\
+        .scalar()
+
+
+# takes a json list of moves, usually a whole turn, and performs them all or none
+# of them, with a single commit.  The moves must all be for the seat the logged in
+# user plays.  Returns the new state for that seat, or just what changed if
+# ?since=<version> names the version the client has.
+# ?compact=1 sends card ids instead of whole buildings, see card_catalog.
+@app.route('/game/<int:gid>/moves', methods=['POST'])
+@login_required
+def post_moves(gid):
+    if stores_game_records():
+        game = GameRecord.query.get_or_404(gid)
+    else:
+        game = Referee.for_game(GameState.query_for('play').filter(GameState.id == gid).one())
+    moves = request.get_json(silent=True)
+    if not isinstance(moves, list) or not all(isinstance(m, dict) for m in moves):
+        return jsonify(error="expected a list of moves"), 400
+    seat = seat_for_user(gid, game, g.user)
+    if seat is None or any(m.get('player') != seat for m in moves):
+        app.logger.info("user %s sent moves for another seat in game %s", g.user.id, gid)
+        return jsonify(error="you can only move for your own seat"), 403
+    # commits before the referee remembers the state it sends, for deltas
+    try:
+        state = game.perform_moves(moves, request.args.get('since', type=int),
+                                   request.args.get('compact', 0, type=int) == 1, db.session.commit,
+                                   seat)
+    except StaleDataError:
+        # someone else's moves for this game were saved first
+        db.session.rollback()
+        return jsonify(error="the game changed, get the latest state and try again"), 409
+    except (NotYourTurnError, NoSuchActionError, IllegalActionError, KeyError, TypeError) as e:
+        db.session.rollback()
+        app.logger.info("rejected moves for game %s: %r", gid, e)
+        return jsonify(error=repr(e)), 400
+    except FatalPlyusError as e:
+        # the moves can't be played in this game, eg. the deck ran out
+        db.session.rollback()
+        app.logger.warning("moves for game %s failed: %s", gid, e.explanation)
+        return jsonify(error=e.explanation), 400
+    return app.response_class(state, mimetype='application/json')
+
+
+# the cards in a deck.  States name their catalog by deck name and digest, and the
+# digest changes whenever the cards do, so this can be cached forever.  Only the
+# current cards are kept, so any other digest is not found; /catalog/<deck>
+# redirects to the current one.
+@app.route('/catalog/<string:deck>/<string:digest>')
+def card_catalog(deck, digest):
+    template = template_for_deck(deck)
+    if template is None:
+        abort(404)
+    catalog = catalog_for(template)
+    if digest != catalog.digest:
+        abort(404)
+    resp = app.response_class(catalog.json, mimetype='application/json')
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    resp.headers['ETag'] = '"%s"' % catalog.digest
+    return resp
+
+
+@app.route('/catalog/<string:deck>')
+def current_card_catalog(deck):
+    template = template_for_deck(deck)
+    if template is None:
+        abort(404)
+    return redirect(url_for('card_catalog', deck=deck, digest=catalog_for(template).digest))
+
+
 @app.route('/protogame/<int:gid>')
 @login_required
 def show_proto_game(gid):
@@ -12,7 +12,7 @@ from plyus.misc import *
 from plyus.player import Player
 from plyus.gamestate import GameState
 from plyus.referee import Referee
-from .simpleai import SimpleAIPlayer
+from plyus.simpleai import SimpleAIPlayer
 from plyus.util import from_json
 
 def create_session_maker():
@@ -59,7 +59,7 @@ class IntegrationTests(unittest.TestCase):
         return (players, ais)
 
     def get_game_for_id(self, sess, game_id):
-        g = sess.query(GameState).filter(GameState.id == game_id).one()
+        g = GameState.query_for('play', sess).filter(GameState.id == game_id).one()
         return g
 
     def do_one_test(self, seed, num_players):
@@ -89,7 +89,7 @@ class IntegrationTests(unittest.TestCase):
         self.assertTrue(finished_cleanly, "finish before 100 steps per player")
 
     def process_ai_move(self, game, ais):
-        ref = Referee(game)
+        ref = Referee.for_game(game)
         cur_plyr = game.get_cur_plyr()
         cur_ai = ais[cur_plyr.name]
         json = ref.get_current_state_as_json_for_player(cur_plyr.position)
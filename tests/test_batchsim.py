@@ -0,0 +1,152 @@
+import unittest
+import logging
+
+import numpy as np
+
+from plyus import batchsim
+from plyus.batchsim import BatchSimulator
+from plyus.engine import Stage, Step
+from plyus.errors import IllegalActionError
+from plyus.referee import Referee
+from .test_engine import play_engine_game, create_engine_game
+
+
+class EngineShuffledBatch(BatchSimulator):
+    """ a batch that takes its shuffles from engine games, so each of its games
+        should be the same game as the engine plays """
+    def __init__(self, games):
+        self.engine_games = games
+        BatchSimulator.__init__(self, len(games), games[0].num_players, seed=0)
+
+    def _shuffled_decks(self):
+        # the deck as it was before start_game dealt four cards to each seat
+        return np.array([sum([p.buildings_in_hand for p in g.players], []) + g.building_card_deck.cards
+                         for g in self.engine_games])
+
+    def _shuffled_role_piles(self, g):
+        piles = []
+        for i in g:
+            r = self.engine_games[i].round
+            piles.append(r.face_up_roles + r.face_down_roles + r.role_draw_pile)
+        return np.array(piles, dtype=np.int32).reshape(len(g), 8)
+
+
+_stages = {Stage.PLAYING: batchsim.PLAYING, Stage.END_GAME: batchsim.END_GAME, Stage.GAME_OVER: batchsim.GAME_OVER}
+_steps = {Step.PICK_ROLE: batchsim.PICK_ROLE, Step.HIDE_ROLE: batchsim.HIDE_ROLE,
+          Step.COINS_OR_BUILDING: batchsim.COINS_OR_BUILDING, Step.KEEP_CARD: batchsim.KEEP_CARD,
+          Step.BUILD_BUILDING: batchsim.BUILD_BUILDING, Step.FINISH: batchsim.FINISH}
+
+
+def engine_state(game):
+    r = game.round
+    players = game.players
+    d = {'stage': _stages[game.stage], 'step': _steps[game.step], 'round_num': game.round_num,
+         'cur_player': game.cur_player_index, 'crown': game.player_with_crown_token,
+         'gold': [p.gold for p in players],
+         'hands': [list(p.buildings_in_hand) for p in players],
+         'tables': [list(p.buildings_on_table) for p in players],
+         'deck': list(game.building_card_deck.cards),
+         'role_pile': list(r.role_draw_pile),
+         'role_owners': [-1 if o is None else o for o in r.role_owners[1:]],
+         'revealed': [sorted(p.revealed_roles) for p in players],
+         'used_power': r.has_used_power, 'taken_bonus': r.has_taken_bonus,
+         'dead_role': r.dead_role or 0, 'mugged_role': r.mugged_role or 0,
+         'cur_role': (game.get_cur_plyr().cur_role or 0) if r.turn_order else 0,
+         'winner': -1}
+    if game.stage == Stage.GAME_OVER:
+        d['winner'] = [p.name for p in players].index(game.winner)
+        d['points'] = [p.points for p in players]
+    return d
+
+
+def batch_state(sim, i):
+    P = sim.num_players
+
+    def in_order(arrived):
+        held = np.flatnonzero(arrived >= 0)
+        return [int(c) for c in held[np.argsort(arrived[held], kind='stable')]]
+
+    d = {'stage': int(sim.stage[i]), 'step': int(sim.step_code[i]), 'round_num': int(sim.round_num[i]),
+         'cur_player': int(sim.cur_player[i]), 'crown': int(sim.crown[i]),
+         'gold': [int(x) for x in sim.gold[i]],
+         'hands': [in_order(sim.hand[i, p]) for p in range(P)],
+         'tables': [in_order(sim.table[i, p]) for p in range(P)],
+         'deck': [int(sim.deck[i, (sim.deck_head[i] + k) % sim.num_cards]) for k in range(sim.deck_size[i])],
+         'role_pile': [int(x) for x in sim.role_pile[i, :sim.role_pile_len[i]]],
+         'role_owners': [int(x) for x in sim.role_owner[i, 1:]],
+         'revealed': [[r for r in range(1, 9) if sim.revealed[i, p] & batchsim.bits.role_bit(r)] for p in range(P)],
+         'used_power': [bool(x) for x in sim.used_power[i]], 'taken_bonus': [bool(x) for x in sim.taken_bonus[i]],
+         'dead_role': int(sim.dead_role[i]), 'mugged_role': int(sim.mugged_role[i]),
+         'cur_role': int(sim.cur_role[i]),
+         'winner': int(sim.winner[i])}
+    if sim.stage[i] == batchsim.GAME_OVER:
+        d['points'] = [int(x) for x in sim.points_scored[i]]
+    return d
+
+
+class TestBatchSimulator(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.WARNING)
+
+    def test_all_games_finish(self):
+        for n in [2, 3, 4, 5, 6]:
+            results = BatchSimulator(200, n, seed=n).run()
+            self.assertTrue(results['finished'].all())
+            self.assertTrue((results['winner'] >= 0).all())
+            self.assertTrue((results['winner'] < n).all())
+
+    def test_same_seed_same_results(self):
+        r1 = BatchSimulator(50, 4, seed=3).run()
+        r2 = BatchSimulator(50, 4, seed=3).run()
+        for k in r1:
+            self.assertTrue((r1[k] == r2[k]).all())
+
+    def test_cards_are_never_duplicated(self):
+        sim = BatchSimulator(100, 5, seed=8)
+        while sim.step():
+            held = (sim.hand >= 0).sum(axis=2)
+            self.assertTrue((held == sim.hand_count).all())
+            in_play = sim.hand_count.sum(axis=1) + sim.table_count.sum(axis=1) + sim.deck_size
+            self.assertTrue((in_play <= sim.num_cards).all())
+            self.assertTrue(((sim.hand >= 0) & (sim.table >= 0)).sum() == 0)
+
+    def test_plays_the_same_games_as_the_engine(self):
+        # both sides play SimpleAI's moves from the same shuffles, compared after every move
+        for n in [2, 3, 4, 5, 6]:
+            pairs = [create_engine_game(seed, n) for seed in range(40)]
+            games = [game for game, ais in pairs]
+            sim = EngineShuffledBatch(games)
+            live = [True] * len(games)
+            for i, game in enumerate(games):
+                self.assertEqual(batch_state(sim, i), engine_state(game))
+
+            while any(live):
+                for i, (game, ais) in enumerate(pairs):
+                    if not live[i]:
+                        continue
+                    move = ais[game.get_cur_plyr().name].decide_what_to_do_native(game)
+                    try:
+                        Referee(game).handle_move(move)
+                    except IllegalActionError:
+                        # the deck ran out, which the batch gives up on too
+                        live[i] = None
+                sim.step()
+                for i, game in enumerate(games):
+                    if live[i] is None:
+                        self.assertEqual(sim.stage[i], batchsim.ABORTED)
+                        live[i] = False
+                    elif live[i]:
+                        self.assertEqual(batch_state(sim, i), engine_state(game), "game %s of %s" % (i, n))
+                        live[i] = game.stage != Stage.GAME_OVER
+
+    def test_matches_one_game_at_a_time(self):
+        # the batch uses different random numbers, so compare averages
+        for n in [2, 4]:
+            batch_rounds = BatchSimulator(500, n, seed=1).run()['rounds'].mean()
+            engine_rounds = np.mean([play_engine_game(seed, n).round_num for seed in range(100)])
+            self.assertAlmostEqual(batch_rounds, engine_rounds, delta=0.75)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,19 @@
+import unittest
+import plyus.bits as bits
+
+
+class TestBits(unittest.TestCase):
+    def test_role_bits(self):
+        self.assertEqual([bits.role_bit(r) for r in (1, 4, 8)], [1, 8, 128])
+
+    def test_seat_flags(self):
+        flags = [False, True, False, True]
+        b = bits.flags_to_bits(flags)
+        self.assertEqual(bits.bits_to_flags(b, 4), flags)
+        self.assertTrue(bits.seat_is_set(b, 3))
+        self.assertFalse(bits.seat_is_set(b, 0))
+        self.assertTrue(bits.seat_is_set(bits.set_seat(b, 0), 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
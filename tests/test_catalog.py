@@ -0,0 +1,54 @@
+import unittest
+import json
+
+from plyus.catalog import catalog_for, template_for_deck, COLORS
+from plyus.engine import SimBuildingDeck
+
+
+class TestCatalog(unittest.TestCase):
+    def test_catalog_matches_cards(self):
+        catalog = catalog_for('decks/deck_test_60.csv')
+        ids = [c.id for c in catalog.full_cards[5:13]]
+        cards = [catalog.card_map[i] for i in ids]
+
+        self.assertEqual(catalog.total_points(ids), sum(c.points for c in cards))
+        self.assertEqual(catalog.total_cost(ids), sum(c.cost for c in cards))
+        for color in COLORS:
+            self.assertEqual(catalog.count_color(ids, color), sum(1 for c in cards if c.color == color))
+        self.assertEqual(catalog.num_colors(ids), len(set(c.color for c in cards)))
+        self.assertEqual(list(catalog.color_counts(ids)),
+                         [sum(1 for c in cards if c.color == color) for color in COLORS])
+
+    def test_empty_ids(self):
+        catalog = catalog_for('decks/deck_test_30.csv')
+        self.assertEqual(catalog.total_points([]), 0)
+        self.assertEqual(catalog.num_colors([]), 0)
+        self.assertEqual(catalog.count_color([], 'red'), 0)
+
+    def test_catalog_is_shared_and_read_only(self):
+        d1 = SimBuildingDeck('decks/deck_test_30.csv')
+        d2 = SimBuildingDeck('decks/deck_test_30.csv')
+        self.assertIs(d1.get_catalog(), d2.get_catalog())
+        with self.assertRaises(ValueError):
+            d1.get_catalog().points[1] = 100
+
+    def test_catalog_json(self):
+        catalog = catalog_for('decks/deck_test_60.csv')
+        d = json.loads(catalog.json)
+        self.assertEqual(catalog.ref(), {'name': 'deck_test_60', 'digest': catalog.digest})
+        self.assertEqual(d['digest'], catalog.digest)
+        self.assertEqual(len(d['cards']), len(catalog.full_cards))
+        for c in d['cards']:
+            card = catalog.card_map[c['id']]
+            self.assertEqual((c['color'], c['points'], c['cost'], c['name']),
+                             (card.color, card.points, card.cost, card.name))
+        self.assertNotEqual(catalog.digest, catalog_for('decks/deck_test_30.csv').digest)
+
+    def test_template_for_deck(self):
+        self.assertEqual(template_for_deck('deck_test_30'), 'decks/deck_test_30.csv')
+        self.assertIsNone(template_for_deck('no_such_deck'))
+        self.assertIsNone(template_for_deck('../requirements'))
+
+
+if __name__ == '__main__':
+    unittest.main()
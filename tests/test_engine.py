@@ -0,0 +1,423 @@
+import unittest
+import json
+import logging
+import random
+
+from plyus.engine import SimGameState, SimPlayer, Stage, Phase, Step
+from plyus.referee import Referee
+from plyus.errors import IllegalActionError, NotYourTurnError
+from plyus.simpleai import SimpleAIPlayer
+from plyus import util
+
+
+def create_engine_game(seed, num_players, deck_template='decks/deck_test_60.csv'):
+    names = ['PeterAI', 'MananAI', 'AndyAI', 'MarkAI', 'KevinAI', 'RyanAI', 'TabithaAI']
+    ais = {}
+    players = []
+    for n in names[0:num_players]:
+        ais[n] = SimpleAIPlayer(n)
+        players.append(SimPlayer(n))
+
+    game = SimGameState(seed, players[0], num_players, deck_template=deck_template)
+    for p in players[1:num_players]:
+        game.add_player(p)
+    game.start_game()
+    return game, ais
+
+
+def play_engine_game(seed, num_players, deck_template='decks/deck_test_60.csv'):
+    game, ais = create_engine_game(seed, num_players, deck_template)
+    ref = Referee(game)
+
+    for i in range(100 * num_players):
+        cur_ai = ais[game.get_cur_plyr().name]
+        ref.handle_move(cur_ai.decide_what_to_do_native(game))
+        if game.stage == Stage.GAME_OVER:
+            return game
+    return None
+
+
+# everything in a snapshot except the object references, so two games can be compared
+def state_of(game):
+    game_values, players, player_states, rnd, round_state, cards = game.snapshot()
+    return game_values, player_states, round_state, cards
+
+
+class TestEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.WARNING)
+
+    def test_self_play(self):
+        for seed in range(10):
+            for n in [2, 3, 4, 5, 6]:
+                game = play_engine_game(seed, n)
+                self.assertIsNotNone(game, "didn't finish game in right amount of steps")
+                self.assertIsNotNone(game.winner)
+
+    def test_same_seed_same_game(self):
+        g1 = play_engine_game(7, 4)
+        g2 = play_engine_game(7, 4)
+        self.assertEqual(g1.round_num, g2.round_num)
+        self.assertEqual([p.points for p in g1.players], [p.points for p in g2.players])
+
+    def test_ai_moves_are_legal(self):
+        for n in [2, 3, 4, 5, 6]:
+            game, ais = create_engine_game(3, n)
+            ref = Referee(game)
+            while game.stage != Stage.GAME_OVER:
+                move = ais[game.get_cur_plyr().name].decide_what_to_do_native(game)
+                self.assertIn(move, ref.legal_moves(game.cur_player_index))
+                other = (game.cur_player_index + 1) % n
+                self.assertEqual(ref.legal_moves(other), [])
+                ref.handle_move(move)
+            self.assertEqual(ref.legal_moves(game.cur_player_index), [])
+
+    def test_role_index_matches_player_roles(self):
+        for n in [2, 3, 5]:
+            game, ais = create_engine_game(4, n)
+            ref = Referee(game)
+            while game.stage != Stage.GAME_OVER:
+                ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+                for p in game.players:
+                    for r in p.roles:
+                        self.assertEqual(game.round.player_for_role(r), p.position)
+                self.assertEqual(game.round.num_roles_picked, sum(len(p.roles) for p in game.players))
+
+    def test_murdered_role_never_takes_a_turn(self):
+        murders = 0
+        for seed in range(10):
+            for n in [2, 4, 6]:
+                game, ais = create_engine_game(seed, n)
+                ref = Referee(game)
+                while game.stage != Stage.GAME_OVER:
+                    if game.phase == Phase.PLAY_TURNS:
+                        rnd = game.round
+                        roles = [r for r, p in rnd.turn_order]
+                        self.assertEqual(roles, sorted(roles))
+                        self.assertEqual(rnd.cur_turn(), [game.get_cur_plyr().cur_role, game.cur_player_index])
+                        self.assertNotEqual(game.get_cur_plyr().cur_role, rnd.dead_role)
+                        if rnd.dead_role in roles:
+                            murders += 1
+                    ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+        self.assertTrue(murders > 0)
+
+    def test_public_turn_order_hides_the_murdered_role(self):
+        passed = 0
+        for seed in range(10):
+            for n in [2, 4, 6]:
+                game, ais = create_engine_game(seed, n)
+                ref = Referee(game)
+                while game.stage != Stage.GAME_OVER:
+                    rnd = game.round
+                    if game.phase == Phase.PLAY_TURNS:
+                        public = game.to_dict_for_public()['round']['turn_order']
+                        started = rnd.turn_order[:rnd.turn_cursor + 1]
+                        self.assertEqual(public, [t for t in started if t[0] != rnd.dead_role])
+                        self.assertNotIn(rnd.dead_role, [r for r, p in public])
+                        if rnd.dead_role in [r for r, p in started]:
+                            passed += 1
+                    ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+        self.assertTrue(passed > 0)
+
+    def test_random_legal_moves_are_accepted(self):
+        rand = random.Random(5)
+        for n in [2, 4, 6]:
+            game, ais = create_engine_game(11, n)
+            ref = Referee(game)
+            for i in range(2000):
+                moves = ref.legal_moves(game.cur_player_index)
+                if not moves:
+                    break
+                ref.handle_move(rand.choice(moves))
+
+    def test_current_player_always_has_a_legal_move(self):
+        rand = random.Random(7)
+        for seed in range(60):
+            game, ais = create_engine_game(seed, 2 + seed % 5)
+            ref = Referee(game)
+            for i in range(1500):
+                if game.stage == Stage.GAME_OVER:
+                    break
+                moves = ref.legal_moves(game.cur_player_index)
+                self.assertTrue(moves, "no legal move at move %s of game %s" % (i, seed))
+                ref.handle_move(rand.choice(moves))
+
+    def test_legal_moves_follow_action_table(self):
+        for n in [2, 5]:
+            game, ais = create_engine_game(13, n)
+            ref = Referee(game)
+            while game.stage != Stage.GAME_OVER:
+                allowed = ref.allowed_actions()
+                for move in ref.legal_moves(game.cur_player_index):
+                    self.assertIn(move['action']['name'], allowed)
+
+                # anything the table doesn't allow is turned away before dispatch
+                for name in set(Referee.action_table[(Phase.PLAY_TURNS, Step.FINISH)]) - allowed:
+                    with self.assertRaises(IllegalActionError):
+                        ref.handle_move({'player': game.cur_player_index, 'action': {'name': name}})
+                ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+
+    def test_cant_build_what_you_cant_afford(self):
+        game, ais = create_engine_game(1, 2)
+        ref = Referee(game)
+        while game.step != Step.BUILD_BUILDING:
+            ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+        me = game.get_cur_plyr()
+        me.gold = 0
+        targets = [m['action']['target'] for m in ref.legal_moves(me.position)
+                   if m['action']['name'] == 'build_building']
+        self.assertEqual(targets, ['skip'])
+
+    def test_exchange_moves_dont_grow_with_every_subset_of_hand(self):
+        game, ais = create_engine_game(1, 2)
+        ref = Referee(game)
+        while game.phase != Phase.PLAY_TURNS:
+            ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+        me = game.get_cur_plyr()
+        me.cur_role = 3
+        deck = game.building_card_deck
+        me.buildings_in_hand.extend(util.draw_n(deck.cards, 12 - len(me.buildings_in_hand)))
+        exchanges = [m['action']['discards'] for m in ref.legal_moves(me.position)
+                     if m['action'].get('target') == 'deck']
+        self.assertEqual(len(exchanges), 12 + 2)
+        self.assertIn([], exchanges)
+        self.assertIn(me.buildings_in_hand, exchanges)
+
+        # exchanges that aren't listed are still allowed
+        ref.handle_move({'player': me.position,
+                         'action': {'name': 'use_power', 'target': 'deck', 'discards': me.buildings_in_hand[:3]}})
+        self.assertEqual(len(me.buildings_in_hand), 12)
+
+    def test_bad_targets_are_illegal(self):
+        game, ais = create_engine_game(1, 2)
+        ref = Referee(game)
+        me = game.cur_player_index
+        missing = [r for r in range(1, 9) if r not in game.round.role_draw_pile][0]
+        with self.assertRaises(IllegalActionError):
+            ref.handle_move({'player': me, 'action': {'name': 'pick_role', 'target': missing}})
+
+        while game.step != Step.COINS_OR_BUILDING:
+            ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+        me = game.cur_player_index
+        ref.handle_move({'player': me, 'action': {'name': 'draw_cards'}})
+        with self.assertRaises(IllegalActionError):
+            ref.handle_move({'player': me, 'action': {'name': 'keep_card', 'target': 2}})
+
+    def test_drawing_from_empty_deck_is_illegal(self):
+        game, ais = create_engine_game(1, 2)
+        ref = Referee(game)
+        while game.step != Step.COINS_OR_BUILDING:
+            ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+        game.building_card_deck.cards[1:] = []
+        with self.assertRaises(IllegalActionError):
+            ref.undo(ref.apply({'player': game.cur_player_index, 'action': {'name': 'draw_cards'}}))
+        self.assertEqual(len(game.building_card_deck.cards), 1)
+
+    def test_no_moves_once_the_game_is_over(self):
+        game = play_engine_game(4, 3)
+        ref = Referee(game)
+        before = state_of(game)
+        # the next round was dealt before the game ended, so picking a role looks possible
+        self.assertTrue(game.round.role_draw_pile)
+        for role in game.round.role_draw_pile:
+            with self.assertRaises(IllegalActionError):
+                ref.handle_move({'player': game.cur_player_index, 'action': {'name': 'pick_role', 'target': role}})
+        self.assertEqual(state_of(game), before)
+
+    def test_role_seven_takes_what_is_left_of_the_deck(self):
+        game, ais = create_engine_game(3, 5)
+        ref = Referee(game)
+        while game.step != Step.COINS_OR_BUILDING:
+            ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+        me = game.get_cur_plyr()
+        me.cur_role = 7
+        game.round.mugged_role = None
+        game.building_card_deck.cards[1:] = []
+        gold, hand = me.gold, len(me.buildings_in_hand)
+        ref.handle_move({'player': me.position, 'action': {'name': 'take_gold'}})
+        self.assertEqual((me.gold, len(me.buildings_in_hand)), (gold + 2, hand + 1))
+        self.assertEqual(game.building_card_deck.cards, [])
+        self.assertEqual(game.step, Step.BUILD_BUILDING)
+
+    def test_rejected_moves_are_only_logged_at_debug(self):
+        game, ais = create_engine_game(1, 2)
+        ref = Referee(game)
+        other = (game.cur_player_index + 1) % 2
+        with self.assertNoLogs(level=logging.INFO):
+            with self.assertRaises(IllegalActionError):
+                ref.handle_move({'player': game.cur_player_index, 'action': {'name': 'keep_card', 'target': 0}})
+            with self.assertRaises(NotYourTurnError):
+                ref.handle_move({'player': other, 'action': {'name': 'build_building', 'target': 'skip'}})
+
+    def test_clone_is_independent(self):
+        game, ais = create_engine_game(8, 4)
+        ref = Referee(game)
+        for i in range(30):
+            ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+
+        copy = game.clone()
+        self.assertEqual(state_of(copy), state_of(game))
+        self.assertIs(copy.building_card_deck.card_map, game.building_card_deck.card_map)
+        self.assertIs(copy.round.game_state, copy)
+
+        before = state_of(game)
+        copy_ref = Referee(copy)
+        while copy.stage != Stage.GAME_OVER:
+            copy_ref.handle_move(ais[copy.get_cur_plyr().name].decide_what_to_do_native(copy))
+        self.assertEqual(state_of(game), before)
+
+    def test_clone_shares_history_until_it_is_added_to(self):
+        game, ais = create_engine_game(8, 4)
+        ref = Referee(game)
+        for i in range(120):
+            ref.perform_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+        journal = game.get_journal()
+        checkpoints = list(game.checkpoints)
+        self.assertTrue(checkpoints)
+
+        # a clone doesn't copy the history, however long it is
+        copy = game.clone()
+        self.assertIs(copy.journal, game.journal)
+        self.assertIs(copy.checkpoints, game.checkpoints)
+
+        # but neither game sees what the other adds to it
+        move = ais[copy.get_cur_plyr().name].decide_what_to_do_native(copy)
+        Referee(copy).perform_move(move)
+        self.assertEqual(game.get_journal(), journal)
+        self.assertEqual(copy.get_journal(), journal + [move])
+        ref.perform_move(move)
+        ref.perform_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+        self.assertEqual(copy.get_journal(), journal + [move])
+        self.assertEqual(copy.checkpoints, checkpoints)
+        self.assertEqual(len(game.get_journal()), len(journal) + 2)
+
+    def test_snapshot_and_restore(self):
+        game, ais = create_engine_game(9, 3)
+        ref = Referee(game)
+        snap = game.snapshot()
+        before = state_of(game)
+        round_before = game.round
+
+        for attempt in range(2):
+            for i in range(40):
+                ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+            self.assertNotEqual(state_of(game), before)
+            game.restore(snap)
+            self.assertEqual(state_of(game), before)
+            self.assertIs(game.round, round_before)
+
+    def test_apply_and_undo_every_legal_move(self):
+        for n in [2, 4, 6]:
+            game, ais = create_engine_game(12, n)
+            ref = Referee(game)
+            while game.stage != Stage.GAME_OVER:
+                before = state_of(game)
+                for move in ref.legal_moves(game.cur_player_index):
+                    record = ref.apply(move)
+                    ref.undo(record)
+                    self.assertEqual(state_of(game), before)
+                ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+
+    def test_illegal_apply_leaves_game_untouched(self):
+        game, ais = create_engine_game(2, 3)
+        ref = Referee(game)
+        before = state_of(game)
+        with self.assertRaises(IllegalActionError):
+            ref.apply({'player': game.cur_player_index, 'action': {'name': 'take_gold'}})
+        self.assertEqual(state_of(game), before)
+
+    def test_referee_is_reused_per_game(self):
+        game, ais = create_engine_game(14, 3)
+        self.assertIsNot(Referee.for_game(game), Referee.for_game(game))
+
+        game.id = 1000
+        ref = Referee.for_game(game)
+        self.assertIs(Referee.for_game(game), ref)
+
+        # the same game loaded again gets the same referee, bound to the new copy
+        copy = game.clone()
+        self.assertIs(Referee.for_game(copy), ref)
+        self.assertIs(ref.game_state, copy)
+        ref.handle_move(ais[copy.get_cur_plyr().name].decide_what_to_do_native(copy))
+        self.assertEqual(copy.round.num_roles_picked, 1)
+        self.assertEqual(game.round.num_roles_picked, 0)
+        self.assertNotIn('action_handlers', vars(ref))
+
+    def test_state_deltas(self):
+        game, ais = create_engine_game(15, 5)
+        ref = Referee(game)
+        clients = [util.from_json(ref.get_current_state_as_json_for_player(i)) for i in range(5)]
+        deltas = 0
+        while game.stage != Stage.GAME_OVER:
+            mover = game.cur_player_index
+            move = ais[game.get_cur_plyr().name].decide_what_to_do_native(game)
+            # the mover sends the version it has, and gets its own state back
+            since = clients[mover]['version']
+            reply = util.from_json(ref.perform_moves([move], since_version=since))
+            if 'delta_since' in reply:
+                self.assertEqual(reply['delta_since'], since)
+                clients[mover] = util.apply_delta(clients[mover], reply['changes'])
+                deltas += 1
+            else:
+                clients[mover] = reply
+            self.assertEqual(clients[mover], util.from_json(ref.get_current_state_as_json_for_player(mover)))
+
+            for i in range(5):
+                update = util.from_json(ref.get_state_update_as_json_for_player(i, clients[i]['version']))
+                if 'delta_since' in update:
+                    self.assertEqual(update['delta_since'], clients[i]['version'])
+                    clients[i] = util.apply_delta(clients[i], update['changes'])
+                else:
+                    clients[i] = update
+                self.assertEqual(clients[i], util.from_json(ref.get_current_state_as_json_for_player(i)))
+        self.assertTrue(deltas > 0)
+
+        # a version the referee didn't send gets the whole state
+        update = util.from_json(ref.get_state_update_as_json_for_player(0, -1))
+        self.assertEqual(update['version'], game.num_moves)
+
+    def test_deltas_are_only_from_a_state_sent_to_the_same_player(self):
+        game, ais = create_engine_game(15, 3)
+        ref = Referee(game)
+        old = util.from_json(ref.get_current_state_as_json_for_player(1))
+        ref.perform_moves([ais[game.get_cur_plyr().name].decide_what_to_do_native(game)])
+        # player 0 has been sent this version, player 1 only the one before
+        version = util.from_json(ref.get_current_state_as_json_for_player(0))['version']
+        self.assertNotEqual(old['version'], version)
+        update = util.from_json(ref.get_state_update_as_json_for_player(1, version))
+        self.assertNotIn('delta_since', update)
+        self.assertEqual(update, util.from_json(ref.get_current_state_as_json_for_player(1)))
+
+    def test_compact_state_uses_card_ids(self):
+        game, ais = create_engine_game(16, 4)
+        ref = Referee(game)
+        for i in range(60):
+            ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+
+        catalog = json.loads(game.building_card_deck.get_catalog().json)
+        cards = dict((c['id'], c) for c in catalog['cards'])
+        for i in range(4):
+            full = util.from_json(ref.get_current_state_as_json_for_player(i))
+            compact = util.from_json(ref.get_current_state_as_json_for_player(i, compact=True))
+            self.assertEqual(compact['catalog']['digest'], catalog['digest'])
+
+            # expanding the ids with the catalog gives back the full state's buildings
+            def names(buildings):
+                return [b['name'] for b in buildings]
+            for fp, cp in zip(full['game']['players'], compact['game']['players']):
+                self.assertEqual(names(fp['buildings_on_table']),
+                                 names(cards[c] for c in cp['buildings_on_table']))
+            for k in ['buildings_on_table', 'buildings_in_hand', 'buildings_buffer']:
+                self.assertEqual(names(full['me'][k]), names(cards[c] for c in compact['me'][k]))
+            self.assertTrue(len(ref.get_current_state_as_json_for_player(i, compact=True)) <
+                            len(ref.get_current_state_as_json_for_player(i)))
+
+    def test_sim_objects_have_no_dict(self):
+        p = SimPlayer("peter")
+        with self.assertRaises(AttributeError):
+            p.not_a_field = 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+from plyus import events
+from .test_engine import play_engine_game
+
+
+class TestEvents(unittest.TestCase):
+    def test_recorder_sees_game_events(self):
+        self.assertFalse(events.active)
+        with events.Recorder() as rec:
+            game = play_engine_game(3, 4)
+        self.assertFalse(events.active)
+
+        picked = [e for e in rec.events if isinstance(e, events.RolePicked)]
+        rounds = [e for e in rec.events if isinstance(e, events.RoundFinished)]
+        finished = [e for e in rec.events if isinstance(e, events.GameFinished)]
+
+        # one role per player per round
+        self.assertEqual(len(picked), 4 * len(rounds))
+        self.assertEqual(rounds[-1].round_num, game.round_num - 1)
+        self.assertEqual(len(finished), 1)
+        self.assertEqual(finished[0].winner, game.winner)
+
+        built = [e for e in rec.events if isinstance(e, events.BuildingBuilt)]
+        razed = [e for e in rec.events if isinstance(e, events.BuildingRazed)]
+        on_table = sum(len(p.buildings_on_table) for p in game.players)
+        self.assertEqual(len(built) - len(razed), on_table)
+
+    def test_recorder_filters_by_type(self):
+        with events.Recorder(events.RoundFinished) as rec:
+            play_engine_game(3, 4)
+        self.assertTrue(rec.events)
+        self.assertTrue(all(isinstance(e, events.RoundFinished) for e in rec.events))
+
+
+if __name__ == '__main__':
+    unittest.main()
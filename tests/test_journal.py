@@ -0,0 +1,99 @@
+import unittest
+import json
+from plyus.engine import Stage, SimGameState
+from plyus.referee import Referee
+from plyus import journal
+from .test_engine import create_engine_game, state_of
+
+
+class TestJournal(unittest.TestCase):
+    def test_rebuild_from_journal(self):
+        for n in [2, 4, 6]:
+            game, ais = create_engine_game(21, n)
+            ref = Referee(game)
+            while game.stage != Stage.GAME_OVER:
+                ref.perform_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+
+            moves = game.get_journal()
+            self.assertEqual(len(moves), game.num_moves)
+            self.assertEqual(moves[0]['action']['name'], 'start_game')
+
+            copy = journal.rebuild_game(game)
+            self.assertEqual(state_of(copy), state_of(game))
+            self.assertEqual(copy.get_journal(), moves)
+
+    def test_rebuild_part_way(self):
+        game, ais = create_engine_game(22, 3)
+        ref = Referee(game)
+        for i in range(25):
+            ref.perform_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+        self.assertEqual(state_of(journal.rebuild_game(game)), state_of(game))
+
+        # search moves aren't journaled
+        ref.undo(ref.apply(ref.legal_moves(game.cur_player_index)[0]))
+        self.assertEqual(game.num_moves, 26)
+
+    def test_game_at_any_move(self):
+        game, ais = create_engine_game(23, 4)
+        ref = Referee(game)
+        states = [state_of(game)]
+        while game.stage != Stage.GAME_OVER:
+            ref.perform_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+            states.append(state_of(game))
+
+        # a checkpoint at the start, at each new round, and every checkpoint_interval moves
+        seqs = [seq for seq, state in game.checkpoints]
+        self.assertEqual(seqs[0], 0)
+        self.assertTrue(len(seqs) > game.round_num)
+
+        for seq in range(0, game.num_moves, 7):
+            self.assertEqual(state_of(journal.game_at(game, seq)), states[seq])
+        last = game.num_moves - 1
+        self.assertEqual(state_of(journal.game_at(game, last)), state_of(game))
+
+        # the moves up to the checkpoint aren't read
+        cp_seq = game.nearest_checkpoint(last)[0]
+        game.journal[:cp_seq + 1] = [None] * (cp_seq + 1)
+        self.assertEqual(state_of(journal.game_at(game, last)), state_of(game))
+
+    def test_checkpoint_round_trip(self):
+        game, ais = create_engine_game(24, 5)
+        ref = Referee(game)
+        for i in range(40):
+            ref.perform_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+        copy = SimGameState.from_checkpoint(json.loads(json.dumps(game.checkpoint())), game.get_journal())
+        self.assertEqual(state_of(copy), state_of(game))
+
+    def test_perform_moves_is_all_or_nothing(self):
+        game, ais = create_engine_game(25, 3)
+        one_by_one = game.clone()
+        ref = Referee(game)
+        ref_one = Referee(one_by_one)
+
+        while game.stage != Stage.GAME_OVER:
+            # a whole turn's worth of moves, worked out on a copy
+            copy = game.clone()
+            copy_ref = Referee(copy)
+            turn = []
+            player = copy.cur_player_index
+            while copy.cur_player_index == player and copy.stage != Stage.GAME_OVER:
+                move = ais[copy.get_cur_plyr().name].decide_what_to_do_native(copy)
+                copy_ref.handle_move(move)
+                turn.append(move)
+
+            # tacking a bad move on the end rejects the whole turn
+            before = state_of(game)
+            with self.assertRaises(Exception):
+                ref.perform_moves(turn + [{'player': player, 'action': {'name': 'no_such_thing'}}])
+            self.assertEqual(state_of(game), before)
+
+            ref.perform_moves(turn)
+            for move in turn:
+                ref_one.perform_move(move)
+            self.assertEqual(state_of(game), state_of(one_by_one))
+            self.assertEqual(game.get_journal(), one_by_one.get_journal())
+            self.assertEqual(game.checkpoints, one_by_one.checkpoints)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+from plyus.engine import Stage, Phase
+from plyus.referee import Referee
+from plyus import observation
+from plyus.observation import OFFSETS, SEAT_SIZE, OBS_SIZE
+from .test_engine import create_engine_game
+
+
+def seat_row(obs, seat):
+    o = OFFSETS['seats'] + seat * SEAT_SIZE
+    return obs[o:o + SEAT_SIZE]
+
+
+class TestObservation(unittest.TestCase):
+    def test_matches_player_view(self):
+        for n in [2, 4, 6]:
+            game, ais = create_engine_game(31, n)
+            ref = Referee(game)
+            out = observation.new_observation()
+            catalog = game.building_card_deck.get_catalog()
+            while game.stage != Stage.GAME_OVER:
+                for i, me in enumerate(game.players):
+                    obs = game.encode_observation(i, out)
+                    self.assertIs(obs, out)
+                    self.assertEqual(obs.shape, (OBS_SIZE,))
+
+                    for p in game.players:
+                        row = seat_row(obs, (p.position - i) % n)
+                        self.assertEqual(row[1], p.gold)
+                        self.assertEqual(row[3], len(p.buildings_on_table))
+                        self.assertEqual(row[9], catalog.total_points(p.buildings_on_table))
+                    for seat in range(n, observation.MAX_PLAYERS):
+                        self.assertFalse(seat_row(obs, seat).any())
+
+                    o = OFFSETS['hand_colors']
+                    self.assertEqual(list(obs[o:o + 5]), list(catalog.color_counts(me.buildings_in_hand)))
+                    o = OFFSETS['role_draw_pile']
+                    sees_pile = i == game.cur_player_index and game.phase == Phase.PICK_ROLES
+                    self.assertEqual(obs[o:o + 8].any(), sees_pile and len(game.round.role_draw_pile) > 0)
+                    o = OFFSETS['cur_seat']
+                    self.assertEqual(obs[o + (game.cur_player_index - i) % n], 1)
+
+                ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+
+    def test_fresh_vector_when_no_out(self):
+        game, ais = create_engine_game(32, 3)
+        a = game.encode_observation(0)
+        b = game.encode_observation(0)
+        self.assertIsNot(a, b)
+        self.assertEqual(a.dtype, np.float32)
+        self.assertTrue(np.array_equal(a, b))
+        self.assertFalse(np.array_equal(a, game.encode_observation(1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
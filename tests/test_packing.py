@@ -0,0 +1,50 @@
+import unittest
+import json
+from plyus.engine import Stage, SimGameState, GameStateBase, PlayerBase, RoundBase
+from plyus.errors import FatalPlyusError
+from plyus.referee import Referee
+from plyus import packing, util
+from .test_engine import create_engine_game, state_of
+
+
+class TestPacking(unittest.TestCase):
+    def test_round_trip_every_move(self):
+        for n in [2, 6]:
+            game, ais = create_engine_game(31, n)
+            ref = Referee(game)
+            while True:
+                data = game.to_bytes()
+                self.assertEqual(data[:4], packing.MAGIC)
+                self.assertEqual(packing.unpack(data), json.loads(util.to_json(game.checkpoint())))
+                copy = SimGameState.from_bytes(data)
+                self.assertEqual(state_of(copy), state_of(game))
+                if game.stage == Stage.GAME_OVER:
+                    break
+                ref.handle_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+            self.assertTrue(len(data) < len(util.to_json(game.checkpoint())) / 3)
+
+    def test_json_fallback(self):
+        game, ais = create_engine_game(32, 3)
+        game.base_seed = 1 << 70
+        data = game.to_bytes()
+        self.assertEqual(json.loads(data.decode('utf-8')), json.loads(util.to_json(game.checkpoint())))
+        self.assertEqual(state_of(SimGameState.from_bytes(data)), state_of(game))
+
+    def test_format_has_the_engine_fields(self):
+        # if this fails, the engine's fields changed: freeze the new ones as
+        # the next version in packing.FIELDS and bump FORMAT_VERSION
+        fields = packing.FIELDS[packing.FORMAT_VERSION]
+        self.assertEqual(set(fields['game']), set(GameStateBase.scalar_fields))
+        self.assertEqual(set(fields['player']), set(PlayerBase.scalar_fields + PlayerBase.list_fields))
+        self.assertEqual(set(fields['round']), set(RoundBase.scalar_fields + RoundBase.list_fields))
+
+    def test_unknown_version(self):
+        game, ais = create_engine_game(33, 3)
+        data = bytearray(game.to_bytes())
+        data[4] = packing.FORMAT_VERSION + 1
+        with self.assertRaises(FatalPlyusError):
+            packing.unpack(bytes(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
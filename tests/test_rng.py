@@ -0,0 +1,50 @@
+import unittest
+from plyus.rng import CounterRandom, stream_key
+from .test_engine import create_engine_game
+
+
+class TestRng(unittest.TestCase):
+    def test_streams_are_repeatable(self):
+        a = CounterRandom(stream_key(42, 3))
+        b = CounterRandom(stream_key(42, 3))
+        self.assertEqual([a.next64() for _ in range(5)], [b.next64() for _ in range(5)])
+        self.assertEqual(a.counter, 5)
+
+        # picking up a stream part way through gives the same numbers
+        c = CounterRandom(stream_key(42, 3), 2)
+        b = CounterRandom(stream_key(42, 3))
+        b.next64(), b.next64()
+        self.assertEqual(c.random(), b.random())
+
+        self.assertNotEqual(stream_key(42, 3), stream_key(42, 4))
+        self.assertNotEqual(stream_key(42, 'roles'), stream_key(42, 'deck'))
+        self.assertNotEqual(a.derive('x').next64(), a.derive('y').next64())
+
+    def test_shuffle_and_randbelow(self):
+        r = CounterRandom(stream_key(7))
+        xs = list(range(60))
+        r.shuffle(xs)
+        self.assertEqual(sorted(xs), list(range(60)))
+        self.assertNotEqual(xs, list(range(60)))
+
+        counts = [0] * 6
+        for _ in range(6000):
+            counts[r.randbelow(6)] += 1
+        for c in counts:
+            self.assertTrue(800 < c < 1200)
+
+    def test_game_counter_is_saved(self):
+        g, ais = create_engine_game(42, 3)
+        self.assertEqual(g.round_num, 0)
+        self.assertTrue(g.rng_counter > 0)
+
+        state = g.snapshot()
+        counter = g.rng_counter
+        x = g.get_random_gen().random()
+        self.assertEqual(g.rng_counter, counter + 1)
+        g.restore(state)
+        self.assertEqual(g.get_random_gen().random(), x)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+import logging
+
+from plyus import simulate
+
+
+class TestSimulate(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.WARNING)
+
+    def test_tournament_is_reproducible(self):
+        jobs = simulate.make_jobs(range(6), [2, 4])
+        in_process = list(simulate.run_tournament(jobs, processes=1))
+        in_pool = list(simulate.run_tournament(jobs, processes=2, chunksize=2))
+        self.assertEqual(in_process, in_pool)
+        self.assertEqual([(r['seed'], r['num_players']) for r in in_pool], [(j[0], j[1]) for j in jobs])
+
+    def test_summary(self):
+        results = list(simulate.run_tournament(simulate.make_jobs(range(10), [3]), processes=1))
+        summary = simulate.summarize(results)[3]
+        self.assertEqual(summary['games'], 10)
+        self.assertEqual(summary['finished'], 10)
+        self.assertEqual(sum(summary['winner_seats']), 10)
+        self.assertEqual(summary['total_rounds'], sum(r['rounds'] for r in results))
+        self.assertEqual(sum(count for lo, hi, count in summary['points_histogram']), 30)
+        self.assertIn("3 players: 10 games, 10 finished", simulate.format_summary({3: summary}))
+
+
+if __name__ == '__main__':
+    unittest.main()
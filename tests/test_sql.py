@@ -1,22 +1,51 @@
 import unittest
 import logging
+import json
 
 import plyus
 import config
+from sqlalchemy import event
+from sqlalchemy.orm.exc import StaleDataError
 
-plyus.create_flask_app(config.test)
+if plyus.app is None:
+    plyus.create_flask_app(config.test)
 
 from plyus.player import Player
 from plyus.misc import BuildingDeck
-from plyus.gamestate import GameState
+from plyus.gamestate import GameState, load_game_at
 from plyus.user import User
 from plyus.proto import ProtoGame, ProtoPlayer
+from plyus.referee import Referee
+from plyus.engine import SimGameState, Stage
+from plyus.moverecord import MoveRecord
+from plyus.gamerecord import GameRecord
+from plyus.errors import FatalPlyusError
+from plyus.simpleai import SimpleAIPlayer
+from plyus import journal
+from plyus import mutable
+from .test_engine import state_of, create_engine_game
 
 
 def create_session_maker():
     return plyus.db.create_scoped_session
 
 
+class StatementCounter(object):
+    """ collects the sql statements run while it is in use """
+    def __enter__(self):
+        self.statements = []
+        self.sql = []
+        event.listen(plyus.db.engine, 'before_cursor_execute', self.before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(plyus.db.engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement.split(None, 1)[0])
+        self.sql.append(statement)
+
+
 class TestSQL(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -35,6 +64,9 @@ class TestSQL(unittest.TestCase):
 
         p1.gold = 32
         p1.take_cards(g.building_card_deck.cards)
+        picker = g.cur_player_index
+        pick = g.round.role_draw_pile[0]
+        Referee(g).handle_move({'player': picker, 'action': {'name': 'pick_role', 'target': pick}})
 
         session_maker = create_session_maker()
         session = session_maker()
@@ -48,9 +80,10 @@ class TestSQL(unittest.TestCase):
 
         g_loaded = new_session.query(GameState).filter(GameState.id == gs_id).one()
 
-        g_loaded.get_random_gen()
-
         self.assertEqual(g_loaded.base_seed, 42)
+        # the loaded game carries on from the same place in its random stream
+        self.assertEqual(g_loaded.rng_counter, g.rng_counter)
+        self.assertEqual(g_loaded.get_random_gen().random(), g.get_random_gen().random())
 
         p1_loaded = session.query(Player).filter(Player.name == 'peter', Player.gamestate_id == gs_id).one()
         p1_bad_copy = Player("peter")
@@ -58,6 +91,265 @@ class TestSQL(unittest.TestCase):
         self.assertNotEqual(p1_loaded, p1_bad_copy)
         self.assertEqual(len(p1_loaded.buildings_buffer), 2)
 
+        r = g_loaded.round
+        self.assertEqual(r.num_roles_picked, 1)
+        self.assertEqual(r.player_for_role(pick), picker)
+
+    def test_move_journal(self):
+        names = ["peter", "manan", "rachel"]
+        players = [Player(n) for n in names]
+        ais = dict((n, SimpleAIPlayer(n)) for n in names)
+        g = GameState(7, players[0], 3)
+        for p in players[1:]:
+            g.add_player(p)
+        g.start_game()
+
+        session = create_session_maker()()
+        session.add(g)
+        session.commit()
+        ref = Referee(g)
+        for i in range(30):
+            ref.perform_move(ais[g.get_cur_plyr().name].decide_what_to_do_native(g))
+            session.commit()
+        gs_id = g.id
+        session.close()
+
+        new_session = create_session_maker()()
+        g_loaded = new_session.query(GameState).filter(GameState.id == gs_id).one()
+        self.assertEqual(g_loaded.num_moves, 31)
+        self.assertEqual(new_session.query(MoveRecord).filter(MoveRecord.game_state_id == gs_id).count(), 31)
+
+        rebuilt = journal.rebuild_game(g_loaded)
+        self.assertEqual(state_of(rebuilt), state_of(SimGameState.from_model(g_loaded)))
+
+        self.assertEqual(state_of(load_game_at(gs_id, 30)), state_of(rebuilt))
+        self.assertEqual(state_of(load_game_at(gs_id, 12)), state_of(journal.game_at(rebuilt, 12)))
+
+    def test_moves_only_write_what_they_change(self):
+        names = ["peter", "manan", "rachel"]
+        players = [Player(n) for n in names]
+        ais = dict((n, SimpleAIPlayer(n)) for n in names)
+        g = GameState(9, players[0], 3)
+        for p in players[1:]:
+            g.add_player(p)
+        g.start_game()
+        session = create_session_maker()()
+        session.add(g)
+        session.commit()
+        ref = Referee(g)
+        for i in range(40):
+            cards = list(g.building_card_deck.cards)
+            gold = [p.gold for p in g.players]
+            with StatementCounter() as counter:
+                ref.perform_moves([ais[g.get_cur_plyr().name].decide_what_to_do_native(g)])
+                session.commit()
+            updates = [sql for sql in counter.sql if sql.startswith('UPDATE')]
+            # one small row for the journal, and updates of just the columns that changed
+            self.assertEqual(len([sql for sql in counter.sql if sql.startswith('INSERT INTO moverecords')]), 1)
+            self.assertEqual(any(sql.startswith('UPDATE buildingdecks') for sql in updates),
+                             g.building_card_deck.cards != cards)
+            self.assertEqual(any('gold=' in sql for sql in updates), [p.gold for p in g.players] != gold)
+        session.close()
+
+    def test_perform_moves_commits_once(self):
+        names = ["peter", "manan"]
+        players = [Player(n) for n in names]
+        ais = dict((n, SimpleAIPlayer(n)) for n in names)
+        g = GameState(8, players[0], 2)
+        g.add_player(players[1])
+        g.start_game()
+        session = create_session_maker()()
+        session.add(g)
+        session.commit()
+
+        for turn_num in range(10):
+            copy = SimGameState.from_model(g)
+            copy_ref = Referee(copy)
+            turn = []
+            while copy.cur_player_index == g.cur_player_index:
+                move = ais[copy.get_cur_plyr().name].decide_what_to_do_native(copy)
+                copy_ref.perform_move(move)
+                turn.append(move)
+            Referee(g).perform_moves(turn)
+            session.commit()
+            self.assertEqual(state_of(SimGameState.from_model(g)), state_of(copy))
+
+        self.assertEqual(state_of(journal.rebuild_game(g)), state_of(SimGameState.from_model(g)))
+        session.close()
+
+    def test_int_array_columns(self):
+        p1 = Player("peter")
+        g = GameState(9, p1, 2)
+        g.add_player(Player("manan"))
+        g.start_game()
+        session = create_session_maker()()
+        session.add(g)
+        session.commit()
+        p_id = p1.id
+
+        # changes in place are saved, and stored packed
+        p1.buildings_in_hand.append(5)
+        session.commit()
+        hand = list(p1.buildings_in_hand)
+        raw = session.execute("SELECT buildings_in_hand FROM players WHERE id = :id", {'id': p_id}).scalar()
+        self.assertIsInstance(raw, bytes)
+        self.assertEqual(len(raw), 2 * len(hand))
+
+        # rows written as json are still read, and repack() writes them packed
+        session.execute("UPDATE players SET buildings_in_hand = :hand WHERE id = :id",
+                        {'hand': json.dumps(hand), 'id': p_id})
+        session.commit()
+        session.close()
+
+        session = create_session_maker()()
+        self.assertEqual(session.query(Player).get(p_id).buildings_in_hand, hand)
+        mutable.repack(session, Player)
+        session.commit()
+        raw = session.execute("SELECT buildings_in_hand FROM players WHERE id = :id", {'id': p_id}).scalar()
+        self.assertIsInstance(raw, bytes)
+        session.close()
+
+    def test_game_record(self):
+        game, ais = create_engine_game(17, 4)
+        session = create_session_maker()()
+        record = GameRecord(game)
+        session.add(record)
+        session.commit()
+        record_id = record.id
+        session.close()
+
+        ref = Referee(game)
+        while game.stage != Stage.GAME_OVER:
+            move = ais[game.get_cur_plyr().name].decide_what_to_do_native(game)
+            checkpoints = len(game.checkpoints)
+            ref.perform_move(move)
+
+            session = create_session_maker()()
+            with StatementCounter() as counter:
+                record = session.query(GameRecord).get(record_id)
+                record.perform_moves([move])
+                session.commit()
+            inserts = ['INSERT'] * (1 + len(game.checkpoints) - checkpoints)
+            self.assertEqual(counter.statements, ['SELECT', 'UPDATE'] + inserts)
+            session.close()
+
+        session = create_session_maker()()
+        record = session.query(GameRecord).get(record_id)
+        self.assertEqual(state_of(record.load()), state_of(game))
+        self.assertEqual(record.get_journal(), game.get_journal())
+        # the checkpoints are kept too, so the record can go back in time
+        self.assertEqual([list(record.nearest_checkpoint(seq)) for seq, state in game.checkpoints],
+                         json.loads(json.dumps(game.checkpoints)))
+        for seq in (0, 37, game.num_moves // 2, game.num_moves - 1):
+            self.assertEqual(state_of(record.game_at(seq)), state_of(journal.game_at(game, seq)))
+        self.assertEqual(record.version, game.num_moves)
+        self.assertEqual((record.stage, record.winner), (Stage.GAME_OVER, game.winner))
+        session.close()
+
+    def test_game_record_without_checkpoints(self):
+        game, ais = create_engine_game(19, 3)
+        ref = Referee(game)
+        for i in range(30):
+            ref.perform_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+        # a copy with the journal but none of the checkpoints
+        copy = SimGameState.from_checkpoint(game.checkpoint(), game.get_journal())
+        session = create_session_maker()()
+        record = GameRecord(copy)
+        session.add(record)
+        session.commit()
+        self.assertIsNone(record.nearest_checkpoint(30))
+        self.assertEqual(state_of(record.game_at(12)), state_of(journal.game_at(game, 12)))
+        session.close()
+
+    def test_game_record_concurrent_moves(self):
+        game, ais = create_engine_game(18, 3)
+        session = create_session_maker()()
+        record = GameRecord(game)
+        session.add(record)
+        session.commit()
+        record_id = record.id
+        session.close()
+
+        move = ais[game.get_cur_plyr().name].decide_what_to_do_native(game)
+        s1 = create_session_maker()()
+        s2 = create_session_maker()()
+        s1.query(GameRecord).get(record_id).perform_moves([move])
+        s2.query(GameRecord).get(record_id).perform_moves([move])
+        s1.commit()
+        with self.assertRaises(StaleDataError):
+            s2.commit()
+        s2.rollback()
+        s1.close()
+        s2.close()
+
+    def test_state_sent_is_only_kept_once_committed(self):
+        game, ais = create_engine_game(18, 3)
+        session = create_session_maker()()
+        record = GameRecord(game)
+        session.add(record)
+        session.commit()
+        record_id = record.id
+        session.close()
+
+        moves = Referee(game).legal_moves(game.cur_player_index)
+        s1 = create_session_maker()()
+        s2 = create_session_maker()()
+        r1 = s1.query(GameRecord).get(record_id)
+        r2 = s2.query(GameRecord).get(record_id)
+        r1.perform_moves([moves[0]], commit=s1.commit)
+        with self.assertRaises(StaleDataError):
+            r2.perform_moves([moves[1]], commit=s2.commit)
+        s2.rollback()
+        # the referee only remembers what it sent for the move that was saved
+        ref = Referee.for_game(r1.load())
+        player = moves[0]['player']
+        state = ref.get_current_state_for_player(player)
+        self.assertEqual(ref.sent_states[(player, state['version'], False)], state)
+        self.assertEqual(len(ref.sent_states), 1)
+        s1.close()
+        s2.close()
+
+    def test_loading_profiles(self):
+        names = ["peter", "manan", "rachel"]
+        players = [Player(n) for n in names]
+        ais = dict((n, SimpleAIPlayer(n)) for n in names)
+        g = GameState(10, players[0], 3)
+        for p in players[1:]:
+            g.add_player(p)
+        g.start_game()
+        session = create_session_maker()()
+        session.add(g)
+        session.commit()
+        gs_id = g.id
+        session.close()
+
+        def selects(counter):
+            return counter.statements.count('SELECT')
+
+        # play: load, send the player their state and make a move
+        for i in range(10):
+            session = create_session_maker()()
+            with StatementCounter() as counter:
+                game = GameState.query_for('play', session).filter(GameState.id == gs_id).one()
+                ref = Referee.for_game(game)
+                ref.get_current_state_as_json_for_player(game.cur_player_index)
+                ref.perform_move(ais[game.get_cur_plyr().name].decide_what_to_do_native(game))
+                session.flush()
+            self.assertEqual(selects(counter), 2)
+            session.commit()
+            session.close()
+
+        # and showing the table
+        session = create_session_maker()()
+        with StatementCounter() as counter:
+            game = GameState.query_for('play', session).filter(GameState.id == gs_id).one()
+            game.to_dict_for_public()
+        self.assertEqual(selects(counter), 2)
+        session.close()
+
+        with self.assertRaises(FatalPlyusError):
+            GameState.query_for('everything')
+
     def test_building_deck_reconstruction(self):
         """ BuildingDecks have some transient fields like full_cards and card_map.  this test
             ensures that these fields get properly recreated after a buildingdeck is loaded from the db"""
@@ -57,6 +57,53 @@ class TestAllTheThings(unittest.TestCase):
         for k in ['prop1', 'prop2', 'prop3']:
             self.assertEqual(f.__dict__[k], f2[k])
 
+    def test_registered_types_round_trip(self):
+        class Bar(object):
+            def __init__(self, a, b=None):
+                self.a = a
+                self.b = b
+
+        # Bar is only registered for this test, so put the registry back afterwards
+        registries = (util._codecs_by_tag, util._codecs_by_class, util._codecs_by_name)
+        saved = [dict(r) for r in registries]
+        try:
+            util.register_type('test_bar', Bar, ('a', 'b'))
+            s = util.to_json([Bar(1, 'x')])
+            self.assertEqual(s, '[{"__t": "test_bar", "a": 1, "b": "x"}]')
+            bar = json.loads(s, object_hook=util.dict_to_object)[0]
+            self.assertIsInstance(bar, Bar)
+            self.assertEqual((bar.a, bar.b), (1, 'x'))
+
+            # rows written before type tags are found by class name
+            old = json.loads('{"__class__": "Bar", "__module__": "nowhere", "a": 2}',
+                             object_hook=util.dict_to_object)
+            self.assertIsInstance(old, Bar)
+            self.assertEqual(old.a, 2)
+        finally:
+            for r, before in zip(registries, saved):
+                r.clear()
+                r.update(before)
+        self.assertNotIn('test_bar', util._codecs_by_tag)
+
+    def test_unregistered_types_are_left_as_dicts(self):
+        s = '{"__class__": "Popen", "__module__": "subprocess", "args": "ls"}'
+        self.assertEqual(json.loads(s, object_hook=util.dict_to_object), json.loads(s))
+        self.assertEqual(json.loads('{"__t": "nope", "a": 1}', object_hook=util.dict_to_object),
+                         {"__t": "nope", "a": 1})
+
+    def test_dict_delta(self):
+        old = {'a': 1, 'b': {'c': [1, 2], 'd': 'x'}, 'players': [{'gold': 2}, {'gold': 3}], 'gone': 1}
+        new = {'a': 1, 'b': {'c': [1, 2, 3], 'd': 'x'}, 'players': [{'gold': 2}, {'gold': 5}], 'new': [7]}
+        delta = util.dict_delta(old, new)
+        self.assertEqual(delta, {'b': {'c': [1, 2, 3]},
+                                 'players': {util.LIST_ITEMS: {'1': {'gold': 5}}},
+                                 'new': [7],
+                                 util.REMOVED: ['gone']})
+        self.assertEqual(util.apply_delta(old, delta), new)
+        # deltas survive a trip through json
+        self.assertEqual(util.apply_delta(old, json.loads(json.dumps(delta))), new)
+        self.assertEqual(util.dict_delta(new, new), {})
+
     def test_flatten(self):
         xss = [[1], [2, 3], [], [4, 5, 6]]
         xs = util.flatten(xss)
@@ -1,14 +1,106 @@
 import unittest
 import logging
-from plyus import app
+import json
+
+import plyus
+import config
+
+if plyus.app is None:
+    plyus.create_flask_app(config.test)
+
+from plyus import util
+from plyus.player import Player
+from plyus.gamestate import GameState
+from plyus.user import User
+from plyus.proto import ProtoGame, ProtoPlayer
+from plyus.gamerecord import GameRecord
+from plyus.engine import Stage
+from plyus.simpleai import SimpleAIPlayer
+from plyus import journal
+from plyus.catalog import catalog_for
+from .test_engine import create_engine_game, state_of
+
+
+def log_in(client, name):
+    """ logs client in as the user name, making the user if need be, and returns its id """
+    client.get('/fakelogin/%s' % name)
+    return User.query.filter_by(email=name).one().id
+
+
+def create_web_game(seed, names):
+    """ a started GameState with a seat for each of the users names, and the
+        ProtoGame linking them.  Returns the game's id. """
+    session = plyus.db.session
+    user_ids = []
+    for name in names:
+        user = User.query.filter_by(email=name).first()
+        if user is None:
+            user = User(nickname=name, email=name)
+            session.add(user)
+            session.flush()
+        user_ids.append(user.id)
+
+    players = [Player(name) for name in names]
+    game = GameState(seed, players[0], len(names), 'decks/deck_test_60.csv')
+    for p in players[1:]:
+        game.add_player(p)
+    game.start_game()
+    session.add(game)
+    session.flush()
+
+    owner = User.query.get(user_ids[0])
+    proto_game = ProtoGame(len(names), owner)
+    proto_game.real_game = game.id
+    proto_game.status = ProtoGame.PLAYING
+    proto_game.proto_players[0].player = players[0]
+    for user_id, player in zip(user_ids[1:], players[1:]):
+        pp = ProtoPlayer(User.query.get(user_id))
+        pp.player = player
+        proto_game.proto_players.append(pp)
+    session.add(proto_game)
+    session.commit()
+    game_id = game.id
+    session.remove()
+    return game_id
+
+
+def create_record_game(seed, num_players):
+    """ a GameRecord for a started game, with a user for each seat named after
+        the seat.  Returns the record's id and the game. """
+    session = plyus.db.session
+    game, ais = create_engine_game(seed, num_players)
+    user_ids = []
+    for p in game.players:
+        user = User.query.filter_by(email=p.name).first()
+        if user is None:
+            user = User(nickname=p.name, email=p.name)
+            session.add(user)
+            session.flush()
+        user_ids.append(user.id)
+    record = GameRecord(game, user_ids)
+    session.add(record)
+    session.commit()
+    record_id = record.id
+    session.remove()
+    return record_id, game
+
+
+def post_moves(client, gid, moves, **args):
+    query = '&'.join('%s=%s' % kv for kv in args.items())
+    return client.post('/game/%s/moves?%s' % (gid, query), data=json.dumps(moves),
+                       content_type='application/json')
 
 
 class WebAppTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        plyus.db.create_all()
+
     def setUp(self):
-        self.app = app.test_client()
+        self.app = plyus.app.test_client()
 
     def tearDown(self):
-        pass
+        plyus.db.session.remove()
 
     def test_empty(self):
         rv = self.app.get('/')
@@ -16,4 +108,117 @@ class WebAppTestCase(unittest.TestCase):
     def test_list_games(self):
         rv = self.app.get('/games')
         assert rv.status_code == 200
-        logging.warn("just did games")
\ No newline at end of file
+        logging.warn("just did games")
+
+    def test_card_catalog(self):
+        catalog = catalog_for('decks/deck_test_60.csv')
+        rv = self.app.get('/catalog/deck_test_60')
+        self.assertEqual(rv.status_code, 302)
+        url = '/catalog/deck_test_60/%s' % catalog.digest
+        self.assertTrue(rv.headers['Location'].endswith(url))
+
+        rv = self.app.get(url)
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.mimetype, 'application/json')
+        self.assertEqual(json.loads(rv.data.decode()), json.loads(catalog.json))
+        self.assertEqual(rv.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(rv.headers['ETag'], '"%s"' % catalog.digest)
+
+    def test_unknown_card_catalog(self):
+        self.assertEqual(self.app.get('/catalog/deck_test_60/0123abcd').status_code, 404)
+        digest = catalog_for('decks/deck_test_60.csv').digest
+        self.assertEqual(self.app.get('/catalog/no_such_deck/%s' % digest).status_code, 404)
+        self.assertEqual(self.app.get('/catalog/no_such_deck').status_code, 404)
+        self.assertEqual(self.app.get('/catalog/..%2fconfig').status_code, 404)
+
+    def test_moves_are_only_taken_for_your_own_seat(self):
+        names = ['web_alice', 'web_bob', 'web_carol']
+        gid = create_web_game(5, names)
+        game = GameState.query.get(gid)
+        # starting the game deals out the seats, so go by the names in them
+        seats = [p.name for p in game.players]
+        cur = game.cur_player_index
+        move = SimpleAIPlayer(seats[cur]).decide_what_to_do_native(game)
+        plyus.db.session.remove()
+
+        # someone else's login can't move for the current seat
+        log_in(self.app, seats[(cur + 1) % 3])
+        rv = post_moves(self.app, gid, [move])
+        self.assertEqual(rv.status_code, 403)
+        self.assertEqual(GameState.query.get(gid).num_moves, 1)
+        plyus.db.session.remove()
+
+        # nor can a user who isn't playing
+        log_in(self.app, 'web_mallory')
+        self.assertEqual(post_moves(self.app, gid, [move]).status_code, 403)
+
+        log_in(self.app, seats[cur])
+        rv = post_moves(self.app, gid, [move])
+        self.assertEqual(rv.status_code, 200)
+        # the reply is the mover's own view of the game
+        reply = util.from_json(rv.data.decode())
+        self.assertEqual(reply['me']['name'], seats[cur])
+        self.assertEqual(reply['version'], 2)
+        self.assertEqual(GameState.query.get(gid).num_moves, 2)
+
+
+class RecordWebAppTestCase(unittest.TestCase):
+    """ the app keeping games as GameRecords """
+    @classmethod
+    def setUpClass(cls):
+        plyus.db.create_all()
+
+    def setUp(self):
+        self.app = plyus.app.test_client()
+        plyus.app.config['GAME_STORAGE'] = 'record'
+
+    def tearDown(self):
+        del plyus.app.config['GAME_STORAGE']
+        plyus.db.session.remove()
+
+    def test_moves_are_only_taken_for_your_own_seat(self):
+        gid, game = create_record_game(6, 3)
+        cur = game.cur_player_index
+        move = SimpleAIPlayer(game.players[cur].name).decide_what_to_do_native(game)
+
+        log_in(self.app, game.players[(cur + 1) % 3].name)
+        self.assertEqual(post_moves(self.app, gid, [move]).status_code, 403)
+        log_in(self.app, 'web_mallory')
+        self.assertEqual(post_moves(self.app, gid, [move]).status_code, 403)
+        self.assertEqual(GameRecord.query.get(gid).num_moves, 1)
+        plyus.db.session.remove()
+
+        log_in(self.app, game.players[cur].name)
+        rv = post_moves(self.app, gid, [move])
+        self.assertEqual(rv.status_code, 200)
+        reply = util.from_json(rv.data.decode())
+        self.assertEqual(reply['me']['name'], game.players[cur].name)
+        self.assertEqual(reply['version'], 2)
+
+    def test_play_a_game(self):
+        gid, game = create_record_game(7, 3)
+        ais = dict((p.name, SimpleAIPlayer(p.name)) for p in game.players)
+        versions = {}
+        while game.stage != Stage.GAME_OVER:
+            player = game.get_cur_plyr()
+            move = ais[player.name].decide_what_to_do_native(game)
+            journal.replay(game, [move])
+            log_in(self.app, player.name)
+            rv = post_moves(self.app, gid, [move], since=versions.get(player.position, -1), compact=1)
+            self.assertEqual(rv.status_code, 200)
+            versions[player.position] = game.num_moves
+        record = GameRecord.query.get(gid)
+        self.assertEqual(state_of(record.load()), state_of(game))
+        self.assertEqual(state_of(record.game_at(40)), state_of(journal.game_at(game, 40)))
+        plyus.db.session.remove()
+
+        # no more moves once the game is over
+        rv = post_moves(self.app, gid, [{'player': player.position, 'action': {'name': 'take_gold'}}])
+        self.assertEqual(rv.status_code, 400)
+
+        rv = self.app.get('/game/%s' % gid)
+        self.assertEqual(rv.status_code, 200)
+
+    def test_unknown_game(self):
+        log_in(self.app, 'web_alice')
+        self.assertEqual(post_moves(self.app, 12345, []).status_code, 404)
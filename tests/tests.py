@@ -13,7 +13,9 @@ from plyus.referee import Referee
 from plyus.round import Round
 from plyus.gamestate import GameState
 from plyus.misc import Stage, Building, BuildingDeck
-from .simpleai import SimpleAIPlayer
+from plyus.engine import SimGameState
+from plyus.simpleai import SimpleAIPlayer
+from .test_engine import play_engine_game
 
 
 class TestAllTheThings(unittest.TestCase):
@@ -106,6 +108,49 @@ class TestAllTheThings(unittest.TestCase):
             total_rounds += test_method(a, 6)
         logging.warning("total_rounds: %s" % total_rounds)
 
+    def test_engine_plays_same_game_as_models(self):
+        for seed in range(3):
+            for n in [2, 4, 5]:
+                engine_game = play_engine_game(seed, n)
+                self.assertEqual(engine_game.round_num, self.do_ai_test(seed, n))
+
+    def test_engine_round_trip(self):
+        players = [fake_player("Peter"), fake_player("Manan"), fake_player("Andy")]
+        game = GameState(42, players[0], 3, deck_template="decks/deck_test_30.csv")
+        game.add_player(players[1])
+        game.add_player(players[2])
+        game.start_game()
+
+        sim = SimGameState.from_model(game)
+        self.assertEqual(sim.building_card_deck.cards, game.building_card_deck.cards)
+        self.assertEqual([p.name for p in sim.players], [p.name for p in game.players])
+
+        ref = Referee(sim)
+        pick = sim.round.role_draw_pile[0]
+        ref.handle_move({'player': sim.cur_player_index, 'action': {'name': 'pick_role', 'target': pick}})
+        sim.copy_to_model(game)
+
+        self.assertEqual(game.cur_player_index, sim.cur_player_index)
+        self.assertNotIn(pick, game.round.role_draw_pile)
+        self.assertEqual(game.players[0].roles, [pick])
+
+    def test_copy_to_unstarted_model(self):
+        players = [fake_player("Peter"), fake_player("Manan"), fake_player("Andy")]
+        game = GameState(43, players[0], 3, deck_template="decks/deck_test_30.csv")
+        game.add_player(players[1])
+        game.add_player(players[2])
+
+        sim = SimGameState.from_model(game)
+        sim.start_game()
+        sim.copy_to_model(game)
+
+        # making the model's round mustn't move it along its random stream or clear roles
+        self.assertEqual(game.rng_counter, sim.rng_counter)
+        self.assertEqual(game.round.role_draw_pile, sim.round.role_draw_pile)
+        self.assertEqual([(p.name, p.position, p.buildings_in_hand) for p in game.players],
+                         [(p.name, p.position, p.buildings_in_hand) for p in sim.players])
+        self.assertEqual(game.get_random_gen().random(), sim.get_random_gen().random())
+
     def do_ai_test(self, seed, num_players):
         names = ['PeterAI', 'MananAI', 'AndyAI', 'MarkAI', 'KevinAI', 'RyanAI', 'TabithaAI']
         ais = {}